@@ -4,6 +4,8 @@ import json
 import uuid
 import base64
 import logging
+import random
+from collections import deque
 from typing import Optional
 
 logging.basicConfig(level=logging.INFO)
@@ -12,7 +14,8 @@ logger = logging.getLogger(__name__)
 class HardwareDeviceClient:
     """硬件设备客户端"""
     
-    def __init__(self, server_url: str, username: str, password: str, device_id: str = None, device_name: str = ""):
+    def __init__(self, server_url: str, username: str, password: str, device_id: str = None, device_name: str = "",
+                 compact_start: bool = True):
         self.server_url = server_url
         self.username = username
         self.password = password
@@ -24,10 +27,25 @@ class HardwareDeviceClient:
         self.token = None
 
         
-        # 会话参数
+        # 会话参数（compact_start 时由服务器生成会话引导事件并返回名称）
+        self.compact_start = compact_start
         self.prompt_name = None
         self.audio_content_name = None
         
+        # 待播放的音频片段（打断时清空）
+        self.playback_buffer = deque(maxlen=500)
+        
+        # 服务器繁忙时的重试状态
+        self.busy_retries = 0
+        self.retry_task = None
+        
+        # 被服务器限流的音频在此时间之前不再发送
+        self.audio_paused_until = 0.0
+        
+        # 服务器节点下线时的重连状态
+        self.reconnect_task = None
+        self.resume_session = False
+        
     async def connect(self):
         """连接到服务器"""
         try:
@@ -108,6 +126,9 @@ class HardwareDeviceClient:
             self.authenticated = True
             self.token = data.get("token")
             logger.info("Device authentication successful")
+            if self.resume_session:
+                self.resume_session = False
+                asyncio.create_task(self.start_session())
             return
         
         if data.get("type") == "auth_failed":
@@ -131,12 +152,62 @@ class HardwareDeviceClient:
             logger.info(f"Password change result: {message}")
             return
         
+        if data.get("type") == "busy":
+            # 服务器过载：按 retry_after 加随机抖动和指数退避后重新开始会话
+            self.session_active = False
+            self.busy_retries += 1
+            retry_after = data.get("retry_after", 5)
+            delay = retry_after * min(2 ** (self.busy_retries - 1), 8) * random.uniform(1.0, 1.5)
+            logger.warning(f"Server busy ({data.get('reason')}), retrying session in {delay:.1f}s")
+            if self.retry_task is None or self.retry_task.done():
+                self.retry_task = asyncio.create_task(self._retry_session(delay))
+            return
+        
+        if data.get("type") == "session_started":
+            self.prompt_name = data.get("promptName")
+            self.audio_content_name = data.get("audioContentName")
+            logger.info("Session bootstrap sent by server")
+            return
+        
+        if data.get("type") == "throttled":
+            # 被限流：在 retry_after 内暂停发送该类消息
+            if data.get("message_class") == "audio":
+                self.audio_paused_until = asyncio.get_running_loop().time() + data.get("retry_after", 0.1)
+            logger.warning(f"Throttled ({data.get('message_class')}), retry after {data.get('retry_after')}s")
+            return
+        
+        if data.get("type") == "reconnect_elsewhere":
+            # 服务器节点正在下线：按服务器给出的随机延迟重连（由负载均衡分配到其他节点）
+            self.resume_session = self.resume_session or self.session_active
+            self.session_active = False
+            self.authenticated = False
+            delay = data.get("retry_after", 0)
+            logger.warning(f"Server draining, reconnecting in {delay:.1f}s")
+            if self.reconnect_task is None or self.reconnect_task.done():
+                self.reconnect_task = asyncio.create_task(self._reconnect(delay))
+            return
+        
+        if data.get("type") == "connection_replaced":
+            # 同一 device_id 的新连接接管了会话，本连接不再重连
+            self.session_active = False
+            self.authenticated = False
+            logger.warning("Connection replaced by a newer connection for this device")
+            return
+        
+        if data.get("type") == "audio_flush":
+            # 用户打断，清空本地播放缓冲
+            self.playback_buffer.clear()
+            logger.info("Playback buffer flushed (barge-in)")
+            return
+        
         if "event" in data:
+            self.busy_retries = 0
             event_type = list(data["event"].keys())[0]
             
             if event_type == "audioOutput":
                 # 播放音频
                 audio_data = data["event"]["audioOutput"]["content"]
+                self.playback_buffer.append(audio_data)
                 logger.info("Received audio output")
             
             elif event_type == "textOutput":
@@ -149,6 +220,15 @@ class HardwareDeviceClient:
         if self.session_active or not self.authenticated:
             return
         
+        if self.compact_start:
+            # 服务器按设备配置发送完整的引导序列，并通过 session_started 返回提示和音频内容名称
+            self.prompt_name = None
+            self.audio_content_name = None
+            await self.send_message({"start": {}})
+            self.session_active = True
+            logger.info("Session start requested")
+            return
+        
         self.prompt_name = str(uuid.uuid4())
         self.audio_content_name = str(uuid.uuid4())
         text_content_name = str(uuid.uuid4())
@@ -231,9 +311,28 @@ class HardwareDeviceClient:
         self.session_active = True
         logger.info("Session started")
     
+    async def _retry_session(self, delay: float):
+        """等待后重新开始会话"""
+        await asyncio.sleep(delay)
+        await self.start_session()
+    
+    async def _reconnect(self, delay: float):
+        """等待后重新连接并认证，认证成功后恢复会话"""
+        await asyncio.sleep(delay)
+        if self.websocket:
+            await self.websocket.close()
+        backoff = 1.0
+        while True:
+            try:
+                await self.connect()
+                return
+            except Exception:
+                await asyncio.sleep(backoff * random.uniform(1.0, 1.5))
+                backoff = min(backoff * 2, 30)
+    
     async def send_audio_chunk(self, audio_base64: str):
         """发送音频数据"""
-        if self.session_active:
+        if self.session_active and self.prompt_name and asyncio.get_running_loop().time() >= self.audio_paused_until:
             await self.send_event({
                 "audioInput": {
                     "promptName": self.prompt_name,
@@ -242,6 +341,11 @@ class HardwareDeviceClient:
                 }
             })
     
+    async def interrupt(self):
+        """打断助手播报（barge-in）"""
+        self.playback_buffer.clear()
+        await self.send_message({"interrupt": {}})
+    
     async def stop_session(self):
         """停止语音会话"""
         if not self.session_active:
@@ -270,8 +374,11 @@ class HardwareDeviceClient:
     
     async def send_event(self, event_data):
         """发送事件到服务器"""
+        await self.send_message({"event": event_data})
+    
+    async def send_message(self, message):
+        """发送消息到服务器"""
         if self.websocket:
-            message = {"event": event_data}
             await self.websocket.send(json.dumps(message))
     
     async def disconnect(self):
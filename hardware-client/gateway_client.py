@@ -0,0 +1,212 @@
+import asyncio
+import websockets
+import json
+import uuid
+import base64
+import logging
+import random
+from typing import Dict, Optional
+
+from device_client import HardwareDeviceClient
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class GatewayChannel(HardwareDeviceClient):
+    """网关连接上的一个设备通道，会话接口与 HardwareDeviceClient 相同"""
+
+    def __init__(self, gateway: "GatewayClient", device_id: str = None, device_name: str = ""):
+        super().__init__(gateway.server_url, gateway.username, gateway.password, device_id, device_name)
+        self.gateway = gateway
+
+    async def connect(self):
+        """通道通过网关连接打开"""
+        await self.gateway.open_channel(self.device_id, self.device_name)
+
+    async def send_message(self, message):
+        """通过网关连接发送，带上通道标识"""
+        message["channel"] = self.device_id
+        await self.gateway.send_message(message)
+
+    async def handle_message(self, data):
+        """处理本通道的服务器消息"""
+        if data.get("type") == "channel_opened":
+            self.authenticated = True
+            logger.info(f"Channel opened for device {self.device_id}")
+            if self.resume_session:
+                self.resume_session = False
+                asyncio.create_task(self.start_session())
+            return
+
+        if data.get("type") == "channel_error":
+            logger.error(f"Channel {self.device_id} error: {data.get('error')}")
+            return
+
+        await super().handle_message(data)
+
+    async def _reconnect(self, delay: float):
+        """通道不能单独重连，由网关整体重连"""
+        await self.gateway.schedule_reconnect(delay)
+
+    async def disconnect(self):
+        """结束会话并关闭通道"""
+        if self.session_active:
+            await self.stop_session()
+        await self.gateway.close_channel(self.device_id)
+
+class GatewayClient:
+    """网关客户端：一个认证过的WebSocket连接承载多个设备通道（多路复用）"""
+
+    def __init__(self, server_url: str, username: str, password: str, gateway_id: str = None):
+        self.server_url = server_url
+        self.username = username
+        self.password = password
+        self.gateway_id = gateway_id or str(uuid.uuid4())
+        self.websocket = None
+        self.authenticated = False
+        self.channels: Dict[str, GatewayChannel] = {}
+        self.reconnect_task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        """连接服务器并以网关身份认证"""
+        self.websocket = await websockets.connect(self.server_url)
+        logger.info(f"Gateway connected to server: {self.server_url}")
+        await self.websocket.send(json.dumps({
+            "auth": {
+                "username": self.username,
+                "password": self.password,
+                "device_id": self.gateway_id,
+                "gateway": True
+            }
+        }))
+        asyncio.create_task(self.listen_messages())
+
+    async def open_channel(self, device_id: str = None, device_name: str = "") -> GatewayChannel:
+        """打开一个设备通道，网关认证后（或重连后）自动向服务器登记"""
+        channel = self.channels.get(device_id) if device_id else None
+        if channel is None:
+            channel = GatewayChannel(self, device_id, device_name)
+            self.channels[channel.device_id] = channel
+        if self.authenticated:
+            await self._send_channel_open(channel)
+        return channel
+
+    async def close_channel(self, device_id: str):
+        """关闭设备通道"""
+        if self.channels.pop(device_id, None) and self.websocket:
+            await self.send_message({"channel": device_id, "channel_close": {}})
+
+    async def _send_channel_open(self, channel: GatewayChannel):
+        await self.send_message({
+            "channel_open": {
+                "device_id": channel.device_id,
+                "device_name": channel.device_name
+            }
+        })
+
+    async def send_message(self, message):
+        """发送消息到服务器"""
+        if self.websocket:
+            await self.websocket.send(json.dumps(message))
+
+    async def listen_messages(self):
+        """监听服务器消息并按通道分发"""
+        try:
+            async for message in self.websocket:
+                data = json.loads(message)
+                channel = self.channels.get(data.get("channel"))
+                if channel:
+                    await channel.handle_message(data)
+                else:
+                    await self.handle_message(data)
+        except websockets.exceptions.ConnectionClosed:
+            logger.info("Gateway connection closed")
+        except Exception as e:
+            logger.error(f"Error listening messages: {e}")
+
+    async def handle_message(self, data):
+        """处理网关级别的服务器消息"""
+        if data.get("type") == "auth_success":
+            self.authenticated = True
+            logger.info(f"Gateway authenticated, opening {len(self.channels)} channels")
+            for channel in list(self.channels.values()):
+                await self._send_channel_open(channel)
+            return
+
+        if data.get("type") == "auth_failed":
+            logger.error(f"Gateway authentication failed: {data.get('error')}")
+            return
+
+        if data.get("type") == "reconnect_elsewhere":
+            # 服务器节点下线：所有通道在重连后恢复会话
+            for channel in self.channels.values():
+                channel.resume_session = channel.resume_session or channel.session_active
+                channel.session_active = False
+                channel.authenticated = False
+            await self.schedule_reconnect(data.get("retry_after", 0))
+            return
+
+        if data.get("type") == "throttled":
+            logger.warning(f"Gateway throttled ({data.get('message_class')}), retry after {data.get('retry_after')}s")
+            return
+
+        if data.get("type") in ("channel_closed", "channel_error"):
+            logger.info(f"Channel {data.get('channel')}: {data.get('type')} {data.get('error', '')}")
+
+    async def schedule_reconnect(self, delay: float):
+        """按服务器给出的延迟重连（同一时间只有一个重连任务）"""
+        self.authenticated = False
+        if self.reconnect_task is None or self.reconnect_task.done():
+            logger.warning(f"Gateway reconnecting in {delay:.1f}s")
+            self.reconnect_task = asyncio.create_task(self._reconnect(delay))
+
+    async def _reconnect(self, delay: float):
+        await asyncio.sleep(delay)
+        if self.websocket:
+            await self.websocket.close()
+        backoff = 1.0
+        while True:
+            try:
+                await self.connect()
+                return
+            except Exception:
+                await asyncio.sleep(backoff * random.uniform(1.0, 1.5))
+                backoff = min(backoff * 2, 30)
+
+    async def disconnect(self):
+        """结束所有通道的会话并断开连接"""
+        for channel in list(self.channels.values()):
+            await channel.disconnect()
+        if self.websocket:
+            await self.websocket.close()
+        logger.info("Gateway disconnected")
+
+# 使用示例
+async def main():
+    gateway = GatewayClient(
+        server_url="ws://localhost:8081",
+        username="device",
+        password="device123"
+    )
+
+    try:
+        await gateway.connect()
+        mics = [await gateway.open_channel(device_name=f"Mic {i:02d}") for i in range(4)]
+        await asyncio.sleep(1)
+        for mic in mics:
+            await mic.start_session()
+
+        # 模拟各麦克风发送音频数据
+        for i in range(10):
+            fake_audio = base64.b64encode(b"fake_audio_data").decode('utf-8')
+            for mic in mics:
+                await mic.send_audio_chunk(fake_audio)
+            await asyncio.sleep(1)
+
+    except KeyboardInterrupt:
+        logger.info("Stopping gateway...")
+    finally:
+        await gateway.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(main())
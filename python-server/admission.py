@@ -0,0 +1,87 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+# 节点级准入控制配置（0 表示不限制）
+MAX_ACTIVE_STREAMS = int(os.getenv("MAX_ACTIVE_STREAMS", "0"))
+MAX_CONCURRENT_TOOL_CALLS = int(os.getenv("MAX_CONCURRENT_TOOL_CALLS", "0"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
+
+class AdmissionRejected(Exception):
+    """在排队期限内未获得资源"""
+
+    def __init__(self, resource: str, retry_after: float):
+        super().__init__(f"{resource} capacity exhausted, retry after {retry_after}s")
+        self.resource = resource
+        self.retry_after = retry_after
+
+
+class _Limit:
+    """带排队期限的并发上限"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def acquire(self, timeout: float, retry_after: float):
+        if self.semaphore:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                # 排队越长，建议的重试间隔越长
+                raise AdmissionRejected(self.name, round(retry_after * (1 + self.waiting / self.limit), 1))
+            finally:
+                self.waiting -= 1
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+        if self.semaphore:
+            self.semaphore.release()
+
+    def stats(self) -> Dict:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+class AdmissionController:
+    """限制本节点并发的S2S流和工具调用，超限时短暂排队，超过期限则拒绝"""
+
+    def __init__(self, max_streams: int = MAX_ACTIVE_STREAMS, max_tool_calls: int = MAX_CONCURRENT_TOOL_CALLS,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT, retry_after: float = ADMISSION_RETRY_AFTER):
+        self.streams = _Limit("streams", max_streams)
+        self.tool_calls = _Limit("tool_calls", max_tool_calls)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+    async def acquire_stream(self, timeout: Optional[float] = None):
+        """获取一个S2S流名额，失败时抛出AdmissionRejected"""
+        await self.streams.acquire(self.queue_timeout if timeout is None else timeout, self.retry_after)
+
+    def release_stream(self):
+        """释放S2S流名额"""
+        self.streams.release()
+
+    @asynccontextmanager
+    async def tool_call(self, timeout: Optional[float] = None):
+        """在并发工具调用上限内执行"""
+        await self.tool_calls.acquire(self.queue_timeout if timeout is None else timeout, self.retry_after)
+        try:
+            yield
+        finally:
+            self.tool_calls.release()
+
+    def stats(self) -> Dict:
+        return {"streams": self.streams.stats(), "tool_calls": self.tool_calls.stats()}
+
+
+# 全局准入控制器实例
+admission_controller = AdmissionController()
@@ -5,13 +5,34 @@ import json
 import logging
 from typing import Optional, Dict, List
 from datetime import datetime
+from tool_results import parse_result_fields
 
 logger = logging.getLogger(__name__)
 
+# 配置变更通知频道（LISTEN/NOTIFY）
+CONFIG_CHANNEL = 'nova_sonic_config'
+
+def _optional_float(value) -> Optional[float]:
+    """表单中的可选数值，空值存为NULL"""
+    if value is None or value == '':
+        return None
+    return float(value)
+
+def _optional_int(value) -> Optional[int]:
+    if value is None or value == '':
+        return None
+    return int(value)
+
+def _result_fields(value) -> str:
+    """校验结果字段投影规则（字段路径的JSON数组），返回存入JSONB的JSON文本；无效时抛出 ValueError"""
+    return json.dumps(parse_result_fields(value))
+
 class DatabaseManager:
     def __init__(self):
         self.pool = None
         self.db_url = self._build_db_url()
+        self.listening = False
+        self._notify_tasks = set()
     
     def _build_db_url(self) -> str:
         """构建数据库连接URL"""
@@ -23,7 +44,7 @@ class DatabaseManager:
         
         return f"postgresql://{user}:{password}@{host}:{port}/{database}"
     
-    async def initialize(self):
+    async def initialize(self, create_schema: bool = True):
         """初始化数据库连接池"""
         try:
             # 添加连接参数
@@ -39,8 +60,9 @@ class DatabaseManager:
                 timeout=15,  # 连接超时15秒
                 max_inactive_connection_lifetime=300  # 5分钟后关闭非活跃连接
             )
-            await self.create_tables()
-            await self.create_default_users()
+            if create_schema:
+                await self.create_tables()
+                await self.create_default_users()
             logger.info("Database initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
@@ -97,6 +119,16 @@ class DatabaseManager:
                 )
             ''')
             
+            # 空闲释放时间（秒），0 表示不释放
+            await conn.execute(
+                "ALTER TABLE device_configs ADD COLUMN IF NOT EXISTS idle_timeout INTEGER DEFAULT 0"
+            )
+            
+            # 配置版本号，随变更通知一起发布
+            await conn.execute(
+                "ALTER TABLE device_configs ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 1"
+            )
+            
             # MCP服务器配置表
             await conn.execute('''
                 CREATE TABLE IF NOT EXISTS mcp_servers (
@@ -115,6 +147,47 @@ class DatabaseManager:
                 )
             ''')
             
+            await conn.execute(
+                "ALTER TABLE mcp_servers ADD COLUMN IF NOT EXISTS version INTEGER DEFAULT 1"
+            )
+            
+            # 工具调用期限（秒），为空时使用 MCP_CALL_TIMEOUT
+            await conn.execute(
+                "ALTER TABLE mcp_servers ADD COLUMN IF NOT EXISTS call_timeout REAL"
+            )
+            
+            # 每个副本的并发调用上限（为空时使用 MCP_MAX_IN_FLIGHT）和stdio副本进程数
+            await conn.execute(
+                "ALTER TABLE mcp_servers ADD COLUMN IF NOT EXISTS max_in_flight INTEGER"
+            )
+            await conn.execute(
+                "ALTER TABLE mcp_servers ADD COLUMN IF NOT EXISTS replicas INTEGER DEFAULT 1"
+            )
+            
+            # 会话启动时立即连接（延迟敏感的工具），否则在首次调用其工具时才连接
+            await conn.execute(
+                "ALTER TABLE mcp_servers ADD COLUMN IF NOT EXISTS eager BOOLEAN DEFAULT FALSE"
+            )
+            
+            # 工具结果大小上限（字节，为空时使用 TOOL_RESULT_MAX_BYTES）和结果字段投影规则（JSON数组）
+            await conn.execute(
+                "ALTER TABLE mcp_servers ADD COLUMN IF NOT EXISTS max_result_bytes INTEGER"
+            )
+            await conn.execute(
+                "ALTER TABLE mcp_servers ADD COLUMN IF NOT EXISTS result_fields JSONB DEFAULT '[]'"
+            )
+            
+            # MCP工具目录表：按连接配置哈希缓存服务器 list_tools 的结果
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS mcp_tool_catalogs (
+                    config_hash VARCHAR(64) PRIMARY KEY,
+                    server_id INTEGER,
+                    server_name VARCHAR(100),
+                    tools JSONB NOT NULL DEFAULT '[]',
+                    fetched_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                )
+            ''')
+            
             # 会话记录表
             await conn.execute('''
                 CREATE TABLE IF NOT EXISTS sessions (
@@ -315,23 +388,35 @@ class DatabaseManager:
             # 构建更新字段
             fields = []
             values = []
+            updated_keys = []
             param_count = 1
             
             for key, value in config_data.items():
                 if key in ['voice_id', 'system_prompt', 'max_tokens', 'temperature', 'top_p',
                           'enable_mcp', 'enable_strands', 'enable_kb', 'enable_agents',
-                          'kb_id', 'lambda_arn', 'mcp_servers', 'chat_history']:
+                          'kb_id', 'lambda_arn', 'mcp_servers', 'chat_history', 'idle_timeout']:
                     fields.append(f"{key} = ${param_count}")
                     values.append(value)
+                    updated_keys.append(key)
                     param_count += 1
             
             if fields:
                 fields.append(f"updated_at = CURRENT_TIMESTAMP")
-                query = f"UPDATE device_configs SET {', '.join(fields)} WHERE device_id = ${param_count}"
+                fields.append("version = version + 1")
+                query = f"UPDATE device_configs SET {', '.join(fields)} WHERE device_id = ${param_count} RETURNING version"
                 values.append(device_id)
                 
-                result = await conn.execute(query, *values)
-                return result != "UPDATE 0"
+                async with conn.transaction():
+                    version = await conn.fetchval(query, *values)
+                    if version is None:
+                        return False
+                    await self._notify(conn, {
+                        "type": "device_config",
+                        "device_id": device_id,
+                        "version": version,
+                        "fields": updated_keys
+                    })
+                return True
             
             return False
     
@@ -394,10 +479,12 @@ class DatabaseManager:
     
     async def create_mcp_server(self, server_data: Dict) -> int:
         """创建MCP服务器配置"""
-        async with self.pool.acquire() as conn:
+        result_fields = _result_fields(server_data.get('result_fields'))
+        async with self.pool.acquire() as conn, conn.transaction():
             server_id = await conn.fetchval('''
-                INSERT INTO mcp_servers (name, connection_type, command, args, env_vars, url, headers, description, tool_name, tool_description)
-                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+                INSERT INTO mcp_servers (name, connection_type, command, args, env_vars, url, headers, description, tool_name, tool_description,
+                                         call_timeout, max_in_flight, replicas, eager, max_result_bytes, result_fields)
+                VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16)
                 RETURNING id
             ''', 
                 server_data['name'],
@@ -409,18 +496,29 @@ class DatabaseManager:
                 json.dumps(server_data.get('headers', {})),
                 server_data.get('description', ''),
                 server_data.get('tool_name', ''),
-                server_data.get('tool_description', '')
+                server_data.get('tool_description', ''),
+                _optional_float(server_data.get('call_timeout')),
+                _optional_int(server_data.get('max_in_flight')),
+                _optional_int(server_data.get('replicas')) or 1,
+                bool(server_data.get('eager', False)),
+                _optional_int(server_data.get('max_result_bytes')),
+                result_fields
             )
+            await self._notify(conn, {"type": "mcp_server", "server_id": server_id, "version": 1})
             return server_id
     
     async def update_mcp_server(self, server_id: int, server_data: Dict) -> bool:
         """更新MCP服务器配置"""
-        async with self.pool.acquire() as conn:
-            result = await conn.execute('''
+        result_fields = _result_fields(server_data.get('result_fields'))
+        async with self.pool.acquire() as conn, conn.transaction():
+            version = await conn.fetchval('''
                 UPDATE mcp_servers 
                 SET name = $1, connection_type = $2, command = $3, args = $4, env_vars = $5, 
-                    url = $6, headers = $7, description = $8, tool_name = $9, tool_description = $10
-                WHERE id = $11
+                    url = $6, headers = $7, description = $8, tool_name = $9, tool_description = $10,
+                    call_timeout = $11, max_in_flight = $12, replicas = $13, eager = $14,
+                    max_result_bytes = $15, result_fields = $16, version = version + 1
+                WHERE id = $17
+                RETURNING version
             ''',
                 server_data['name'],
                 server_data.get('connection_type', 'stdio'),
@@ -432,15 +530,106 @@ class DatabaseManager:
                 server_data.get('description', ''),
                 server_data.get('tool_name', ''),
                 server_data.get('tool_description', ''),
+                _optional_float(server_data.get('call_timeout')),
+                _optional_int(server_data.get('max_in_flight')),
+                _optional_int(server_data.get('replicas')) or 1,
+                bool(server_data.get('eager', False)),
+                _optional_int(server_data.get('max_result_bytes')),
+                result_fields,
                 server_id
             )
-            return result != "UPDATE 0"
+            if version is None:
+                return False
+            await self._notify(conn, {"type": "mcp_server", "server_id": server_id, "version": version})
+            return True
     
     async def delete_mcp_server(self, server_id: int) -> bool:
         """删除MCP服务器配置"""
-        async with self.pool.acquire() as conn:
+        async with self.pool.acquire() as conn, conn.transaction():
             result = await conn.execute("DELETE FROM mcp_servers WHERE id = $1", server_id)
-            return result != "DELETE 0"
+            if result == "DELETE 0":
+                return False
+            await self._notify(conn, {"type": "mcp_server", "server_id": server_id, "version": None, "deleted": True})
+            return True
+    
+    # MCP工具目录操作
+    async def get_tool_catalogs(self, config_hash: Optional[str] = None) -> List[Dict]:
+        """获取MCP工具目录，指定哈希时只返回该目录"""
+        async with self.pool.acquire() as conn:
+            if config_hash:
+                rows = await conn.fetch("SELECT * FROM mcp_tool_catalogs WHERE config_hash = $1", config_hash)
+            else:
+                rows = await conn.fetch("SELECT * FROM mcp_tool_catalogs ORDER BY fetched_at DESC")
+            return [dict(row) for row in rows]
+    
+    async def get_server_tool_catalogs(self, server_id: int) -> List[Dict]:
+        """获取MCP服务器的工具目录（最近获取的在前）"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT * FROM mcp_tool_catalogs WHERE server_id = $1 ORDER BY fetched_at DESC", server_id
+            )
+            return [dict(row) for row in rows]
+    
+    async def save_tool_catalog(self, config_hash: str, server_id: Optional[int], server_name: Optional[str], tools: List[Dict]):
+        """保存MCP服务器的工具目录并通知其他进程"""
+        async with self.pool.acquire() as conn, conn.transaction():
+            await conn.execute('''
+                INSERT INTO mcp_tool_catalogs (config_hash, server_id, server_name, tools, fetched_at)
+                VALUES ($1, $2, $3, $4, NOW())
+                ON CONFLICT (config_hash) DO UPDATE
+                SET server_id = EXCLUDED.server_id, server_name = EXCLUDED.server_name,
+                    tools = EXCLUDED.tools, fetched_at = EXCLUDED.fetched_at
+            ''', config_hash, server_id, server_name, json.dumps(tools))
+            await self._notify(conn, {"type": "mcp_tools", "config_hash": config_hash})
+    
+    # 配置变更通知
+    async def _notify(self, conn, change: Dict):
+        """在当前事务中发布配置变更通知，事务提交后送达所有监听者"""
+        await conn.execute("SELECT pg_notify($1, $2)", CONFIG_CHANNEL, json.dumps(change))
+    
+    async def listen_config_changes(self, callback):
+        """保持一个LISTEN连接，把配置变更通知交给callback；断线后自动重连
+
+        重连后先发送一次 {"type": "resync"}，因为断线期间的通知已丢失。
+        """
+        def on_notification(connection, pid, channel, payload):
+            try:
+                change = json.loads(payload)
+            except ValueError:
+                logger.warning(f"Invalid config notification: {payload}")
+                return
+            task = asyncio.create_task(callback(change))
+            self._notify_tasks.add(task)
+            task.add_done_callback(self._notify_tasks.discard)
+        
+        reconnecting = False
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(
+                    self.db_url,
+                    ssl='require' if 'rds.amazonaws.com' in self.db_url else None,
+                    timeout=15
+                )
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda connection: closed.set())
+                await conn.add_listener(CONFIG_CHANNEL, on_notification)
+                self.listening = True
+                logger.info(f"Listening for config changes on '{CONFIG_CHANNEL}'")
+                if reconnecting:
+                    await callback({"type": "resync"})
+                await closed.wait()
+            except asyncio.CancelledError:
+                self.listening = False
+                if conn and not conn.is_closed():
+                    await conn.close()
+                raise
+            except Exception as e:
+                logger.error(f"Config listener error: {e}")
+            self.listening = False
+            reconnecting = True
+            logger.warning("Config listener disconnected, reconnecting in 5s")
+            await asyncio.sleep(5)
     
     async def delete_user(self, username: str) -> bool:
         """删除用户"""
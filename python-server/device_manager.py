@@ -5,6 +5,18 @@ from typing import Dict, Optional
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from database import db_manager
+from s2s_events import S2sEvent
+from session_bootstrap import BootstrapTemplate, build_bootstrap_template, template_key
+from tool_catalog import mcp_tool_catalog, tool_spec
+
+# 内置工具的toolSpec（不随设备变化）
+QUERY_SCHEMA = '{"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}'
+DATE_TOOL = tool_spec("getDateTool", "get information about the current day",
+                      '{"type": "object", "properties": {}, "required": []}')
+KB_TOOL = tool_spec("getKbTool", "get information from knowledge base", QUERY_SCHEMA)
+LOCATION_TOOL = tool_spec("getLocationTool", "Search for places and locations", QUERY_SCHEMA)
+AGENT_TOOL = tool_spec("externalAgent", "Get weather information", QUERY_SCHEMA)
+BOOKING_TOOL = tool_spec("getBookingDetails", "Manage bookings and reservations", QUERY_SCHEMA)
 
 @dataclass
 class DeviceConfig:
@@ -25,6 +37,9 @@ class DeviceConfig:
     kb_id: str = ""
     lambda_arn: str = ""
     
+    # 空闲释放时间（秒），0 表示不释放
+    idle_timeout: int = 0
+    
     # 聊天历史
     chat_history: list = None
     
@@ -44,11 +59,23 @@ class DeviceManager:
     
     def __init__(self):
         self.device_sessions: Dict[str, object] = {}  # device_id -> S2sSessionManager
+        # 配置缓存，由配置变更通知（LISTEN/NOTIFY）或本进程的更新失效
+        self._config_cache: Dict[str, dict] = {}
+        self._mcp_server_cache: Optional[Dict[int, dict]] = None
+        # 会话引导模板：device_id -> (配置版本, {音频输入配置: 模板})
+        self._bootstrap_cache: Dict[str, tuple] = {}
+        # 工具配置：device_id -> (配置版本, 工具配置的JSON)
+        self._tool_config_cache: Dict[str, tuple] = {}
+        # 已应用的配置版本：device_id -> 版本，只记录本进程在线的设备，下线时清除
+        self._applied_versions: Dict[str, int] = {}
         
     async def register_device(self, device_id: str, device_name: str = "") -> dict:
         """注册新设备"""
         device_name = device_name or f"Device-{device_id[:8]}"
-        return await db_manager.register_device(device_id, device_name)
+        self._config_cache.pop(device_id, None)
+        config = await db_manager.register_device(device_id, device_name)
+        self._applied_versions[device_id] = (config or {}).get('version') or 0
+        return config
     
     async def unregister_device(self, device_id: str):
         """设备下线"""
@@ -59,11 +86,33 @@ class DeviceManager:
         
         if device_id in self.device_sessions:
             del self.device_sessions[device_id]
+        self._config_cache.pop(device_id, None)
+        self._bootstrap_cache.pop(device_id, None)
+        self._tool_config_cache.pop(device_id, None)
+        self._applied_versions.pop(device_id, None)
+    
+    def registered_devices(self) -> list:
+        """本进程在线（已注册且未下线）的设备"""
+        return list(self._applied_versions)
+    
+    def accept_config_version(self, device_id: str, version: int) -> bool:
+        """记录在线设备新应用的配置版本，重复或过时的版本返回False"""
+        if version <= self._applied_versions.get(device_id, 0):
+            return False
+        if device_id in self._applied_versions:
+            self._applied_versions[device_id] = version
+        return True
     
-    async def get_device_config(self, device_id: str) -> Optional[dict]:
-        """获取设备配置"""
+    async def get_device_config(self, device_id: str, use_cache: bool = True) -> Optional[dict]:
+        """获取设备配置，mcp_servers 解析为当前的MCP服务器配置"""
+        if use_cache and device_id in self._config_cache:
+            return self._config_cache[device_id]
         try:
-            return await db_manager.get_device_config(device_id)
+            config = await db_manager.get_device_config(device_id)
+            if config:
+                config['mcp_servers'] = await self._resolve_mcp_servers(config.get('mcp_servers'))
+                self._config_cache[device_id] = config
+            return config
         except Exception:
             return None
     
@@ -73,6 +122,45 @@ class DeviceManager:
             return await db_manager.update_device_config(device_id, config_data)
         except Exception:
             return False
+        finally:
+            self._config_cache.pop(device_id, None)
+    
+    def invalidate_config(self, device_id: Optional[str] = None):
+        """使设备配置缓存失效，不指定设备时清空全部"""
+        if device_id is None:
+            self._config_cache.clear()
+        else:
+            self._config_cache.pop(device_id, None)
+    
+    def invalidate_mcp_servers(self):
+        """MCP服务器配置变更后清空服务器缓存及引用它们的设备配置"""
+        self._mcp_server_cache = None
+        self._config_cache.clear()
+    
+    async def _resolve_mcp_servers(self, servers) -> list:
+        """用mcp_servers表中的最新配置替换设备保存的服务器副本，已删除的服务器被移除"""
+        if isinstance(servers, str):
+            servers = json.loads(servers)
+        if not servers:
+            return []
+        
+        if self._mcp_server_cache is None:
+            catalog = {}
+            for server in await db_manager.get_all_mcp_servers():
+                for key, value in server.items():
+                    if hasattr(value, 'isoformat'):  # datetime对象
+                        server[key] = value.isoformat()
+                catalog[server['id']] = server
+            self._mcp_server_cache = catalog
+        
+        resolved = []
+        for server in servers:
+            server_id = server.get('id')
+            if server_id is None:
+                resolved.append(server)
+            elif server_id in self._mcp_server_cache:
+                resolved.append(self._mcp_server_cache[server_id])
+        return resolved
     
     async def get_all_devices(self) -> Dict[str, dict]:
         """获取所有设备信息"""
@@ -89,81 +177,70 @@ class DeviceManager:
         """获取设备会话"""
         return self.device_sessions.get(device_id)
     
+    def get_bootstrap_template(self, device_config: dict, audio_input_config: Optional[dict] = None) -> BootstrapTemplate:
+        """获取设备当前配置版本的会话引导模板，配置或MCP服务器版本变化后重新生成"""
+        device_id = device_config['device_id']
+        key = template_key(device_config)
+        cached = self._bootstrap_cache.get(device_id)
+        if cached is None or cached[0] != key:
+            cached = self._bootstrap_cache[device_id] = (key, {})
+        
+        audio_key = json.dumps(audio_input_config, sort_keys=True) if audio_input_config else None
+        template = cached[1].get(audio_key)
+        if template is None:
+            template = build_bootstrap_template(device_config, self.build_tool_config(device_config), audio_input_config)
+            cached[1][audio_key] = template
+        return template
+    
     def build_tool_config(self, device_config: dict) -> dict:
+        """设备的工具配置，每次返回新的副本，调用方可以修改"""
+        return json.loads(self.tool_config_json(device_config))
+    
+    def tool_config_json(self, device_config: dict) -> str:
+        """设备工具配置的JSON，按（配置版本, MCP工具目录版本）编译一次后复用。
+        缓存的是不可变的字符串，调用方无法改动其他会话共用的配置"""
+        device_id = device_config['device_id']
+        key = template_key(device_config)
+        cached = self._tool_config_cache.get(device_id)
+        if cached is None or cached[0] != key:
+            compiled = json.dumps(self._compile_tool_config(device_config), ensure_ascii=False)
+            cached = self._tool_config_cache[device_id] = (key, compiled)
+        return cached[1]
+    
+    def _compile_tool_config(self, device_config: dict) -> dict:
         """根据设备配置构建工具配置"""
-        tools = []
-        
         # 基础工具
-        tools.append({
-            "toolSpec": {
-                "name": "getDateTool",
-                "description": "get information about the current day",
-                "inputSchema": {
-                    "json": '{"type": "object", "properties": {}, "required": []}'
-                }
-            }
-        })
+        tools = [DATE_TOOL]
         
         # 知识库工具
         if device_config.get('enable_kb') and device_config.get('kb_id'):
-            tools.append({
-                "toolSpec": {
-                    "name": "getKbTool",
-                    "description": "get information from knowledge base",
-                    "inputSchema": {
-                        "json": '{"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}'
-                    }
-                }
-            })
+            tools.append(KB_TOOL)
         
-        # 动态MCP工具
-        mcp_servers = device_config.get('mcp_servers', [])
-        for server in mcp_servers:
-            if server.get('tool_name'):
-                tools.append({
-                    "toolSpec": {
-                        "name": server['tool_name'],
-                        "description": server.get('tool_description', server['name']),
-                        "inputSchema": {
-                            "json": '{"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}'
-                        }
-                    }
-                })
+        # 动态MCP工具：优先使用服务器 list_tools 提供的工具和输入模式
+        names = set()
+        for server in device_config.get('mcp_servers', []):
+            catalog_tools = mcp_tool_catalog.tools(server)
+            if catalog_tools:
+                for tool in catalog_tools:
+                    if tool['name'].lower() in names or tool['name'].lower() in S2sEvent.BUILTIN_TOOL_NAMES:
+                        continue
+                    names.add(tool['name'].lower())
+                    tools.append(tool_spec(tool['name'], tool.get('description') or server['name'],
+                                           tool.get('inputSchema') or QUERY_SCHEMA))
+            elif server.get('tool_name') and server['tool_name'].lower() not in names:
+                names.add(server['tool_name'].lower())
+                tools.append(tool_spec(server['tool_name'], server.get('tool_description', server['name']), QUERY_SCHEMA))
         
         # 传统MCP工具（向后兼容）
         if device_config.get('enable_mcp'):
-            tools.append({
-                "toolSpec": {
-                    "name": "getLocationTool",
-                    "description": "Search for places and locations",
-                    "inputSchema": {
-                        "json": '{"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}'
-                    }
-                }
-            })
+            tools.append(LOCATION_TOOL)
         
         # Strands Agent工具
         if device_config.get('enable_strands'):
-            tools.append({
-                "toolSpec": {
-                    "name": "externalAgent",
-                    "description": "Get weather information",
-                    "inputSchema": {
-                        "json": '{"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}'
-                    }
-                }
-            })
+            tools.append(AGENT_TOOL)
         
         # Bedrock Agents工具
         if device_config.get('enable_agents') and device_config.get('lambda_arn'):
-            tools.append({
-                "toolSpec": {
-                    "name": "getBookingDetails",
-                    "description": "Manage bookings and reservations",
-                    "inputSchema": {
-                        "json": '{"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}'
-                    }
-                }
-            })
+            tools.append(BOOKING_TOOL)
         
         return {"tools": tools}
\ No newline at end of file
@@ -12,8 +12,22 @@ from auth_manager import AuthManager
 from database import db_manager
 import argparse
 import os
+import signal
+import multiprocessing
+import tempfile
+import time
+import random
 from integration.strands_agent import StrandsAgent
-from integration.universal_mcp_client import UniversalMcpManager
+from worker_ipc import WorkerIpc
+from admission import admission_controller, AdmissionRejected
+from rate_limiter import rate_limiter, classify_message
+from session_supervisor import SessionSupervisor, supervisor_registry
+from ws_settings import serve_options, read_timeout
+from tool_catalog import mcp_tool_catalog, config_hash
+from mcp_resilience import mcp_breakers, CircuitBreaker, MCP_PROBE_INTERVAL
+from integration.mcp_http_pool import mcp_http_pool
+from integration.mcp_process_pool import mcp_process_pool
+from tool_results import tool_result_stats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
@@ -27,6 +41,25 @@ MCP_CLIENT = None
 STRANDS_AGENT = None
 # 每个设备独立的MCP管理器
 DEVICE_MCP_MANAGERS = {}
+# 空闲会话检查间隔（秒）
+IDLE_REAPER_INTERVAL = int(os.getenv("IDLE_REAPER_INTERVAL", "15"))
+# 多进程模式下的工作进程编号和IPC通道（单进程模式为None）
+WORKER_ID = None
+WORKER_IPC = None
+STARTED_AT = time.monotonic()
+# 需要重启S2S会话的配置项
+RESTART_TRIGGERS = ['system_prompt', 'voice_id', 'enable_mcp', 'mcp_servers', 'enable_strands', 'enable_kb', 'enable_agents']
+# 优雅下线：等待进行中轮次结束的最长秒数，以及分散设备重连的抖动范围（秒）
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+DRAIN_RECONNECT_JITTER = float(os.getenv("DRAIN_RECONNECT_JITTER", "10"))
+# 多进程滚动重启时等待新工作进程就绪的最长秒数
+WORKER_READY_TIMEOUT = float(os.getenv("WORKER_READY_TIMEOUT", "60"))
+DRAINING = False
+# 资源统计和泄漏检查间隔（秒）
+RESOURCE_CHECK_INTERVAL = int(os.getenv("RESOURCE_CHECK_INTERVAL", "60"))
+# 网关多路复用：每个网关连接的最大设备通道数，以及单个通道允许积压的上行音频片段数
+GATEWAY_MAX_CHANNELS = int(os.getenv("GATEWAY_MAX_CHANNELS", "64"))
+GATEWAY_CHANNEL_MAX_BACKLOG = int(os.getenv("GATEWAY_CHANNEL_MAX_BACKLOG", "200"))
 
 # 移除不需要的WebSocket连接管理
 
@@ -55,12 +88,33 @@ async def cors_handler(request, handler):
 async def websocket_handler(websocket):
     """WebSocket处理器 - 支持设备连接和认证"""
     device_id = None
-    stream_manager = None
     authenticated = False
+    # 连接持有的任务、会话和MCP连接都由supervisor登记并在断开时统一释放
+    supervisor = SessionSupervisor(websocket, device_manager, DEVICE_MCP_MANAGERS)
+    client_ip = websocket.remote_address[0] if websocket.remote_address else None
+    throttle_notified = {}
     
     try:
-        async for message in websocket:
+        while True:
+            # 读空闲超时：长时间未认证或无消息的连接直接关闭，释放其持有的资源
+            try:
+                message = await asyncio.wait_for(websocket.recv(), read_timeout(authenticated))
+            except asyncio.TimeoutError:
+                logger.info(f"Closing idle connection (device {device_id}, authenticated={authenticated})")
+                await websocket.close(1000, "idle timeout")
+                break
+            
+            # 同一设备已建立新连接，会话已交接给新连接
+            if supervisor.evicted:
+                break
             try:
+                # 入口限流：在JSON解析之前按消息类别检查设备和IP的令牌桶
+                message_class = classify_message(message)
+                retry_after = rate_limiter.check(message_class, device_id if authenticated else None, client_ip)
+                if retry_after is not None:
+                    await notify_throttled(supervisor, throttle_notified, message_class, retry_after)
+                    continue
+                
                 data = json.loads(message)
                 
                 # 处理认证
@@ -74,6 +128,20 @@ async def websocket_handler(websocket):
                         token = auth_manager.create_session(user, device_id)
                         authenticated = True
                         
+                        # 网关：一个连接承载多个设备通道
+                        if data['auth'].get('gateway'):
+                            logger.info(f"Gateway {device_id} authenticated")
+                            await websocket.send(json.dumps({
+                                "type": "auth_success",
+                                "token": token,
+                                "device_id": device_id,
+                                "gateway": True
+                            }))
+                            await run_gateway(websocket, device_id)
+                            break
+                        
+                        await take_over_device(supervisor, device_id)
+                        
                         # 注册设备
                         device_name = data['auth'].get('device_name', '')
                         device_config = await device_manager.register_device(device_id, device_name)
@@ -148,6 +216,7 @@ async def websocket_handler(websocket):
                     device_name = data.get('device_name', '')
                     device_config = await device_manager.register_device(device_id, device_name)
                     authenticated = True  # 临时兼容
+                    await take_over_device(supervisor, device_id)
                     logger.info(f"Device {device_id} connected (legacy mode)")
                     
                     await websocket.send(json.dumps({
@@ -157,83 +226,21 @@ async def websocket_handler(websocket):
                     }))
                     continue
                 
-                # 处理S2S事件
-                if 'event' in data:
+                # 处理设备端打断（barge-in）：丢弃尚未下发的助手音频
+                if 'interrupt' in data:
+                    if authenticated and supervisor.session:
+                        supervisor.session.flush_pending_audio()
+                    continue
+
+                # 处理S2S事件和会话start命令
+                if 'event' in data or 'start' in data:
                     if not authenticated or not device_id:
                         await websocket.send(json.dumps({
                             "error": "Device not authenticated"
                         }))
                         continue
                     
-                    # 获取设备配置
-                    device_config = await device_manager.get_device_config(device_id)
-                    if not device_config:
-                        continue
-                    
-                    # 初始化会话管理器
-                    if stream_manager is None:
-                        aws_region = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
-                        
-                        # 为设备创建独立的MCP管理器
-                        if device_id not in DEVICE_MCP_MANAGERS:
-                            DEVICE_MCP_MANAGERS[device_id] = UniversalMcpManager()
-                        
-                        # 加载设备的MCP服务器
-                        await DEVICE_MCP_MANAGERS[device_id].load_servers_for_device(device_config)
-                        
-                        stream_manager = S2sSessionManager(
-                            model_id='amazon.nova-sonic-v1:0',
-                            region=aws_region,
-                            mcp_client=MCP_CLIENT if device_config.get('enable_mcp') else None,
-                            strands_agent=STRANDS_AGENT if device_config.get('enable_strands') else None,
-                            universal_mcp_manager=DEVICE_MCP_MANAGERS.get(device_id)
-                        )
-                        
-                        await stream_manager.initialize_stream()
-                        device_manager.set_device_session(device_id, stream_manager)
-                        
-                        # 恢复历史记录到新会话
-                        chat_history = device_config.get('chat_history', [])
-                        if chat_history:
-                            logger.info(f"Restoring {len(chat_history)} chat history items for device {device_id}")
-                            # TODO: 实现历史记录恢复逻辑
-                        
-                        # 启动响应转发任务
-                        forward_task = asyncio.create_task(
-                            forward_responses(websocket, stream_manager, device_id)
-                        )
-                    
-                    # 处理事件
-                    event_type = list(data['event'].keys())[0]
-                    
-                    # 应用设备配置到事件
-                    if event_type == 'sessionStart':
-                        data['event']['sessionStart']['inferenceConfiguration'] = {
-                            'maxTokens': device_config.get('max_tokens', 1024),
-                            'topP': device_config.get('top_p', 0.95),
-                            'temperature': device_config.get('temperature', 0.7)
-                        }
-                    
-                    elif event_type == 'promptStart':
-                        # 应用语音配置
-                        if 'audioOutputConfiguration' in data['event']['promptStart']:
-                            data['event']['promptStart']['audioOutputConfiguration']['voiceId'] = device_config.get('voice_id', 'matthew')
-                        
-                        # 应用工具配置
-                        data['event']['promptStart']['toolConfiguration'] = device_manager.build_tool_config(device_config)
-                    
-                    elif event_type == 'textInput' and data['event']['textInput'].get('content') == 'SYSTEM_PROMPT':
-                        # 替换系统提示词
-                        data['event']['textInput']['content'] = device_config.get('system_prompt', 'You are a friendly assistant.')
-                    
-                    # 发送到S2S
-                    if event_type == 'audioInput':
-                        prompt_name = data['event']['audioInput']['promptName']
-                        content_name = data['event']['audioInput']['contentName']
-                        audio_base64 = data['event']['audioInput']['content']
-                        stream_manager.add_audio_chunk(prompt_name, content_name, audio_base64)
-                    else:
-                        await stream_manager.send_raw_event(data)
+                    await handle_device_event(supervisor, data)
                         
             except json.JSONDecodeError:
                 logger.error("Invalid JSON received")
@@ -243,29 +250,433 @@ async def websocket_handler(websocket):
     except websockets.exceptions.ConnectionClosed:
         logger.info(f"Device {device_id} disconnected")
     finally:
-        if device_id:
-            await device_manager.unregister_device(device_id)
-            # 清理设备的MCP管理器
-            if device_id in DEVICE_MCP_MANAGERS:
-                await DEVICE_MCP_MANAGERS[device_id].cleanup_all()
-                del DEVICE_MCP_MANAGERS[device_id]
-        if stream_manager:
+        await supervisor.close()
+
+async def notify_throttled(supervisor, throttle_notified, message_class, retry_after):
+    """通知设备消息被限流，每个类别每秒最多通知一次，避免下行被限流消息占满"""
+    now = time.monotonic()
+    if now - throttle_notified.get(message_class, 0) >= 1:
+        throttle_notified[message_class] = now
+        await supervisor.send({
+            "type": "throttled",
+            "message_class": message_class,
+            "retry_after": retry_after
+        })
+
+async def handle_device_event(supervisor, data):
+    """处理设备的S2S事件：按需建立、重建或恢复会话，然后转发到上游流"""
+    device_id = supervisor.device_id
+    try:
+        # 获取设备配置
+        device_config = await device_manager.get_device_config(device_id)
+        if not device_config:
+            return
+        
+        # 紧凑的start命令：由服务器按预生成的模板发送整个会话引导序列，等同于sessionStart
+        start = data.get('start')
+        event_type = 'sessionStart' if start is not None else list(data['event'].keys())[0]
+        stream_manager = supervisor.session
+        
+        # 会话已被重启（配置变更或管理操作）：按新配置重建，沿用会话引导事件和历史
+        if stream_manager is not None and device_manager.get_device_session(device_id) is not stream_manager:
+            supervisor.previous_session = supervisor.detach_session()
+            stream_manager = None
+            await supervisor.cancel(supervisor.forward_task)
+        
+        # 设备已结束会话（sessionEnd）：下一个事件开始全新的会话
+        elif stream_manager is not None and not stream_manager.is_active and not stream_manager.suspended:
+            supervisor.detach_session()
+            stream_manager = None
+            await supervisor.cancel(supervisor.forward_task)
+        
+        # 设备在仍然活跃的会话上重新开始（如重连后接管了旧连接的会话）：沿用历史和MCP连接重建上游流
+        elif stream_manager is not None and event_type == 'sessionStart' and stream_manager.is_active:
             await stream_manager.close()
-        if 'forward_task' in locals():
-            forward_task.cancel()
+            supervisor.previous_session = supervisor.detach_session()
+            stream_manager = None
+            await supervisor.cancel(supervisor.forward_task)
+        
+        # 节点繁忙：在建议的重试时间之前不再尝试建立上游流
+        if (stream_manager is None or stream_manager.suspended) and time.monotonic() < supervisor.busy_until:
+            return
+        
+        # 节点正在下线：不再建立新的上游流，让设备连接其他节点
+        if stream_manager is None and DRAINING:
+            await supervisor.send(reconnect_elsewhere_message())
+            return
+        
+        # 初始化会话管理器
+        if stream_manager is None:
+            aws_region = os.getenv("AWS_DEFAULT_REGION", "us-east-1")
+            
+            # 为设备创建独立的MCP管理器
+            mcp_manager = supervisor.mcp_lease()
+            
+            new_session = S2sSessionManager(
+                model_id='amazon.nova-sonic-v1:0',
+                region=aws_region,
+                mcp_client=MCP_CLIENT if device_config.get('enable_mcp') else None,
+                strands_agent=STRANDS_AGENT if device_config.get('enable_strands') else None,
+                universal_mcp_manager=mcp_manager,
+                admission=admission_controller
+            )
+            
+            # 先获取准入名额再加载MCP服务器，被拒绝时不做多余的工作
+            await new_session.initialize_stream()
+            stream_manager = supervisor.attach_session(new_session)
+            
+            # 加载设备的MCP服务器（只等待 eager 服务器，其余在首次调用工具时连接）
+            await mcp_manager.load_servers_for_device(device_config)
+            
+            if supervisor.previous_session:
+                stream_manager.inherit_session(
+                    supervisor.previous_session,
+                    lambda event, is_system: apply_device_config(event, device_config, is_system)
+                )
+                supervisor.previous_session = None
+                # 设备自己重新开始会话时，历史在设备的系统提示之后补发
+                if event_type != 'sessionStart':
+                    stream_manager.replay_session()
+            
+            # 恢复历史记录到新会话
+            chat_history = device_config.get('chat_history', [])
+            if chat_history:
+                logger.info(f"Restoring {len(chat_history)} chat history items for device {device_id}")
+                # TODO: 实现历史记录恢复逻辑
+            
+            # 启动响应转发任务
+            supervisor.forward_task = supervisor.spawn(forward_responses(supervisor, stream_manager), "forward")
+        
+        # 处理事件
+        stream_manager.idle_timeout = device_config.get('idle_timeout') or 0
+        
+        # 空闲释放后按需重新打开上游流
+        if stream_manager.suspended:
+            if event_type == 'sessionStart':
+                await resume_device_session(device_id, device_config, stream_manager, replay=False)
+            elif event_type == 'audioInput':
+                audio = data['event']['audioInput']
+                if not stream_manager.buffer_idle_audio(audio['promptName'], audio['contentName'], audio['content']):
+                    return
+                # 检测到语音：回放会话引导事件和预录音频
+                await resume_device_session(device_id, device_config, stream_manager)
+                return
+            elif event_type in ('contentEnd', 'promptEnd', 'sessionEnd'):
+                # 上游流已释放，无需结束
+                return
+            else:
+                await resume_device_session(device_id, device_config, stream_manager)
+        
+        if start is not None:
+            audio_input_config = start.get('audioInputConfiguration') if isinstance(start, dict) else None
+            template = device_manager.get_bootstrap_template(
+                device_config, audio_input_config if isinstance(audio_input_config, dict) else None
+            )
+            await stream_manager.send_bootstrap(template)
+            await supervisor.send({
+                "type": "session_started",
+                "promptName": template.prompt_name,
+                "audioContentName": template.audio_content_name
+            })
+            return
+        
+        # 应用设备配置到事件
+        apply_device_config(data, device_config)
+        
+        # 发送到S2S
+        if event_type == 'audioInput':
+            prompt_name = data['event']['audioInput']['promptName']
+            content_name = data['event']['audioInput']['contentName']
+            audio_base64 = data['event']['audioInput']['content']
+            stream_manager.add_audio_chunk(prompt_name, content_name, audio_base64)
+        else:
+            await stream_manager.send_raw_event(data)
+    
+    except AdmissionRejected as e:
+        # 节点过载：明确告知设备稍后重试，而不是让所有会话一起变慢
+        supervisor.busy_until = time.monotonic() + e.retry_after
+        logger.warning(f"Device {device_id} rejected by admission control: {e}")
+        await supervisor.send({
+            "type": "busy",
+            "reason": e.resource,
+            "retry_after": e.retry_after
+        })
+
+async def run_gateway(websocket, gateway_id):
+    """网关多路复用：一个已认证的连接承载多个设备通道，每个通道有独立的supervisor、会话和资源"""
+    channels = {}
+    throttle_notified = {}
+    channel_throttle_notified = {}
+    
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(websocket.recv(), read_timeout(True))
+            except asyncio.TimeoutError:
+                logger.info(f"Closing idle gateway connection {gateway_id}")
+                await websocket.close(1000, "idle timeout")
+                break
+            
+            try:
+                # 网关整体的限流桶按最大通道数放宽，解析后再按通道限流
+                message_class = classify_message(message)
+                retry_after = rate_limiter.check_gateway(message_class, gateway_id, GATEWAY_MAX_CHANNELS)
+                if retry_after is not None:
+                    now = time.monotonic()
+                    if now - throttle_notified.get(message_class, 0) >= 1:
+                        throttle_notified[message_class] = now
+                        await websocket.send(json.dumps({
+                            "type": "throttled",
+                            "message_class": message_class,
+                            "retry_after": retry_after
+                        }))
+                    continue
+                
+                data = json.loads(message)
+                
+                # 打开通道：注册设备，同一设备已有连接时接管其会话
+                if 'channel_open' in data:
+                    channel_id = data['channel_open'].get('device_id')
+                    if not channel_id:
+                        continue
+                    if channel_id not in channels and len(channels) >= GATEWAY_MAX_CHANNELS:
+                        await websocket.send(json.dumps({
+                            "type": "channel_error",
+                            "channel": channel_id,
+                            "error": f"Too many channels (max {GATEWAY_MAX_CHANNELS})"
+                        }))
+                        continue
+                    supervisor = channels.get(channel_id)
+                    if supervisor is None or supervisor.closed:
+                        supervisor = SessionSupervisor(websocket, device_manager, DEVICE_MCP_MANAGERS, multiplexed=True)
+                        channels[channel_id] = supervisor
+                        await take_over_device(supervisor, channel_id)
+                    device_name = data['channel_open'].get('device_name', '')
+                    device_config = await device_manager.register_device(channel_id, device_name)
+                    logger.info(f"Gateway {gateway_id} opened channel for device {channel_id}")
+                    await supervisor.send({"type": "channel_opened", "config": device_config})
+                    continue
+                
+                channel_id = data.get('channel')
+                supervisor = channels.get(channel_id)
+                if supervisor is not None and supervisor.closed:
+                    # 通道已被同一设备的其他连接接管
+                    del channels[channel_id]
+                    supervisor = None
+                
+                if 'channel_close' in data:
+                    if supervisor:
+                        await supervisor.close()
+                        del channels[channel_id]
+                    await websocket.send(json.dumps({"type": "channel_closed", "channel": channel_id}))
+                    continue
+                
+                if supervisor is None:
+                    await websocket.send(json.dumps({
+                        "type": "channel_error",
+                        "channel": channel_id,
+                        "error": "Channel not open"
+                    }))
+                    continue
+                
+                # 通道级限流和背压：一个通道积压不影响其他通道
+                retry_after = rate_limiter.check(message_class, channel_id, None)
+                if retry_after is None and message_class == 'audio' and supervisor.session \
+                        and supervisor.session.audio_backlog() > GATEWAY_CHANNEL_MAX_BACKLOG:
+                    retry_after = supervisor.session.audio_frame_ms / 1000
+                if retry_after is not None:
+                    await notify_throttled(supervisor, channel_throttle_notified.setdefault(channel_id, {}), message_class, retry_after)
+                    continue
+                
+                if 'interrupt' in data:
+                    if supervisor.session:
+                        supervisor.session.flush_pending_audio()
+                    continue
+                
+                if 'event' in data or 'start' in data:
+                    await handle_device_event(supervisor, data)
+            
+            except json.JSONDecodeError:
+                logger.error("Invalid JSON received")
+            except Exception as e:
+                logger.error(f"Error processing gateway message: {e}")
+    
+    except websockets.exceptions.ConnectionClosed:
+        logger.info(f"Gateway {gateway_id} disconnected")
+    finally:
+        for supervisor in channels.values():
+            await supervisor.close()
+
+def apply_device_config(data, device_config, is_system=False):
+    """把设备配置应用到S2S事件：推理参数、语音、工具和系统提示词"""
+    event_type = list(data['event'].keys())[0]
+    
+    if event_type == 'sessionStart':
+        data['event']['sessionStart']['inferenceConfiguration'] = {
+            'maxTokens': device_config.get('max_tokens', 1024),
+            'topP': device_config.get('top_p', 0.95),
+            'temperature': device_config.get('temperature', 0.7)
+        }
+    
+    elif event_type == 'promptStart':
+        # 应用语音配置
+        if 'audioOutputConfiguration' in data['event']['promptStart']:
+            data['event']['promptStart']['audioOutputConfiguration']['voiceId'] = device_config.get('voice_id', 'matthew')
+        
+        # 应用工具配置
+        data['event']['promptStart']['toolConfiguration'] = device_manager.build_tool_config(device_config)
+    
+    elif event_type == 'textInput' and (is_system or data['event']['textInput'].get('content') == 'SYSTEM_PROMPT'):
+        # 替换系统提示词
+        data['event']['textInput']['content'] = device_config.get('system_prompt', 'You are a friendly assistant.')
+    
+    return data
+
+async def resume_device_session(device_id, device_config, stream_manager, replay=True):
+    """恢复空闲释放的会话：并行重连MCP服务器和Bedrock流"""
+    started = time.monotonic()
+    mcp_manager = DEVICE_MCP_MANAGERS.get(device_id)
+    if mcp_manager:
+        _, resumed = await asyncio.gather(
+            mcp_manager.load_servers_for_device(device_config),
+            stream_manager.resume(replay=replay),
+            return_exceptions=True
+        )
+        if isinstance(resumed, BaseException):
+            # 流未能恢复（如准入被拒绝），保持释放状态
+            await mcp_manager.cleanup_all()
+            raise resumed
+    else:
+        await stream_manager.resume(replay=replay)
+    logger.info(f"Session resumed for device {device_id} in {time.monotonic() - started:.2f}s")
+
+async def idle_reaper():
+    """释放空闲设备的Bedrock流、后台任务和MCP连接"""
+    while True:
+        await asyncio.sleep(IDLE_REAPER_INTERVAL)
+        for device_id, session in list(device_manager.device_sessions.items()):
+            try:
+                if not session or session.suspended or not session.is_active or not session.idle_timeout:
+                    continue
+                if session.idle_seconds() < session.idle_timeout:
+                    continue
+                await session.suspend()
+                if device_id in DEVICE_MCP_MANAGERS:
+                    await DEVICE_MCP_MANAGERS[device_id].cleanup_all()
+                logger.info(f"Device {device_id} idle for {session.idle_timeout}s, upstream session released")
+            except Exception as e:
+                logger.error(f"Error releasing idle session for device {device_id}: {e}")
+
+async def resource_monitor():
+    """定期检查关闭后仍在运行的任务，并记录资源数量"""
+    while True:
+        await asyncio.sleep(RESOURCE_CHECK_INTERVAL)
+        try:
+            leaks = supervisor_registry.find_leaks()
+            if leaks:
+                logger.warning(f"{len(leaks)} tasks still running after their connection closed: {leaks[:10]}")
+            logger.debug(f"Resources: {supervisor_registry.counts()}")
+        except Exception as e:
+            logger.error(f"Error checking resources: {e}")
+
+async def tool_catalog_refresher():
+    """已连接的MCP服务器的工具目录过期后在后台刷新（同一连接配置只刷新一次）"""
+    while True:
+        await asyncio.sleep(60)
+        refreshing = set()
+        for mcp_manager in list(DEVICE_MCP_MANAGERS.values()):
+            for client in list(mcp_manager.clients.values()):
+                key = config_hash(client.config)
+                if client.connected and key not in refreshing and mcp_tool_catalog.is_stale(client.config):
+                    refreshing.add(key)
+                    client.refresh_catalog()
+
+async def mcp_pool_maintainer():
+    """定期替换进程池中到期的stdio MCP进程，停止预热长时间无人使用的配置"""
+    while True:
+        await asyncio.sleep(60)
+        mcp_process_pool.maintain()
+
+async def mcp_health_prober():
+    """熔断中的MCP服务器定期探测（每个连接配置探测一个客户端），恢复后关闭熔断"""
+    while True:
+        await asyncio.sleep(MCP_PROBE_INTERVAL)
+        open_breakers = mcp_breakers.open_breakers()
+        if not open_breakers:
+            continue
+        probes = {}
+        for mcp_manager in list(DEVICE_MCP_MANAGERS.values()):
+            for client in list(mcp_manager.clients.values()):
+                key = config_hash(client.config)
+                if key in open_breakers and key not in probes:
+                    probes[key] = client
+        results = await asyncio.gather(*(client.probe() for client in probes.values()), return_exceptions=True)
+        for client, result in zip(probes.values(), results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error probing MCP server '{client.config.get('name')}': {result}")
 
-async def forward_responses(websocket, stream_manager, device_id):
+async def forward_responses(supervisor, stream_manager):
     """转发响应到设备"""
     try:
         while True:
             response = await stream_manager.output_queue.get()
-            response['device_id'] = device_id
-            await websocket.send(json.dumps(response))
+            response['device_id'] = supervisor.device_id
+            await supervisor.send(response)
     except asyncio.CancelledError:
         pass
     except Exception as e:
         logger.error(f"Error forwarding responses: {e}")
 
+async def take_over_device(supervisor, device_id):
+    """设备只保留一个活跃连接：新连接替换旧连接并接管其会话和MCP连接"""
+    replaced = supervisor.take_over(device_id)
+    if replaced:
+        await replaced.evict()
+        logger.info(f"Device {device_id} reconnected, previous connection replaced")
+    elif WORKER_IPC:
+        # 旧连接可能在其他工作进程上，无法交接资源，只关闭旧连接
+        await WORKER_IPC.broadcast({"op": "evict_connection", "device_id": device_id})
+    
+    if supervisor.session is not None:
+        supervisor.forward_task = supervisor.spawn(forward_responses(supervisor, supervisor.session), "forward")
+
+def reconnect_elsewhere_message():
+    """通知设备连接其他节点，重连时间随机分散以避免重连风暴"""
+    return {"type": "reconnect_elsewhere", "retry_after": round(random.uniform(0, DRAIN_RECONNECT_JITTER), 2)}
+
+async def drain_connection(websocket, supervisors, deadline):
+    """等待连接上（网关连接上的所有通道）进行中的轮次结束并转发完已生成的响应，然后通知设备重连并关闭连接"""
+    sessions = [supervisor.session for supervisor in supervisors if supervisor.session]
+    while any(session.is_active and session.turn_in_progress for session in sessions) and time.monotonic() < deadline:
+        await asyncio.sleep(0.2)
+    while any(not session.output_queue.empty() for session in sessions) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    # 网关连接只通知一次，由网关整体重连
+    try:
+        await websocket.send(json.dumps(reconnect_elsewhere_message()))
+    except websockets.exceptions.ConnectionClosed:
+        pass
+    await websocket.close(1001, "server draining")
+
+async def drain(ws_server):
+    """优雅下线：停止接受新连接，等待进行中的轮次结束，分散通知设备重连到其他节点"""
+    global DRAINING
+    DRAINING = True
+    ws_server.close(close_connections=False)
+    connections = {}
+    for supervisor in list(supervisor_registry.live.values()):
+        connections.setdefault(supervisor.websocket, []).append(supervisor)
+    logger.info(f"Draining {len(connections)} connections (timeout {DRAIN_TIMEOUT}s)")
+    
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    await asyncio.gather(*(drain_connection(websocket, supervisors, deadline)
+                           for websocket, supervisors in connections.items()), return_exceptions=True)
+    # 等待各连接处理器的清理逻辑执行完毕
+    try:
+        await asyncio.wait_for(ws_server.wait_closed(), max(deadline - time.monotonic(), 5))
+    except asyncio.TimeoutError:
+        logger.warning("Timed out waiting for connection handlers to finish")
+
 # HTTP API 处理器
 def require_auth(handler):
     """认证装饰器"""
@@ -409,7 +820,7 @@ async def get_devices(request):
 async def get_device_config(request):
     """获取设备配置"""
     device_id = request.match_info['device_id']
-    config = await device_manager.get_device_config(device_id)
+    config = await device_manager.get_device_config(device_id, use_cache=False)
     if not config:
         return web.json_response({"error": "Device not found"}, status=404)
     return web.json_response(config)
@@ -424,22 +835,21 @@ async def update_device_config(request):
         return web.json_response({"error": "Device not found"}, status=404)
     
     # 检查是否需要重启会话的配置项
-    restart_triggers = ['system_prompt', 'voice_id', 'enable_mcp', 'mcp_servers', 'enable_strands', 'enable_kb', 'enable_agents']
-    should_restart = any(key in data for key in restart_triggers)
+    should_restart = any(key in data for key in RESTART_TRIGGERS)
+    
+    # 未监听配置变更时，其他进程收不到通知，由本进程通知它们失效缓存
+    if not db_manager.listening:
+        await broadcast_device_op('invalidate_config', device_id)
     
-    if should_restart:
+    # 监听配置变更时，重启和MCP重载由变更通知在持有设备的进程上完成
+    if should_restart and not db_manager.listening:
         # 如果MCP配置发生变化，重新加载MCP服务器
         if 'mcp_servers' in data or 'enable_mcp' in data:
-            updated_config = await device_manager.get_device_config(device_id)
-            if updated_config and device_id in DEVICE_MCP_MANAGERS:
-                await DEVICE_MCP_MANAGERS[device_id].load_servers_for_device(updated_config)
+            if await dispatch_device_op('reload_mcp', device_id):
                 logger.info(f"MCP servers reloaded for device {device_id}")
         
         # 断开与Sonic的S2S会话，保持WebSocket连接
-        session = device_manager.get_device_session(device_id)
-        if session:
-            await session.close()
-            device_manager.set_device_session(device_id, None)
+        if await dispatch_device_op('restart_session', device_id):
             logger.info(f"S2S session restarted for device {device_id} due to configuration change: {list(data.keys())}")
     
     return web.json_response({"success": True, "session_restarted": should_restart})
@@ -451,31 +861,229 @@ async def device_action(request):
     action = data.get('action')
     
     if action == 'restart_session':
-        session = device_manager.get_device_session(device_id)
-        if session:
-            await session.close()
-            device_manager.set_device_session(device_id, None)
+        if await dispatch_device_op('restart_session', device_id):
             logger.info(f"Session manually restarted for device {device_id}")
         return web.json_response({"success": True})
     
     return web.json_response({"error": "Unknown action"}, status=400)
 
+async def handle_config_change(change):
+    """处理配置变更通知：失效本进程缓存，并对本进程持有的设备重启会话或重载MCP"""
+    change_type = change.get('type')
+    
+    if change_type == 'resync':
+        # 监听断线期间可能错过通知
+        device_manager.invalidate_mcp_servers()
+        await mcp_tool_catalog.load()
+        # 重新读取本进程在线设备的配置，补做错过的配置变更（不知道变更了哪些字段，重载MCP并重启会话）
+        for device_id in device_manager.registered_devices():
+            device_config = await device_manager.get_device_config(device_id, use_cache=False)
+            version = (device_config or {}).get('version') or 0
+            if not device_manager.accept_config_version(device_id, version):
+                continue
+            await reload_local_mcp(device_id)
+            if await restart_local_session(device_id):
+                logger.info(f"S2S session restarted for device {device_id} after resync (config v{version})")
+    
+    elif change_type == 'mcp_tools':
+        # 某个MCP服务器的工具目录已刷新，新会话使用新的工具配置
+        await mcp_tool_catalog.load(change.get('config_hash'))
+    
+    elif change_type == 'device_config':
+        device_id = change.get('device_id')
+        device_manager.invalidate_config(device_id)
+        version = change.get('version') or 0
+        if not device_manager.accept_config_version(device_id, version):
+            return
+        
+        fields = change.get('fields', [])
+        if 'mcp_servers' in fields or 'enable_mcp' in fields:
+            if await reload_local_mcp(device_id):
+                logger.info(f"MCP servers reloaded for device {device_id} (config v{version})")
+        if any(field in RESTART_TRIGGERS for field in fields):
+            if await restart_local_session(device_id):
+                logger.info(f"S2S session restarted for device {device_id} due to configuration change: {fields}")
+    
+    elif change_type == 'mcp_server':
+        server_id = change.get('server_id')
+        device_manager.invalidate_mcp_servers()
+        for device_id, mcp_manager in list(DEVICE_MCP_MANAGERS.items()):
+            device_config = await device_manager.get_device_config(device_id)
+            referenced = any(client.config.get('id') == server_id for client in mcp_manager.clients.values()) or \
+                any(server.get('id') == server_id for server in (device_config or {}).get('mcp_servers', []))
+            if referenced and await reload_local_mcp(device_id):
+                logger.info(f"MCP servers reloaded for device {device_id} after MCP server {server_id} changed")
+
+async def restart_local_session(device_id):
+    """重启本进程持有的设备会话，设备不在本进程时返回False"""
+    session = device_manager.get_device_session(device_id)
+    if not session:
+        return False
+    await session.close()
+    device_manager.set_device_session(device_id, None)
+    return True
+
+async def reload_local_mcp(device_id):
+    """重新加载本进程持有的设备MCP服务器，设备不在本进程时返回False"""
+    if device_id not in DEVICE_MCP_MANAGERS:
+        return False
+    session = device_manager.get_device_session(device_id)
+    if session and session.suspended:
+        return True  # 空闲释放中，恢复会话时按最新配置加载
+    updated_config = await device_manager.get_device_config(device_id)
+    if updated_config:
+        await DEVICE_MCP_MANAGERS[device_id].load_servers_for_device(updated_config)
+    return True
+
+async def invalidate_local_config(device_id):
+    """失效本进程的设备配置缓存"""
+    device_manager.invalidate_config(device_id)
+    return True
+
+async def evict_local_connection(device_id):
+    """关闭本进程上该设备的旧连接（设备已在其他进程重新连接），设备不在本进程时返回False"""
+    supervisor = supervisor_registry.by_device.get(device_id)
+    if not supervisor:
+        return False
+    await supervisor.evict()
+    return True
+
+LOCAL_DEVICE_OPS = {
+    'restart_session': restart_local_session,
+    'reload_mcp': reload_local_mcp,
+    'evict_connection': evict_local_connection,
+    'invalidate_config': invalidate_local_config,
+}
+
+async def local_stream_stats(device_id):
+    """本进程持有的设备会话的发送延迟统计，设备不在本进程时返回None"""
+    session = device_manager.get_device_session(device_id)
+    if not session:
+        return None
+    return {"device_id": device_id, "worker_id": WORKER_ID, "send_latency": session.get_send_stats()}
+
+# 只读的设备查询：在持有设备的进程上执行，返回结果（不在本进程时为None）
+LOCAL_DEVICE_QUERIES = {
+    'stream_stats': local_stream_stats,
+}
+
+async def query_device(op, device_id):
+    """在持有该设备的进程上执行查询：先查本进程，多进程模式下再通过IPC转发"""
+    result = await LOCAL_DEVICE_QUERIES[op](device_id)
+    if result is None and WORKER_IPC:
+        responses = await WORKER_IPC.broadcast({"op": op, "device_id": device_id})
+        result = next((response['result'] for response in responses if response.get('result') is not None), None)
+    return result
+
+async def dispatch_device_op(op, device_id):
+    """在持有该设备的进程上执行操作：先尝试本进程，多进程模式下再通过IPC转发"""
+    if await LOCAL_DEVICE_OPS[op](device_id):
+        return True
+    if WORKER_IPC:
+        responses = await WORKER_IPC.broadcast({"op": op, "device_id": device_id})
+        return any(response.get('handled') for response in responses)
+    return False
+
+async def broadcast_device_op(op, device_id):
+    """在所有进程上执行操作（如失效配置缓存），不因某个进程已处理而停止"""
+    await LOCAL_DEVICE_OPS[op](device_id)
+    if WORKER_IPC:
+        await WORKER_IPC.broadcast({"op": op, "device_id": device_id})
+
+def worker_health():
+    """本进程的健康状态"""
+    return {
+        "status": "healthy",
+        "worker_id": WORKER_ID,
+        "pid": os.getpid(),
+        "uptime": int(time.monotonic() - STARTED_AT),
+        "connected_devices": len(device_manager.device_sessions),
+        "active_sessions": sum(1 for session in device_manager.device_sessions.values() if session and session.is_active),
+        "admission": admission_controller.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "resources": supervisor_registry.counts(),
+        "mcp_breakers": mcp_breakers.stats(),
+        "mcp_process_pool": mcp_process_pool.stats(),
+        "tool_results": tool_result_stats.stats(),
+    }
+
+async def handle_ipc_request(message):
+    """处理来自其他工作进程的IPC请求"""
+    op = message.get('op')
+    if op == 'health':
+        return worker_health()
+    if op == 'mcp_breakers':
+        return {"worker_id": WORKER_ID, "breakers": mcp_breakers.stats()}
+    if op in LOCAL_DEVICE_OPS:
+        return {"handled": await LOCAL_DEVICE_OPS[op](message.get('device_id'))}
+    if op in LOCAL_DEVICE_QUERIES:
+        return {"result": await LOCAL_DEVICE_QUERIES[op](message.get('device_id'))}
+    return {"error": f"Unknown op: {op}"}
+
+async def get_workers(request):
+    """获取所有工作进程的健康状态"""
+    workers = [worker_health()]
+    if WORKER_IPC:
+        workers.extend(await WORKER_IPC.broadcast({"op": "health"}))
+        expected = WORKER_IPC.worker_count
+    else:
+        expected = 1
+    workers.sort(key=lambda worker: worker.get('worker_id') or 0)
+    return web.json_response({"expected": expected, "responding": len(workers), "workers": workers})
+
+async def get_device_stream_stats(request):
+    """获取设备S2S输入流的分优先级发送延迟"""
+    device_id = request.match_info['device_id']
+    stats = await query_device('stream_stats', device_id)
+    if stats is None:
+        return web.json_response({"error": "No active session"}, status=404)
+    return web.json_response(stats)
+
 async def get_mcp_servers(request):
-    """获取所有MCP服务器配置"""
+    """获取所有MCP服务器配置，附带各工作进程的熔断状态。
+    breakers 为各进程各自的熔断器，breaker 为其中最严重的状态及熔断中的进程数"""
     servers = await db_manager.get_all_mcp_servers()
+    worker_breakers = [{"worker_id": WORKER_ID, "breakers": mcp_breakers.stats()}]
+    if WORKER_IPC:
+        worker_breakers.extend(await WORKER_IPC.broadcast({"op": "mcp_breakers"}))
+    for server in servers:
+        key = config_hash(server)
+        breakers = [dict(worker['breakers'][key], worker_id=worker.get('worker_id'))
+                    for worker in worker_breakers if key in worker.get('breakers', {})]
+        not_closed = [breaker for breaker in breakers if breaker['state'] != CircuitBreaker.CLOSED]
+        worst = max(not_closed, key=lambda breaker: breaker['state'] == CircuitBreaker.OPEN, default=None)
+        server['breakers'] = breakers
+        server['breaker'] = dict(worst or {"state": CircuitBreaker.CLOSED},
+                                 workers=len(worker_breakers), workers_tripped=len(not_closed))
     return web.json_response(servers)
 
+async def get_mcp_server_tools(request):
+    """获取MCP服务器缓存的工具目录"""
+    server_id = int(request.match_info['server_id'])
+    catalogs = await db_manager.get_server_tool_catalogs(server_id)
+    for catalog in catalogs:
+        if isinstance(catalog['tools'], str):
+            catalog['tools'] = json.loads(catalog['tools'])
+        catalog['fetched_at'] = catalog['fetched_at'].isoformat()
+    return web.json_response({"server_id": server_id, "catalogs": catalogs})
+
 async def create_mcp_server(request):
     """创建MCP服务器配置"""
     data = await request.json()
-    server_id = await db_manager.create_mcp_server(data)
+    try:
+        server_id = await db_manager.create_mcp_server(data)
+    except ValueError as e:
+        return web.json_response({"success": False, "error": str(e)}, status=400)
     return web.json_response({"success": True, "server_id": server_id})
 
 async def update_mcp_server(request):
     """更新MCP服务器配置"""
     server_id = int(request.match_info['server_id'])
     data = await request.json()
-    success = await db_manager.update_mcp_server(server_id, data)
+    try:
+        success = await db_manager.update_mcp_server(server_id, data)
+    except ValueError as e:
+        return web.json_response({"success": False, "error": str(e)}, status=400)
     return web.json_response({"success": success})
 
 async def delete_mcp_server(request):
@@ -508,7 +1116,7 @@ async def delete_user(request):
 
 async def health_check(request):
     """健康检查端点"""
-    return web.json_response({"status": "healthy", "service": "nova-sonic-server"})
+    return web.json_response({"status": "healthy", "service": "nova-sonic-server", "worker_id": WORKER_ID, "pid": os.getpid()})
 
 async def init_app():
     """初始化Web应用"""
@@ -516,6 +1124,7 @@ async def init_app():
     
     # 健康检查
     app.router.add_get('/health', health_check)
+    app.router.add_get('/api/workers', get_workers)
     
     # API路由
     app.router.add_post('/api/auth/login', login)
@@ -526,9 +1135,11 @@ async def init_app():
     app.router.add_get('/api/devices/{device_id}', get_device_config)
     app.router.add_put('/api/devices/{device_id}', update_device_config)
     app.router.add_post('/api/devices/{device_id}/action', device_action)
+    app.router.add_get('/api/devices/{device_id}/stats', get_device_stream_stats)
     
     # MCP服务器管理API
     app.router.add_get('/api/mcp-servers', get_mcp_servers)
+    app.router.add_get('/api/mcp-servers/{server_id}/tools', get_mcp_server_tools)
     app.router.add_post('/api/mcp-servers', create_mcp_server)
     app.router.add_put('/api/mcp-servers/{server_id}', update_mcp_server)
     app.router.add_delete('/api/mcp-servers/{server_id}', delete_mcp_server)
@@ -539,12 +1150,32 @@ async def init_app():
     
     return app
 
-async def main(host, port, http_port, enable_mcp=False, enable_strands=False):
+async def main(host, port, http_port, enable_mcp=False, enable_strands=False, reuse_port=False, ready=None):
     """主函数"""
     global MCP_CLIENT, STRANDS_AGENT
     
-    # 初始化数据库
-    await db_manager.initialize()
+    # SIGTERM（以及单进程模式下的Ctrl+C）触发优雅下线
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, stop_event.set)
+    if WORKER_ID is None:
+        loop.add_signal_handler(signal.SIGINT, stop_event.set)
+    
+    # 初始化数据库（多进程模式下表结构已由主进程创建）
+    await db_manager.initialize(create_schema=WORKER_ID is None)
+    
+    # 多进程模式下启动进程间IPC
+    if WORKER_IPC:
+        await WORKER_IPC.start(handle_ipc_request)
+    
+    # 加载缓存的MCP工具目录，会话启动时不必等待MCP服务器的 list_tools
+    try:
+        await mcp_tool_catalog.load()
+    except Exception as e:
+        logger.error(f"Failed to load MCP tool catalogs: {e}")
+    
+    # 监听跨进程/跨节点的配置变更
+    config_listener_task = asyncio.create_task(db_manager.listen_config_changes(handle_config_change))
     
     # 初始化集成服务
     if enable_mcp:
@@ -563,25 +1194,154 @@ async def main(host, port, http_port, enable_mcp=False, enable_strands=False):
             logger.error(f"Failed to initialize Strands: {e}")
     
     # 启动HTTP API服务器（包含WebSocket路由）
+    runner = None
     if http_port:
         app = await init_app()
         runner = web.AppRunner(app)
         await runner.setup()
-        site = web.TCPSite(runner, host, http_port)
+        site = web.TCPSite(runner, host, http_port, reuse_port=reuse_port or None)
         await site.start()
         logger.info(f"HTTP API server started at {host}:{http_port}")
     
+    # 启动空闲会话回收
+    reaper_task = asyncio.create_task(idle_reaper())
+    monitor_task = asyncio.create_task(resource_monitor())
+    catalog_task = asyncio.create_task(tool_catalog_refresher())
+    prober_task = asyncio.create_task(mcp_health_prober())
+    pool_task = asyncio.create_task(mcp_pool_maintainer())
+    
     # 启动独立的WebSocket服务器
-    async with websockets.serve(websocket_handler, host, port):
-        logger.info(f"WebSocket server started at {host}:{port}")
+    async with websockets.serve(websocket_handler, host, port, reuse_port=reuse_port, **serve_options()) as ws_server:
+        logger.info(f"WebSocket server started at {host}:{port}" + (f" (worker {WORKER_ID})" if WORKER_IPC else ""))
+        if ready is not None:
+            ready.set()
         
-        # 保持服务运行
-        await asyncio.Future()
+        # 运行直到收到下线信号
+        await stop_event.wait()
+        await drain(ws_server)
+    
+    # 按顺序释放资源：后台任务、剩余MCP连接、IPC、HTTP，最后关闭数据库
+    for task in (reaper_task, monitor_task, catalog_task, prober_task, pool_task, config_listener_task):
+        task.cancel()
+    await asyncio.gather(reaper_task, monitor_task, catalog_task, prober_task, pool_task, config_listener_task,
+                         return_exceptions=True)
+    for device_id, mcp_manager in list(DEVICE_MCP_MANAGERS.items()):
+        try:
+            await mcp_manager.cleanup_all()
+        except Exception as e:
+            logger.error(f"Error closing MCP servers for device {device_id}: {e}")
+    DEVICE_MCP_MANAGERS.clear()
+    await mcp_http_pool.aclose()
+    await mcp_process_pool.aclose()
+    if WORKER_IPC:
+        await WORKER_IPC.close()
+    if runner:
+        await runner.cleanup()
+    await db_manager.close()
+    logger.info("Server drained and stopped")
+
+def run_worker(worker_id, worker_count, ipc_dir, host, ws_port, http_port, enable_mcp, enable_strands, ready=None):
+    """工作进程入口：与其他工作进程通过SO_REUSEPORT共享WS和HTTP端口"""
+    global WORKER_ID, WORKER_IPC
+    WORKER_ID = worker_id
+    WORKER_IPC = WorkerIpc(worker_id, worker_count, ipc_dir)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # 由主进程统一处理Ctrl+C
+    try:
+        asyncio.run(main(host, ws_port, http_port, enable_mcp, enable_strands, reuse_port=True, ready=ready))
+    except KeyboardInterrupt:
+        pass
+
+def run_supervisor(worker_count, host, ws_port, http_port, enable_mcp, enable_strands):
+    """主进程：创建表结构后启动N个工作进程，退出的工作进程会被重新拉起。
+    SIGTERM/SIGINT 转发给工作进程并等待其排空；SIGHUP 逐个滚动重启工作进程"""
+    async def prepare_database():
+        await db_manager.initialize()
+        await db_manager.close()
+    asyncio.run(prepare_database())
+    
+    ipc_dir = os.getenv("WORKER_IPC_DIR", os.path.join(tempfile.gettempdir(), f"nova-sonic-{os.getpid()}"))
+    context = multiprocessing.get_context("fork")
+    workers = {}
+    retiring = []  # (进程, 强制结束时间)
+    stopping = False
+    reload_requested = False
+    
+    def start_worker(worker_id):
+        ready = context.Event()
+        process = context.Process(
+            target=run_worker,
+            args=(worker_id, worker_count, ipc_dir, host, ws_port, http_port, enable_mcp, enable_strands, ready),
+            name=f"nova-sonic-worker-{worker_id}",
+            daemon=False
+        )
+        process.start()
+        workers[worker_id] = process
+        logger.info(f"Worker {worker_id} started (pid {process.pid})")
+        return ready
+    
+    def retire(process):
+        """SIGTERM让工作进程进入排空模式，超过期限仍未退出则强制结束"""
+        if process.is_alive():
+            process.terminate()
+        retiring.append((process, time.monotonic() + DRAIN_TIMEOUT + 15))
+    
+    def reap_retiring():
+        for entry in list(retiring):
+            process, kill_at = entry
+            if not process.is_alive():
+                process.join()
+                retiring.remove(entry)
+            elif time.monotonic() > kill_at:
+                logger.warning(f"Worker pid {process.pid} did not drain in time, killing")
+                process.kill()
+    
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+    
+    def reload(signum, frame):
+        nonlocal reload_requested
+        reload_requested = True
+    
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGHUP, reload)
+    
+    for worker_id in range(worker_count):
+        start_worker(worker_id)
+    
+    while not stopping:
+        time.sleep(1)
+        if reload_requested:
+            reload_requested = False
+            logger.info("Rolling restart of workers")
+            for worker_id, old_process in list(workers.items()):
+                # 新进程就绪（已通过SO_REUSEPORT监听端口）后再让旧进程排空，端口始终有进程在接受连接
+                ready = start_worker(worker_id)
+                if not ready.wait(WORKER_READY_TIMEOUT):
+                    logger.warning(f"Worker {worker_id} not ready after {WORKER_READY_TIMEOUT}s")
+                retire(old_process)
+                if stopping:
+                    break
+        for worker_id, process in list(workers.items()):
+            if not process.is_alive() and not stopping:
+                logger.warning(f"Worker {worker_id} exited with code {process.exitcode}, restarting")
+                start_worker(worker_id)
+        reap_retiring()
+    
+    for process in workers.values():
+        retire(process)
+    while retiring:
+        time.sleep(0.5)
+        reap_retiring()
+    logger.info("All workers stopped")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Enhanced Nova S2S Server')
     parser.add_argument('--agent', type=str, help='Agent integration "mcp" or "strands"')
     parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+    parser.add_argument('--workers', type=int, default=int(os.getenv("SERVER_WORKERS", "1")),
+                        help='Number of worker processes sharing the ports (SO_REUSEPORT)')
     args = parser.parse_args()
     
     host = os.getenv("PYTHON_HOST", os.getenv("HOST", "localhost"))
@@ -591,6 +1351,10 @@ if __name__ == "__main__":
     enable_mcp = args.agent == "mcp"
     enable_strands = args.agent == "strands"
     
+    if args.workers > 1:
+        run_supervisor(args.workers, host, ws_port, http_port, enable_mcp, enable_strands)
+        raise SystemExit(0)
+    
     try:
         asyncio.run(main(host, ws_port, http_port, enable_mcp, enable_strands))
     except KeyboardInterrupt:
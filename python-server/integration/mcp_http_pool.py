@@ -0,0 +1,71 @@
+import os
+from typing import Dict, Optional, Tuple
+
+import httpx
+
+# 远程MCP服务器（SSE/HTTP）共享的keep-alive连接池，按源站（scheme, host, port）各一个。
+# SSE会话各自占用一个长连接，MCP_HTTP_MAX_CONNECTIONS 需要大于同一源站的并发会话数
+MCP_HTTP_MAX_CONNECTIONS = int(os.getenv("MCP_HTTP_MAX_CONNECTIONS", "256"))
+MCP_HTTP_MAX_KEEPALIVE = int(os.getenv("MCP_HTTP_MAX_KEEPALIVE", "32"))
+MCP_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("MCP_HTTP_KEEPALIVE_EXPIRY", "120"))
+# 建立TCP/TLS连接失败时的重试次数（不影响已建立的MCP会话）
+MCP_HTTP_RETRIES = int(os.getenv("MCP_HTTP_RETRIES", "2"))
+
+
+class _SharedTransport(httpx.AsyncBaseTransport):
+    """按源站转发到共享连接池；MCP会话关闭自己的httpx客户端时不关闭连接池"""
+
+    def __init__(self, pool: "McpHttpPool"):
+        self._pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._pool.transport_for(request.url).handle_async_request(request)
+
+    async def aclose(self):
+        pass
+
+
+class McpHttpPool:
+    """节点内所有SSE/HTTP MCP连接共用的HTTP连接池，复用TCP/TLS连接（也省去重复的DNS解析和握手）"""
+
+    def __init__(self):
+        self._transports: Dict[Tuple[bytes, bytes, Optional[int]], httpx.AsyncHTTPTransport] = {}
+        self._shared = _SharedTransport(self)
+        self.limits = httpx.Limits(
+            max_connections=MCP_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=MCP_HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=MCP_HTTP_KEEPALIVE_EXPIRY,
+        )
+
+    def transport_for(self, url: httpx.URL) -> httpx.AsyncHTTPTransport:
+        origin = (url.raw_scheme, url.raw_host, url.port)
+        transport = self._transports.get(origin)
+        if transport is None:
+            transport = self._transports[origin] = httpx.AsyncHTTPTransport(
+                limits=self.limits, retries=MCP_HTTP_RETRIES
+            )
+        return transport
+
+    def client_factory(self, headers: Optional[Dict[str, str]] = None, timeout: Optional[httpx.Timeout] = None,
+                       auth: Optional[httpx.Auth] = None) -> httpx.AsyncClient:
+        """供 sse_client/streamablehttp_client 使用的 httpx_client_factory，与MCP默认参数一致"""
+        return httpx.AsyncClient(
+            headers=headers,
+            timeout=timeout if timeout is not None else httpx.Timeout(30.0),
+            auth=auth,
+            follow_redirects=True,
+            transport=self._shared,
+        )
+
+    def stats(self) -> Dict:
+        return {"origins": len(self._transports)}
+
+    async def aclose(self):
+        """进程退出时关闭所有连接"""
+        transports, self._transports = list(self._transports.values()), {}
+        for transport in transports:
+            await transport.aclose()
+
+
+# 全局连接池实例
+mcp_http_pool = McpHttpPool()
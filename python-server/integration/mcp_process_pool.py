@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from contextlib import AsyncExitStack
+from typing import Deque, Dict, Optional
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+from mcp_resilience import MCP_CONNECT_TIMEOUT
+from tool_catalog import config_hash
+
+logger = logging.getLogger(__name__)
+
+# 每个常用stdio服务器配置预先启动并初始化的空闲进程数（0 表示不预热）
+MCP_POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "1"))
+# 进程处理 MCP_POOL_RECYCLE_CALLS 次调用或运行 MCP_POOL_RECYCLE_SECONDS 秒后换成新进程，限制内存增长
+MCP_POOL_RECYCLE_CALLS = int(os.getenv("MCP_POOL_RECYCLE_CALLS", "500"))
+MCP_POOL_RECYCLE_SECONDS = float(os.getenv("MCP_POOL_RECYCLE_SECONDS", "1800"))
+# 配置超过该时长没有会话使用时不再预热
+MCP_POOL_IDLE_SECONDS = float(os.getenv("MCP_POOL_IDLE_SECONDS", "1800"))
+
+
+class McpProcess:
+    """一个已初始化（完成 ClientSession.initialize）的stdio MCP服务器进程，由专门的任务持有"""
+
+    def __init__(self, server_config: dict, params: StdioServerParameters):
+        self.name = server_config.get('name', 'mcp')
+        self.params = params
+        self.session: Optional[ClientSession] = None
+        self.calls = 0
+        self.started_at = 0.0
+        # 服务器通知（如工具列表变化）转给当前使用该进程的客户端
+        self.on_message = None
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """启动进程并完成MCP初始化，超过 MCP_CONNECT_TIMEOUT 视为失败"""
+        ready = asyncio.get_running_loop().create_future()
+        self._task = asyncio.create_task(self._run(ready), name=f"mcp-process:{self.name}")
+        try:
+            await asyncio.shield(ready)
+        except asyncio.CancelledError:
+            # 调用方放弃等待：进程启动后立即关闭
+            self._closing.set()
+            raise
+
+    async def _run(self, ready: asyncio.Future):
+        try:
+            async with AsyncExitStack() as stack:
+                async with asyncio.timeout(MCP_CONNECT_TIMEOUT):
+                    read, write = await stack.enter_async_context(stdio_client(self.params))
+                    self.session = await stack.enter_async_context(
+                        ClientSession(read, write, message_handler=self._handle_message)
+                    )
+                    await self.session.initialize()
+                self.started_at = time.monotonic()
+                ready.set_result(None)
+                await self._closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e if isinstance(e, Exception) else ConnectionError("process start cancelled"))
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self.session = None
+
+    async def _handle_message(self, message):
+        if self.on_message:
+            await self.on_message(message)
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    def expired(self) -> bool:
+        """调用次数或运行时间已到，应换成新进程"""
+        return self.calls >= MCP_POOL_RECYCLE_CALLS or time.monotonic() - self.started_at >= MCP_POOL_RECYCLE_SECONDS
+
+    async def close(self):
+        """结束进程（在持有它的任务中退出stdio上下文）"""
+        self._closing.set()
+        task = self._task
+        if task and task is not asyncio.current_task():
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class McpProcessPool:
+    """节点级的stdio MCP进程预热池：为最近有会话使用的服务器配置保持 MCP_POOL_SIZE 个空闲的已初始化进程，
+    会话连接时直接取用，取走后在后台补充。进程交给会话后不再放回池中（服务器进程可能带有会话状态）"""
+
+    def __init__(self, size: int = MCP_POOL_SIZE):
+        self.size = size
+        self.idle: Dict[str, Deque[McpProcess]] = {}
+        # 配置哈希 -> (最近使用时间, 服务器配置, 启动参数)
+        self.demand: Dict[str, tuple] = {}
+        self._refill_tasks: Dict[str, asyncio.Task] = {}
+        self._closing_tasks = set()
+        self.hits = 0
+        self.misses = 0
+
+    async def checkout(self, server_config: dict, params: StdioServerParameters) -> McpProcess:
+        """取一个已初始化的进程，池中没有时现场启动"""
+        key = config_hash(server_config)
+        self.demand[key] = (time.monotonic(), server_config, params)
+        idle = self.idle.get(key)
+        while idle:
+            process = idle.popleft()
+            if process.alive and not process.expired():
+                self.hits += 1
+                self._refill(key)
+                return process
+            self._close_later(process)
+
+        self.misses += 1
+        self._refill(key)
+        process = McpProcess(server_config, params)
+        await process.start()
+        return process
+
+    def _refill(self, key: str):
+        """在后台把该配置的空闲进程补到 size 个"""
+        if self.size <= 0:
+            return
+        task = self._refill_tasks.get(key)
+        if task is None or task.done():
+            self._refill_tasks[key] = asyncio.create_task(self._fill(key), name=f"mcp-pool-refill:{key[:8]}")
+
+    async def _fill(self, key: str):
+        idle = self.idle.setdefault(key, deque())
+        while len(idle) < self.size and key in self.demand:
+            _, server_config, params = self.demand[key]
+            process = McpProcess(server_config, params)
+            try:
+                await process.start()
+            except Exception as e:
+                logger.warning(f"Failed to prewarm MCP server '{server_config.get('name')}': {e}")
+                return
+            idle.append(process)
+
+    def _close_later(self, process: McpProcess):
+        task = asyncio.create_task(process.close())
+        self._closing_tasks.add(task)
+        task.add_done_callback(self._closing_tasks.discard)
+
+    def maintain(self):
+        """定期调用：替换过期的空闲进程，停止预热长时间无人使用的配置"""
+        now = time.monotonic()
+        for key in list(self.demand):
+            last_used = self.demand[key][0]
+            idle = self.idle.get(key, deque())
+            if now - last_used > MCP_POOL_IDLE_SECONDS:
+                del self.demand[key]
+                while idle:
+                    self._close_later(idle.popleft())
+                continue
+            for process in [p for p in idle if not p.alive or p.expired()]:
+                idle.remove(process)
+                self._close_later(process)
+            if len(idle) < self.size:
+                self._refill(key)
+
+    def stats(self) -> Dict:
+        return {
+            "size": self.size,
+            "configs": len(self.demand),
+            "idle_processes": sum(len(idle) for idle in self.idle.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    async def aclose(self):
+        """进程退出时关闭所有空闲进程"""
+        for task in self._refill_tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._refill_tasks.values(), return_exceptions=True)
+        self.demand.clear()
+        processes = [process for idle in self.idle.values() for process in idle]
+        self.idle.clear()
+        await asyncio.gather(*(process.close() for process in processes), *self._closing_tasks,
+                             return_exceptions=True)
+
+
+# 全局进程池实例
+mcp_process_pool = McpProcessPool()
@@ -4,158 +4,404 @@ import aiohttp
 from contextlib import AsyncExitStack
 from typing import Dict, List, Optional, Any
 from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
 from mcp.client.sse import sse_client
 from mcp.client.streamable_http import streamablehttp_client
+from mcp.shared.exceptions import McpError
+from tool_catalog import mcp_tool_catalog
+from integration.mcp_http_pool import mcp_http_pool
+from integration.mcp_process_pool import McpProcess, mcp_process_pool
+from mcp_resilience import (MCP_CONNECT_TIMEOUT, CallQueue, CallRejected, CircuitBreaker, busy_message, call_timeout,
+                            max_in_flight, mcp_breakers, replica_count, unavailable_message)
+
+def _json_field(server_config: Dict, field: str, default):
+    """数据库中的JSON字段可能是字符串或已解析的值"""
+    value = server_config.get(field)
+    if isinstance(value, str):
+        return json.loads(value) if value else default
+    return default if value is None else value
 
 class UniversalMcpClient:
     def __init__(self, server_config: Dict):
         self.config = server_config
         self.connection_type = server_config.get('connection_type', 'stdio')
+        # 连接参数只解析一次，重连时复用
+        self._args = _json_field(server_config, 'args', [])
+        self._env_vars = _json_field(server_config, 'env_vars', {})
+        self._headers = _json_field(server_config, 'headers', {})
         self.session: Optional[ClientSession] = None
-        self.exit_stack = AsyncExitStack()
+        # stdio服务器可以启动多个副本进程分担调用，session 为第一个副本
+        self.replicas: List[ClientSession] = []
+        self._replica_load: Dict[ClientSession, int] = {}
         self.connected = False
+        # stdio副本进程从节点的进程池取用，与 replicas 一一对应；到期的进程在后台换成新进程
+        self._processes: List[McpProcess] = []
+        self._recycle_task: Optional[asyncio.Task] = None
+        # SSE/HTTP连接由专门的任务持有（进入和退出传输上下文必须在同一个任务中），_closing 通知它关闭连接
+        self._owner_task: Optional[asyncio.Task] = None
+        self._closing: Optional[asyncio.Event] = None
+        self._connect_lock = asyncio.Lock()
+        self._background_connect: Optional[asyncio.Task] = None
+        # 所有副本共用的并发名额和等待队列
+        self.calls = CallQueue(max_in_flight(server_config) * replica_count(server_config))
+        # 后台刷新工具目录的任务
+        self._catalog_task: Optional[asyncio.Task] = None
+        # 同一连接配置的服务器共用的熔断器
+        self.breaker = mcp_breakers.get(server_config)
 
     async def connect(self):
+        """建立连接；失败时记录到熔断器，connected 保持为 False"""
         try:
             if self.connection_type == 'stdio':
-                await self._connect_stdio()
-            elif self.connection_type == 'sse':
-                await self._connect_sse()
-            elif self.connection_type == 'http':
-                await self._connect_http()
+                # 常用配置的进程已在进程池中启动并初始化，不需要等待进程启动
+                await self._checkout_processes()
             else:
-                raise ValueError(f"Unsupported connection type: {self.connection_type}")
-            
-            if self.session:
-                await self.session.initialize()
-                self.connected = True
-                
+                await self._open_connection()
         except Exception as e:
-            print(f"Failed to connect to MCP server {self.config['name']}: {e}")
-            self.connected = False
-
-    async def _connect_stdio(self):
-        env_vars = json.loads(self.config.get('env_vars', '{}'))
-        args = json.loads(self.config.get('args', '[]'))
+            error = f"connect timed out after {MCP_CONNECT_TIMEOUT}s" if isinstance(e, TimeoutError) else str(e)
+            print(f"Failed to connect to MCP server {self.config['name']}: {error}")
+            self.breaker.record_failure(error)
+            await self._reset()
+            return
         
+        # 工具目录缺失或过期时在后台刷新，连接（和会话启动）不等待 list_tools
+        if mcp_tool_catalog.is_stale(self.config):
+            self.refresh_catalog()
+
+    async def _checkout_processes(self):
+        """从进程池取 replicas 个已初始化的stdio进程"""
         server_params = StdioServerParameters(
             command=self.config['command'],
-            args=args,
-            env=env_vars
+            args=self._args,
+            env=self._env_vars
         )
-        
-        stdio_transport = await self.exit_stack.enter_async_context(
-            stdio_client(server_params)
-        )
-        stdio, write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(
-            ClientSession(stdio, write)
+        results = await asyncio.gather(
+            *(mcp_process_pool.checkout(self.config, server_params) for _ in range(replica_count(self.config))),
+            return_exceptions=True
         )
+        processes = [result for result in results if isinstance(result, McpProcess)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            await asyncio.gather(*(process.close() for process in processes))
+            raise errors[0]
+        
+        for process in processes:
+            process.on_message = self._handle_message
+        self._processes = processes
+        self.replicas = [process.session for process in processes]
+        self.session = self.replicas[0]
+        self.connected = True
+
+    async def _open_connection(self):
+        """启动SSE/HTTP连接任务，等待MCP会话初始化完成"""
+        ready = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._owner_task = asyncio.create_task(self._own_connection(ready, self._closing),
+                                               name=f"mcp:{self.config['name']}")
+        # 调用方被取消时连接任务继续完成建立，之后由 cleanup 关闭
+        await asyncio.shield(ready)
+
+    async def _own_connection(self, ready: asyncio.Future, closing: asyncio.Event):
+        """连接任务：建立传输和MCP会话，保持到 closing，然后在同一任务中关闭"""
+        try:
+            async with AsyncExitStack() as stack:
+                # 不可达的端点不能无限期阻塞调用方
+                async with asyncio.timeout(MCP_CONNECT_TIMEOUT):
+                    if self.connection_type == 'sse':
+                        await self._connect_sse(stack)
+                    elif self.connection_type == 'http':
+                        await self._connect_http(stack)
+                    else:
+                        raise ValueError(f"Unsupported connection type: {self.connection_type}")
+                    await asyncio.gather(*(replica.initialize() for replica in self.replicas))
+                
+                self.session = self.replicas[0]
+                self.connected = True
+                ready.set_result(None)
+                await closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e if isinstance(e, Exception) else ConnectionError("connect cancelled"))
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self.connected = False
+
+    async def ensure_connected(self) -> bool:
+        """按需连接（首次调用工具时），并发的调用只连接一次"""
+        async with self._connect_lock:
+            if not self.connected:
+                await self.connect()
+            return self.connected
+
+    def connect_in_background(self):
+        """后台连接，不阻塞调用方（如只为获取工具目录）"""
+        if self._background_connect is None or self._background_connect.done():
+            self._background_connect = asyncio.create_task(self.ensure_connected())
+
+    async def _reset(self):
+        """关闭未完成或已失效的连接，之后可以重新连接"""
+        owner, self._owner_task = self._owner_task, None
+        if self._closing:
+            self._closing.set()
+        if owner and owner is not asyncio.current_task():
+            try:
+                await owner
+            except (asyncio.CancelledError, Exception):
+                pass
+        processes, self._processes = self._processes, []
+        await asyncio.gather(*(process.close() for process in processes))
+        self.connected = False
+        self.session = None
+        self.replicas = []
+        self._replica_load.clear()
+
+    async def probe(self) -> bool:
+        """健康探测：已连接时ping服务器，否则尝试重新连接；成功时关闭熔断"""
+        if self.connected:
+            try:
+                async with asyncio.timeout(call_timeout(self.config)):
+                    await asyncio.gather(*(replica.send_ping() for replica in self.replicas))
+            except Exception as e:
+                self.breaker.record_failure(f"ping failed: {e or type(e).__name__}")
+                await self._reset()
+                return False
+        elif not await self.ensure_connected():
+            return False
+        self.breaker.record_success()
+        return True
 
-    async def _connect_sse(self):
+    def _recycle(self, process: McpProcess):
+        """进程达到调用次数或运行时间上限后在后台换成新进程（同一时间只替换一个）"""
+        if process in self._processes and (self._recycle_task is None or self._recycle_task.done()):
+            self._recycle_task = asyncio.create_task(self._replace_process(process))
+
+    async def _replace_process(self, old: McpProcess):
+        """从进程池取新进程替换旧进程，旧进程上的调用完成后关闭它"""
+        server_params = old.params
+        try:
+            process = await mcp_process_pool.checkout(self.config, server_params)
+        except Exception as e:
+            print(f"Failed to recycle MCP server {self.config['name']} process: {e}")
+            return
+        if old not in self._processes:
+            # 替换期间连接已重置
+            await process.close()
+            return
+        
+        index = self._processes.index(old)
+        old_session = self.replicas[index]
+        process.on_message = self._handle_message
+        self._processes[index] = process
+        self.replicas[index] = process.session
+        self.session = self.replicas[0]
+        try:
+            async with asyncio.timeout(call_timeout(self.config)):
+                while self._replica_load.get(old_session, 0) > 0:
+                    await asyncio.sleep(0.1)
+        except TimeoutError:
+            pass
+        finally:
+            self._replica_load.pop(old_session, None)
+            await old.close()
+
+    async def _connect_sse(self, stack: AsyncExitStack):
         url = self.config.get('url')
         if not url:
             raise ValueError("SSE connection requires URL")
         
-        headers = json.loads(self.config.get('headers', '{}'))
-        
-        sse_transport = await self.exit_stack.enter_async_context(
-            sse_client(url, headers=headers)
+        # 使用节点共享的keep-alive连接池
+        sse_transport = await stack.enter_async_context(
+            sse_client(url, headers=self._headers, httpx_client_factory=mcp_http_pool.client_factory)
         )
         read, write = sse_transport
-        self.session = await self.exit_stack.enter_async_context(
-            ClientSession(read, write)
-        )
+        self.replicas.append(await stack.enter_async_context(
+            ClientSession(read, write, message_handler=self._handle_message)
+        ))
 
-    async def _connect_http(self):
+    async def _connect_http(self, stack: AsyncExitStack):
         url = self.config.get('url')
         if not url:
             raise ValueError("HTTP connection requires URL")
         
-        headers = json.loads(self.config.get('headers', '{}'))
-        
-        http_transport = await self.exit_stack.enter_async_context(
-            streamablehttp_client(url, headers=headers)
+        http_transport = await stack.enter_async_context(
+            streamablehttp_client(url, headers=self._headers, httpx_client_factory=mcp_http_pool.client_factory)
         )
         read, write = http_transport
-        self.session = await self.exit_stack.enter_async_context(
-            ClientSession(read, write)
-        )
+        self.replicas.append(await stack.enter_async_context(
+            ClientSession(read, write, message_handler=self._handle_message)
+        ))
 
-    async def get_tools(self):
-        if not self.connected or not self.session:
-            return []
-        
+    async def _handle_message(self, message):
+        """服务器通知工具列表变化时刷新工具目录"""
+        notification = getattr(message, 'root', message)
+        if getattr(notification, 'method', None) == 'notifications/tools/list_changed':
+            self.refresh_catalog()
+
+    def refresh_catalog(self):
+        """在后台刷新工具目录（同一时间只有一个刷新任务）"""
+        if self._catalog_task is None or self._catalog_task.done():
+            self._catalog_task = asyncio.create_task(self._fetch_catalog())
+
+    async def _fetch_catalog(self):
+        """读取服务器的工具列表，写入工具目录供生成工具配置使用"""
         try:
             tools_result = await self.session.list_tools()
-            return [
-                {
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": tool.inputSchema,
-                    },
-                }
-                for tool in tools_result.tools
-            ]
         except Exception as e:
-            print(f"Error getting tools: {e}")
-            return []
+            print(f"Error listing tools for MCP server {self.config['name']}: {e}")
+            return
+        tools = [
+            {"name": tool.name, "description": tool.description or "", "inputSchema": tool.inputSchema}
+            for tool in tools_result.tools
+        ]
+        await mcp_tool_catalog.store(self.config, tools)
+
+    @property
+    def tool_names(self) -> set:
+        """工具目录中本服务器的工具名（按输入模式原样传参）"""
+        return {tool['name'] for tool in mcp_tool_catalog.tools(self.config) or []}
+
+    def resolve_tool(self, tool_name: str) -> Optional[str]:
+        """模型返回的工具名对应的服务器工具名（不区分大小写），不属于本服务器时返回None"""
+        for name in self.tool_names:
+            if name.lower() == tool_name.lower():
+                return name
+        if self.config.get('tool_name', '').lower() == tool_name.lower():
+            return self.config['tool_name']
+        return None
+
+    async def get_tools(self):
+        """从工具目录返回工具列表，不访问服务器"""
+        return [
+            {
+                "type": "function",
+                "function": {
+                    "name": tool['name'],
+                    "description": tool['description'],
+                    "parameters": tool['inputSchema'],
+                },
+            }
+            for tool in mcp_tool_catalog.tools(self.config) or []
+        ]
 
     async def call_tool(self, tool_name: str, tool_input):
-        if not self.connected or not self.session:
-            return "MCP server not connected"
+        # 熔断期间直接返回，不让语音回合等待一个已知不可用的服务器
+        if not self.breaker.allow():
+            return unavailable_message(self.config['name'])
+        trial = self.breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            return await self._call_tool(tool_name, tool_input)
+        finally:
+            if trial:
+                # 试探调用在所有退出路径上都要么记录了结果，要么放回试探名额，熔断器不会一直停在 half_open
+                self.breaker.release_trial()
+
+    async def _call_tool(self, tool_name: str, tool_input):
+        # 服务器在首次调用其工具时才连接
+        if not self.connected and not await self.ensure_connected():
+            return unavailable_message(self.config['name'])
         
         try:
             if isinstance(tool_input, str):
                 tool_input = json.loads(tool_input)
             
-            # 尝试从输入中提取查询参数
-            if "query" in tool_input:
+            # 通用查询工具：尝试从输入中提取查询参数；list_tools 提供的工具按其输入模式原样传参
+            if tool_name not in self.tool_names and "query" in tool_input:
                 params = {"query": tool_input["query"]}
             else:
                 params = tool_input
-            
-            response = await self.session.call_tool(tool_name, params)
-            
-            result = []
-            for content in response.content:
-                if hasattr(content, 'text'):
-                    result.append(content.text)
-                else:
-                    result.append(str(content))
-            
-            return result if result else "No result"
-            
         except Exception as e:
             return f"Error calling MCP tool: {e}"
+        
+        # 排队时间计入调用期限：在期限内等不到名额的调用直接告诉用户稍后再试
+        loop = asyncio.get_running_loop()
+        timeout = call_timeout(self.config)
+        deadline = loop.time() + timeout
+        try:
+            await self.calls.acquire(deadline)
+        except CallRejected as e:
+            print(f"MCP call to {self.config['name']} rejected: {e}")
+            return busy_message(self.config['name'])
+        
+        # 分配给当前调用最少的副本
+        replica = min(self.replicas, key=lambda session: self._replica_load.get(session, 0)) if self.replicas else None
+        started = loop.time()
+        try:
+            if replica is None:
+                raise ConnectionError("MCP server disconnected")
+            self._replica_load[replica] = self._replica_load.get(replica, 0) + 1
+            async with asyncio.timeout_at(deadline):
+                response = await replica.call_tool(tool_name, params)
+        except TimeoutError:
+            self.breaker.record_failure(f"call timed out after {timeout}s")
+            return unavailable_message(self.config['name'])
+        except McpError as e:
+            # 服务器返回了错误响应，服务器本身可用
+            self.breaker.record_success()
+            return f"Error calling MCP tool: {e}"
+        except Exception as e:
+            self.breaker.record_failure(str(e) or type(e).__name__)
+            # 连接失效（进程退出、SSE流断开）：下次调用时重新连接。
+            # Streamable HTTP 会话的每个请求各自从连接池取连接，单个请求失败不需要重建会话（探测失败时才重建）
+            if self.connection_type != 'http':
+                await self._reset()
+            return unavailable_message(self.config['name'])
+        finally:
+            if replica in self._replica_load:
+                self._replica_load[replica] -= 1
+            self.calls.release(loop.time() - started)
+            process = next((process for process in self._processes if process.session is replica), None)
+            if process:
+                process.calls += 1
+                if process.expired():
+                    self._recycle(process)
+        
+        self.breaker.record_success()
+        result = []
+        for content in response.content:
+            if hasattr(content, 'text'):
+                result.append(content.text)
+            else:
+                result.append(str(content))
+        
+        return result if result else "No result"
 
     async def cleanup(self):
-        await self.exit_stack.aclose()
-        self.connected = False
+        for task in (self._catalog_task, self._background_connect, self._recycle_task):
+            if task and not task.done():
+                task.cancel()
+        await self._reset()
 
 class UniversalMcpManager:
     def __init__(self):
         self.clients: Dict[str, UniversalMcpClient] = {}
     
     async def load_servers_for_device(self, device_config: Dict):
-        """为设备加载配置的MCP服务器"""
+        """为设备加载配置的MCP服务器：工具按缓存的工具目录公布，服务器在首次调用其工具时才连接。
+        标记为 eager 的服务器（延迟敏感的工具）在这里并行连接"""
         mcp_servers = device_config.get('mcp_servers', [])
         
         # 清理现有客户端
         await self.cleanup_all()
         
-        # 创建新客户端
+        eager = []
         for server_config in mcp_servers:
             client = UniversalMcpClient(server_config)
-            await client.connect()
-            if client.connected:
-                self.clients[server_config['name']] = client
-                print(f"MCP server '{server_config['name']}' connected successfully")
-            else:
-                print(f"Failed to connect MCP server '{server_config['name']}'")
+            self.clients[server_config['name']] = client
+            if client.breaker.is_open:
+                print(f"MCP server '{server_config['name']}' circuit is open, connecting later")
+            elif server_config.get('eager'):
+                eager.append(client)
+            elif mcp_tool_catalog.tools(server_config) is None:
+                # 还没有工具目录：后台连接以获取目录，不阻塞会话启动
+                client.connect_in_background()
+        
+        if eager:
+            await asyncio.gather(*(client.ensure_connected() for client in eager))
+            for client in eager:
+                if client.connected:
+                    print(f"MCP server '{client.config['name']}' connected successfully")
+                else:
+                    print(f"Failed to connect MCP server '{client.config['name']}'")
     
     async def call_tool(self, server_name: str, tool_name: str, tool_input):
         """调用指定服务器的工具"""
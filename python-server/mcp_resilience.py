@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from tool_catalog import config_hash
+
+logger = logging.getLogger(__name__)
+
+# MCP调用和连接的默认期限（秒），服务器可在 mcp_servers.call_timeout 中单独设置调用期限
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "15"))
+MCP_CONNECT_TIMEOUT = float(os.getenv("MCP_CONNECT_TIMEOUT", "15"))
+# 熔断：连续失败 MCP_BREAKER_FAILURES 次后断开，MCP_BREAKER_COOLDOWN 秒后允许一次试探调用
+MCP_BREAKER_FAILURES = int(os.getenv("MCP_BREAKER_FAILURES", "3"))
+MCP_BREAKER_COOLDOWN = float(os.getenv("MCP_BREAKER_COOLDOWN", "30"))
+# 熔断期间后台探测服务器健康的间隔（秒）
+MCP_PROBE_INTERVAL = float(os.getenv("MCP_PROBE_INTERVAL", "10"))
+# 每个服务器进程（副本）同时执行的调用数，服务器可在 mcp_servers.max_in_flight 中单独设置；超出的调用排队
+MCP_MAX_IN_FLIGHT = int(os.getenv("MCP_MAX_IN_FLIGHT", "4"))
+MCP_MAX_QUEUE = int(os.getenv("MCP_MAX_QUEUE", "16"))
+
+
+def call_timeout(server_config: dict) -> float:
+    """服务器的调用期限"""
+    return float(server_config.get('call_timeout') or MCP_CALL_TIMEOUT)
+
+
+def max_in_flight(server_config: dict) -> int:
+    """服务器每个副本的并发调用上限"""
+    return int(server_config.get('max_in_flight') or MCP_MAX_IN_FLIGHT)
+
+
+def replica_count(server_config: dict) -> int:
+    """stdio服务器启动的副本进程数，SSE/HTTP端点本身支持并发请求，只用一个连接"""
+    if server_config.get('connection_type', 'stdio') != 'stdio':
+        return 1
+    return max(1, int(server_config.get('replicas') or 1))
+
+
+def busy_message(server_name: str) -> str:
+    """调用排队已满或排队等待会超过期限时返回给模型的工具结果"""
+    return (f"The {server_name} service is busy right now. "
+            f"Tell the user to try again in a moment.")
+
+
+def unavailable_message(server_name: str) -> str:
+    """熔断或超时时返回给模型的工具结果，模型可以直接转述给用户"""
+    return (f"The {server_name} service is not responding right now. "
+            f"Tell the user it is temporarily unavailable and offer to try again later.")
+
+
+class CallRejected(Exception):
+    """调用未能在期限内获得执行名额"""
+
+
+class CallQueue:
+    """服务器的并发调用名额和有界FIFO等待队列。
+    按平均调用耗时估计排队时间，等不到期限内执行的调用立即拒绝，不占用队列"""
+
+    def __init__(self, slots: int, max_queue: int = MCP_MAX_QUEUE):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters = deque()
+        # 调用耗时的指数移动平均（秒）
+        self.avg_call_seconds = 0.0
+        self.completed = 0
+        self.rejected = 0
+
+    def estimated_wait(self) -> float:
+        """新调用排到执行大约需要的秒数"""
+        return (len(self.waiters) + 1) / self.slots * self.avg_call_seconds
+
+    async def acquire(self, deadline: float):
+        """获取执行名额，deadline 为事件循环时间；排队已满或来不及执行时抛出 CallRejected"""
+        if self.in_flight < self.slots and not self.waiters:
+            self.in_flight += 1
+            return
+        loop = asyncio.get_running_loop()
+        remaining = deadline - loop.time()
+        if len(self.waiters) >= self.max_queue:
+            self.rejected += 1
+            raise CallRejected(f"queue full ({self.max_queue} waiting)")
+        if self.estimated_wait() >= remaining:
+            self.rejected += 1
+            raise CallRejected(f"estimated wait {self.estimated_wait():.1f}s exceeds deadline")
+
+        waiter = loop.create_future()
+        self.waiters.append(waiter)
+        try:
+            # 名额由 release 直接转交给队首的调用
+            await asyncio.wait_for(waiter, remaining)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            self.rejected += 1
+            raise CallRejected("deadline passed while queued")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+    def release(self, call_seconds: Optional[float] = None):
+        """归还名额；有排队的调用时直接转交给队首"""
+        if call_seconds is not None:
+            self.completed += 1
+            self.avg_call_seconds = call_seconds if self.completed == 1 else \
+                0.8 * self.avg_call_seconds + 0.2 * call_seconds
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def _remove(self, waiter):
+        try:
+            self.waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self) -> Dict:
+        return {
+            "slots": self.slots,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "avg_call_seconds": round(self.avg_call_seconds, 3),
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+class CircuitBreaker:
+    """一个MCP服务器（按连接配置）的熔断器：closed 正常调用，open 直接失败，half_open 只放行一次试探调用"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: int = MCP_BREAKER_FAILURES, cooldown: float = MCP_BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """是否可以调用；冷却期过后放行一次试探调用"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            return True
+        self.rejected += 1
+        return False
+
+    def release_trial(self):
+        """试探调用没有得出结果（如排队被拒绝、参数无效）：放回试探名额，下一个调用可以继续试探"""
+        if self.state == self.HALF_OPEN:
+            # opened_at 不变，冷却期已过
+            self.state = self.OPEN
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"MCP server '{self.name}' recovered, circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            logger.warning(f"MCP server '{self.name}' circuit opened after {self.failures} failures: {error}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != self.CLOSED
+
+    def stats(self) -> Dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "last_error": self.last_error,
+            "open_seconds": round(time.monotonic() - self.opened_at, 1) if self.is_open else 0,
+        }
+
+
+class BreakerRegistry:
+    """本进程的MCP熔断器，同一连接配置的服务器（不同设备的连接）共用一个"""
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, server_config: dict) -> CircuitBreaker:
+        key = config_hash(server_config)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(server_config.get('name', key))
+        return breaker
+
+    def open_breakers(self) -> Dict[str, CircuitBreaker]:
+        return {key: breaker for key, breaker in self.breakers.items() if breaker.is_open}
+
+    def stats(self) -> Dict:
+        return {key: breaker.stats() for key, breaker in self.breakers.items()}
+
+
+# 全局熔断器注册表
+mcp_breakers = BreakerRegistry()
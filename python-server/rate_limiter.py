@@ -0,0 +1,126 @@
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+# 默认限流配置：消息类别 -> (每秒令牌数, 桶容量)
+# 可通过环境变量 RATE_LIMIT_<类别> 覆盖，格式为 "速率/容量"，如 RATE_LIMIT_AUDIO=200/400
+DEFAULT_LIMITS = {
+    'audio': (200.0, 400.0),
+    'event': (20.0, 50.0),
+    'auth': (0.5, 5.0),
+    'user_action': (0.2, 3.0),
+}
+# 同一IP后面可能有多台设备，IP桶按设备桶的倍数放宽
+RATE_LIMIT_IP_MULTIPLIER = float(os.getenv("RATE_LIMIT_IP_MULTIPLIER", "20"))
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() != "false"
+# 超过该时长未使用的桶会被清理（秒）
+BUCKET_IDLE_SECONDS = 600
+
+
+def _load_limits() -> Dict[str, Tuple[float, float]]:
+    limits = dict(DEFAULT_LIMITS)
+    for message_class in DEFAULT_LIMITS:
+        value = os.getenv(f"RATE_LIMIT_{message_class.upper()}")
+        if value:
+            rate, _, burst = value.partition('/')
+            limits[message_class] = (float(rate), float(burst or rate))
+    return limits
+
+
+def classify_message(message) -> str:
+    """不解析JSON，按原始文本判断消息类别"""
+    if isinstance(message, bytes):
+        return 'event'
+    if '"audioInput"' in message:
+        return 'audio'
+    if '"user_action"' in message:
+        return 'user_action'
+    if '"auth"' in message:
+        return 'auth'
+    return 'event'
+
+
+class TokenBucket:
+    """令牌桶"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def consume(self, now: float, amount: float = 1.0) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def retry_after(self, amount: float = 1.0) -> float:
+        return (amount - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+
+class RateLimiter:
+    """WebSocket入口限流：每个设备和每个IP按消息类别各有一个令牌桶"""
+
+    def __init__(self, limits: Optional[Dict[str, Tuple[float, float]]] = None,
+                 ip_multiplier: float = RATE_LIMIT_IP_MULTIPLIER, enabled: bool = RATE_LIMIT_ENABLED):
+        self.limits = limits or _load_limits()
+        self.ip_multiplier = ip_multiplier
+        self.enabled = enabled
+        self.buckets: Dict[Tuple[str, str, str], TokenBucket] = {}
+        self.allowed = {message_class: 0 for message_class in self.limits}
+        self.throttled = {message_class: 0 for message_class in self.limits}
+        self._last_prune = time.monotonic()
+
+    def _bucket(self, scope: str, key: str, message_class: str, multiplier: float = 1.0) -> TokenBucket:
+        bucket = self.buckets.get((scope, key, message_class))
+        if bucket is None:
+            rate, burst = self.limits[message_class]
+            bucket = self.buckets[(scope, key, message_class)] = TokenBucket(rate * multiplier, burst * multiplier)
+        return bucket
+
+    def _consume(self, message_class: str, scopes) -> Optional[float]:
+        if not self.enabled or message_class not in self.limits:
+            return None
+        now = time.monotonic()
+        if now - self._last_prune > 60:
+            self._prune(now)
+
+        for scope, key, multiplier in scopes:
+            if key is None:
+                continue
+            bucket = self._bucket(scope, key, message_class, multiplier)
+            if not bucket.consume(now):
+                self.throttled[message_class] += 1
+                return round(bucket.retry_after(), 2)
+        self.allowed[message_class] += 1
+        return None
+
+    def check(self, message_class: str, device_id: Optional[str], ip: Optional[str]) -> Optional[float]:
+        """允许时返回None，否则返回建议的重试秒数"""
+        return self._consume(message_class, (('device', device_id, 1.0), ('ip', ip, self.ip_multiplier)))
+
+    def check_gateway(self, message_class: str, gateway_id: str, channels: int) -> Optional[float]:
+        """网关连接整体的限流，按其最大通道数放宽；各通道另按设备限流"""
+        return self._consume(message_class, (('gateway', gateway_id, float(channels)),))
+
+    def _prune(self, now: float):
+        self._last_prune = now
+        for bucket_key in [k for k, b in self.buckets.items() if now - b.updated > BUCKET_IDLE_SECONDS]:
+            del self.buckets[bucket_key]
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "buckets": len(self.buckets),
+            "allowed": dict(self.allowed),
+            "throttled": dict(self.throttled),
+        }
+
+
+# 全局限流器实例
+rate_limiter = RateLimiter()
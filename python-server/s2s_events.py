@@ -28,6 +28,8 @@ class S2sEvent:
           "encoding": "base64",
           "audioType": "SPEECH"
         }
+  # Tools answered by the session manager itself rather than a dynamic MCP server (lowercase)
+  BUILTIN_TOOL_NAMES = ("getdatetool", "getkbtool", "getlocationtool", "externalagent", "getbookingdetails")
   DEFAULT_TOOL_CONFIG = {
           "tools": [
               {
@@ -157,15 +159,15 @@ class S2sEvent:
         }
 
   @staticmethod
-  def content_start_text(prompt_name, content_name):
+  def content_start_text(prompt_name, content_name, role="SYSTEM", interactive=True):
     return {
         "event":{
         "contentStart":{
           "promptName":prompt_name,
           "contentName":content_name,
           "type":"TEXT",
-          "interactive":True,
-          "role": "SYSTEM",
+          "interactive":interactive,
+          "role": role,
           "textInputConfiguration":{
             "mediaType":"text/plain"
             }
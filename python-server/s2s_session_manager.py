@@ -1,5 +1,10 @@
 import asyncio
+import copy
+import itertools
+from array import array
+from collections import deque
 import json
+import os
 import base64
 import warnings
 import uuid
@@ -10,12 +15,53 @@ from aws_sdk_bedrock_runtime.models import InvokeModelWithBidirectionalStreamInp
 from aws_sdk_bedrock_runtime.config import Config, HTTPAuthSchemeResolver, SigV4AuthScheme
 from smithy_aws_core.credentials_resolvers.environment import EnvironmentCredentialsResolver
 from integration import inline_agent, bedrock_knowledge_bases as kb
+from admission import AdmissionRejected
+from tool_results import encode_tool_result
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
 DEBUG = False
 
+# Uplink audio coalescing defaults (milliseconds)
+AUDIO_FRAME_MS = int(os.getenv("AUDIO_FRAME_MS", "100"))
+AUDIO_COALESCE_LATENCY_MS = int(os.getenv("AUDIO_COALESCE_LATENCY_MS", "40"))
+
+# Input stream priorities (lower is sent first). Control traffic such as tool
+# results jumps ahead of queued audio; events that must stay ordered behind
+# pending audio (e.g. the contentEnd closing the audio content) share its lane.
+PRIORITY_CONTROL = 0
+PRIORITY_AUDIO = 1
+PRIORITY_NAMES = {PRIORITY_CONTROL: "control", PRIORITY_AUDIO: "audio"}
+
+# Stream rollover: Nova Sonic limits how long one bidirectional stream may live.
+# After MAX_SESSION_SECONDS - ROLLOVER_MARGIN_SECONDS the stream is replaced at the
+# next turn boundary; ROLLOVER_HARD_MARGIN_SECONDS before the limit it is replaced
+# regardless, after waiting up to half the hard margin for outstanding tool calls
+# (the rest are answered with an error on the old stream, which alone knows their
+# toolUseIds). The last HISTORY_TURNS text turns are replayed into the new stream.
+MAX_SESSION_SECONDS = int(os.getenv("S2S_MAX_SESSION_SECONDS", "480"))
+ROLLOVER_MARGIN_SECONDS = int(os.getenv("S2S_ROLLOVER_MARGIN_SECONDS", "90"))
+ROLLOVER_HARD_MARGIN_SECONDS = int(os.getenv("S2S_ROLLOVER_HARD_MARGIN_SECONDS", "15"))
+HISTORY_TURNS = int(os.getenv("S2S_HISTORY_TURNS", "10"))
+HISTORY_TURN_MAX_CHARS = 1000
+
+# A stream that ends on its own is only replaced when it expired (near the age
+# limit, or an error naming a timeout/expiry); any other error would repeat on the
+# new stream. Streams ending within ROLLOVER_EARLY_SECONDS count as failed
+# rollovers: they are retried with exponential backoff from ROLLOVER_BACKOFF_SECONDS
+# and after ROLLOVER_MAX_FAILURES in a row the session is closed.
+ROLLOVER_EARLY_SECONDS = int(os.getenv("S2S_ROLLOVER_EARLY_SECONDS", "30"))
+ROLLOVER_MAX_FAILURES = int(os.getenv("S2S_ROLLOVER_MAX_FAILURES", "3"))
+ROLLOVER_BACKOFF_SECONDS = float(os.getenv("S2S_ROLLOVER_BACKOFF_SECONDS", "0.5"))
+STREAM_EXPIRY_MARKERS = ("timed out", "timeout", "expired", "exceeded")
+
+# Idle suspension: while suspended, device audio is only checked for speech
+# (peak sample above IDLE_WAKE_PEAK) and the last IDLE_PREROLL_CHUNKS chunks are
+# kept so the first words are not lost when the stream reopens.
+IDLE_WAKE_PEAK = int(os.getenv("IDLE_WAKE_PEAK", "1000"))
+IDLE_PREROLL_CHUNKS = int(os.getenv("IDLE_PREROLL_CHUNKS", "50"))
+
 def debug_print(message):
     """Print only if debug mode is enabled"""
     if DEBUG:
@@ -25,7 +71,8 @@ def debug_print(message):
 class S2sSessionManager:
     """Manages bidirectional streaming with AWS Bedrock using asyncio"""
     
-    def __init__(self, region, model_id='amazon.nova-sonic-v1:0', mcp_client=None, strands_agent=None, universal_mcp_manager=None):
+    def __init__(self, region, model_id='amazon.nova-sonic-v1:0', mcp_client=None, strands_agent=None, universal_mcp_manager=None,
+                 audio_frame_ms=None, audio_latency_ms=None, admission=None):
         """Initialize the stream manager."""
         self.model_id = model_id
         self.region = region
@@ -34,7 +81,45 @@ class S2sSessionManager:
         self.audio_input_queue = asyncio.Queue()
         self.output_queue = asyncio.Queue()
         
+        # Uplink coalescing: merge small device chunks into frames of audio_frame_ms,
+        # waiting no longer than audio_latency_ms for a frame to fill (0 disables)
+        self.audio_frame_ms = AUDIO_FRAME_MS if audio_frame_ms is None else audio_frame_ms
+        self.audio_latency_ms = AUDIO_COALESCE_LATENCY_MS if audio_latency_ms is None else audio_latency_ms
+        self.set_audio_input_config(S2sEvent.DEFAULT_AUDIO_INPUT_CONFIG)
+        self._audio_carry = None
+        
+        # Single writer: every event reaches the Bedrock input stream through this queue
+        self.input_queue = asyncio.PriorityQueue()
+        self._input_seq = itertools.count()
+        self._audio_lane_pending = 0  # items queued in the audio lane but not yet sent
+        self.send_stats = {priority: {"count": 0, "total_ms": 0.0, "max_ms": 0.0} for priority in PRIORITY_NAMES}
+        
         self.response_task = None
+        self.audio_task = None
+        self.writer_task = None
+        self.rollover_task = None
+        self._pending_rollover = None
+        self.stream_started_at = None
+        self.max_session_seconds = MAX_SESSION_SECONDS
+        self._rollover_lock = asyncio.Lock()
+        # Consecutive streams that ended within ROLLOVER_EARLY_SECONDS
+        self._early_stream_ends = 0
+        
+        # Bootstrap events sent by the device and a compact transcript, replayed
+        # into a replacement stream on rollover
+        self._bootstrap = {}
+        self._system_content_name = None
+        self.history = deque(maxlen=HISTORY_TURNS)
+        self._text_output_final = False
+        # Inherited history still to be sent once the device's own bootstrap
+        # (session, prompt and system content) has gone out
+        self._history_pending = False
+        
+        # Idle policy (seconds without activity before suspending, 0 disables)
+        self.idle_timeout = 0
+        self.last_activity = time.monotonic()
+        self.suspended = False
+        self._preroll = deque(maxlen=IDLE_PREROLL_CHUNKS)
         self.stream = None
         self.is_active = False
         self.bedrock_client = None
@@ -43,12 +128,27 @@ class S2sSessionManager:
         self.prompt_name = None  # Will be set from frontend
         self.content_name = None  # Will be set from frontend
         self.audio_content_name = None  # Will be set from frontend
-        self.toolUseContent = ""
-        self.toolUseId = ""
-        self.toolName = ""
+        # Tool calls started as soon as their toolUse event arrives, keyed by the
+        # tool content id: (toolUseId, toolName, task). When the model closes the
+        # tool content a sender task (same key in _tool_senders) awaits the result
+        # and sends it, so calls in the same turn run concurrently and their
+        # results go out in completion order.
+        self.tool_calls = {}
+        self._tool_senders = {}
+        # Barge-in state: the assistant audio content currently being played
+        # and the one cut off by the user, whose late audioOutput is dropped.
+        self.current_audio_content_id = None
+        self.interrupted_content_id = None
+        # True from the first output content of a turn until it ends or is
+        # interrupted; a draining server waits for this before disconnecting
+        self.turn_in_progress = False
         self.mcp_loc_client = mcp_client
         self.strands_agent = strands_agent
         self.universal_mcp_manager = universal_mcp_manager
+        
+        # Node-level admission control for streams and tool calls
+        self.admission = admission
+        self._holds_stream_slot = False
 
     def _initialize_client(self):
         """Initialize the Bedrock client."""
@@ -71,18 +171,24 @@ class S2sSessionManager:
             print(f"Failed to initialize Bedrock client: {str(e)}")
             raise
 
+        if self.admission and not self._holds_stream_slot:
+            # Raises AdmissionRejected when the node is at capacity
+            await self.admission.acquire_stream()
+            self._holds_stream_slot = True
+
         try:
             # Initialize the stream
-            self.stream = await self.bedrock_client.invoke_model_with_bidirectional_stream(
-                InvokeModelWithBidirectionalStreamOperationInput(model_id=self.model_id)
-            )
+            self.stream = await self._open_stream()
+            self.stream_started_at = time.monotonic()
             self.is_active = True
             
             # Start listening for responses
-            self.response_task = asyncio.create_task(self._process_responses())
+            self.response_task = asyncio.create_task(self._process_responses(self.stream))
+            self.rollover_task = asyncio.create_task(self._rollover_watchdog())
 
-            # Start processing audio input
-            asyncio.create_task(self._process_audio_input())
+            # Start processing audio input and the single input stream writer
+            self.audio_task = asyncio.create_task(self._process_audio_input())
+            self.writer_task = asyncio.create_task(self._process_input_events())
             
             # Wait a bit to ensure everything is set up
             await asyncio.sleep(0.1)
@@ -91,37 +197,188 @@ class S2sSessionManager:
             return self
         except Exception as e:
             self.is_active = False
+            self._release_stream_slot()
             print(f"Failed to initialize stream: {str(e)}")
             raise
     
-    async def send_raw_event(self, event_data):
+    async def send_raw_event(self, event_data, priority=None, payload=None):
+        """Queue a raw event for the Bedrock stream writer.
+
+        Without an explicit priority the event jumps ahead of queued audio only
+        when no audio is pending; otherwise it is routed through the audio lane
+        so it cannot overtake audio it has to follow. ``payload`` is the event
+        already serialized, which the writer then sends as-is.
+        """
+        if not self.stream or not self.is_active:
+            debug_print("Stream not initialized or closed")
+            return
+
+        self._capture_bootstrap(event_data)
+        if 'audioInput' not in event_data['event']:
+            self.last_activity = time.monotonic()
+
+        if priority is None:
+            priority = PRIORITY_AUDIO if self._audio_lane_pending else PRIORITY_CONTROL
+
+        if self._history_pending and self._opens_conversation(event_data):
+            # The device restarted the session itself: slot the inherited
+            # history between its system prompt and the first conversation content
+            self._history_pending = False
+            for history_event in self._history_events():
+                if priority == PRIORITY_AUDIO:
+                    self._audio_lane_pending += 1
+                    self.audio_input_queue.put_nowait({'event': history_event, 'payload': None})
+                else:
+                    self._enqueue_input(history_event, priority)
+
+        if priority == PRIORITY_AUDIO:
+            # Pass through the coalescer so it stays behind audio still being merged
+            self._audio_lane_pending += 1
+            self.audio_input_queue.put_nowait({'event': event_data, 'payload': payload})
+        else:
+            self._enqueue_input(event_data, priority, payload=payload)
+
+    @staticmethod
+    def _opens_conversation(event_data):
+        """Whether the event starts non-system content (audio, user text or tool)."""
+        body = event_data['event'].get('contentStart')
+        return body is not None and body.get('role') != 'SYSTEM'
+
+    def set_audio_input_config(self, input_config):
+        """Size coalesced uplink frames for the audio format that opened the stream.
+
+        Fields missing from ``input_config`` (or an unusable config) fall back to
+        the default 16 kHz 16-bit mono PCM.
+        """
+        config = dict(S2sEvent.DEFAULT_AUDIO_INPUT_CONFIG)
+        if isinstance(input_config, dict):
+            config.update({key: value for key, value in input_config.items()
+                           if key not in ('sampleRateHertz', 'sampleSizeBits', 'channelCount')
+                           or (isinstance(value, int) and value > 0)})
+        bytes_per_ms = config['sampleRateHertz'] * config['sampleSizeBits'] // 8 * config['channelCount'] / 1000
+        self.audio_frame_bytes = int(self.audio_frame_ms * bytes_per_ms)
+
+    async def send_bootstrap(self, template):
+        """Queue a precomputed bootstrap sequence (events already patched and serialized)."""
+        for event_data, payload in zip(template.events, template.payloads):
+            await self.send_raw_event(event_data, payload=payload)
+
+    def _capture_bootstrap(self, event_data):
+        """Remember the session/prompt/system/audio setup events for stream rollover."""
+        event_name = next(iter(event_data.get('event', {})), None)
+        if event_name is None or event_name == 'audioInput':
+            return
+        body = event_data['event'][event_name]
+
+        if event_name == 'sessionStart':
+            self._bootstrap = {'sessionStart': event_data}
+        elif event_name == 'promptStart':
+            self._bootstrap['promptStart'] = event_data
+            self.prompt_name = body.get('promptName')
+        elif event_name == 'contentStart':
+            if body.get('type') == 'AUDIO':
+                self._bootstrap['audioStart'] = event_data
+                self.audio_content_name = body.get('contentName')
+                self.set_audio_input_config(body.get('audioInputConfiguration'))
+            elif body.get('role') == 'SYSTEM':
+                self._bootstrap['system'] = [event_data]
+                self._system_content_name = body.get('contentName')
+        elif event_name in ('textInput', 'contentEnd') and self._system_content_name \
+                and body.get('contentName') == self._system_content_name:
+            self._bootstrap.setdefault('system', []).append(event_data)
+            if event_name == 'contentEnd':
+                self._system_content_name = None
+        elif event_name == 'contentEnd' and body.get('contentName') == self.audio_content_name:
+            self._bootstrap.pop('audioStart', None)
+
+    @staticmethod
+    def _encode_event(event_data, payload=None):
+        """Serialize an event into an input stream chunk, reusing a pre-serialized payload if given."""
+        if payload is None:
+            payload = json.dumps(event_data).encode('utf-8')
+        return InvokeModelWithBidirectionalStreamInputChunk(
+            value=BidirectionalInputPayloadPart(bytes_=payload)
+        )
+
+    def _enqueue_input(self, event_data, priority, weight=1, payload=None):
+        """Put an event on the writer queue; weight is the number of audio-lane items it settles."""
+        self.input_queue.put_nowait((priority, next(self._input_seq), time.monotonic(), event_data, weight, payload))
+
+    async def _drain_control_events(self, timeout=2):
+        """Wait until control events queued so far have been written to the current stream."""
+        barrier = asyncio.get_running_loop().create_future()
+        self._enqueue_input(None, PRIORITY_CONTROL, payload=barrier)
         try:
-            """Send a raw event to the Bedrock stream."""
-            if not self.stream or not self.is_active:
-                debug_print("Stream not initialized or closed")
-                return
-            
-            event_json = json.dumps(event_data)
-            #if "audioInput" not in event_data["event"]:
-            #    print(event_json)
-            event = InvokeModelWithBidirectionalStreamInputChunk(
-                value=BidirectionalInputPayloadPart(bytes_=event_json.encode('utf-8'))
-            )
-            await self.stream.input_stream.send(event)
-
-            # Close session
-            if "sessionEnd" in event_data["event"]:
-                self.close()
-            
-        except Exception as e:
-            debug_print(f"Error sending event: {str(e)}")
+            await asyncio.wait_for(barrier, timeout)
+        except asyncio.TimeoutError:
+            debug_print("Timed out waiting for queued control events")
+
+    async def _process_input_events(self):
+        """Single writer draining the priority queue onto the Bedrock input stream."""
+        while self.is_active:
+            try:
+                priority, _, enqueued_at, event_data, weight, payload = await self.input_queue.get()
+
+                # Barrier: everything queued ahead of it has been written
+                if event_data is None:
+                    if not payload.done():
+                        payload.set_result(None)
+                    continue
+                
+                event = self._encode_event(event_data, payload)
+                try:
+                    await self.stream.input_stream.send(event)
+                finally:
+                    if priority == PRIORITY_AUDIO:
+                        self._audio_lane_pending = max(0, self._audio_lane_pending - weight)
+
+                stats = self.send_stats[priority]
+                latency_ms = (time.monotonic() - enqueued_at) * 1000
+                stats["count"] += 1
+                stats["total_ms"] += latency_ms
+                stats["max_ms"] = max(stats["max_ms"], latency_ms)
+
+                # Close session
+                if "sessionEnd" in event_data["event"]:
+                    await self.close()
+                    break
+                
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                debug_print(f"Error sending event: {str(e)}")
+
+    def get_send_stats(self):
+        """Per-priority queue-to-send latency of the input stream writer."""
+        return {
+            PRIORITY_NAMES[priority]: {
+                "count": stats["count"],
+                "avg_ms": round(stats["total_ms"] / stats["count"], 2) if stats["count"] else 0.0,
+                "max_ms": round(stats["max_ms"], 2),
+            }
+            for priority, stats in self.send_stats.items()
+        }
     
     async def _process_audio_input(self):
-        """Process audio input from the queue and send to Bedrock."""
+        """Process audio input from the queue and send to Bedrock.
+
+        Consecutive chunks for the same prompt/content are coalesced into one
+        audioInput frame of up to ``audio_frame_ms``, waiting at most
+        ``audio_latency_ms`` after the first chunk for the frame to fill up.
+        """
+        loop = asyncio.get_running_loop()
         while self.is_active:
             try:
-                # Get audio data from the queue
-                data = await self.audio_input_queue.get()
+                # Get audio data from the queue (or the chunk held back last round)
+                if self._audio_carry is not None:
+                    data, self._audio_carry = self._audio_carry, None
+                else:
+                    data = await self.audio_input_queue.get()
+
+                # Ordered control event queued behind audio
+                if 'event' in data:
+                    self._enqueue_input(data['event'], PRIORITY_AUDIO, payload=data.get('payload'))
+                    continue
                 
                 # Extract data from the queue item
                 prompt_name = data.get('prompt_name')
@@ -130,13 +387,40 @@ class S2sSessionManager:
                 
                 if not audio_bytes or not prompt_name or not content_name:
                     debug_print("Missing required audio data properties")
+                    self._audio_lane_pending = max(0, self._audio_lane_pending - 1)
                     continue
 
+                chunks = [audio_bytes.decode('utf-8') if isinstance(audio_bytes, bytes) else audio_bytes]
+                frame_size = len(chunks[0]) * 3 // 4
+                deadline = loop.time() + self.audio_latency_ms / 1000
+
+                # Coalesce until the frame is full or the latency budget is spent
+                while frame_size < self.audio_frame_bytes:
+                    try:
+                        next_data = self.audio_input_queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            next_data = await asyncio.wait_for(self.audio_input_queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+
+                    next_bytes = next_data.get('audio_bytes')
+                    if next_data.get('prompt_name') != prompt_name or next_data.get('content_name') != content_name \
+                            or not next_bytes:
+                        self._audio_carry = next_data
+                        break
+
+                    chunks.append(next_bytes.decode('utf-8') if isinstance(next_bytes, bytes) else next_bytes)
+                    frame_size += len(chunks[-1]) * 3 // 4
+
                 # Create the audio input event
-                audio_event = S2sEvent.audio_input(prompt_name, content_name, audio_bytes.decode('utf-8') if isinstance(audio_bytes, bytes) else audio_bytes)
+                audio_event = S2sEvent.audio_input(prompt_name, content_name, self._merge_audio_chunks(chunks))
                 
-                # Send the event
-                await self.send_raw_event(audio_event)
+                # Hand the frame to the writer
+                self._enqueue_input(audio_event, PRIORITY_AUDIO, weight=len(chunks))
                 
             except asyncio.CancelledError:
                 break
@@ -145,21 +429,116 @@ class S2sSessionManager:
                 if DEBUG:
                     import traceback
                     traceback.print_exc()
+
+    @staticmethod
+    def _merge_audio_chunks(chunks):
+        """Merge base64 audio chunks into a single base64 payload."""
+        if len(chunks) == 1:
+            return chunks[0]
+        # Unpadded base64 blocks can be concatenated as-is
+        if all(len(chunk) % 4 == 0 and not chunk.endswith('=') for chunk in chunks[:-1]):
+            return ''.join(chunks)
+        return base64.b64encode(b''.join(base64.b64decode(chunk) for chunk in chunks)).decode('utf-8')
     
     def add_audio_chunk(self, prompt_name, content_name, audio_data):
         """Add an audio chunk to the queue."""
         # The audio_data is already a base64 string from the frontend
+        self._audio_lane_pending += 1
         self.audio_input_queue.put_nowait({
             'prompt_name': prompt_name,
             'content_name': content_name,
             'audio_bytes': audio_data
         })
     
-    async def _process_responses(self):
-        """Process incoming responses from Bedrock."""
-        while self.is_active:
+    def audio_backlog(self):
+        """Audio-lane items queued but not yet written to the Bedrock stream."""
+        return self._audio_lane_pending
+
+    def idle_seconds(self):
+        """Seconds since the last conversational activity."""
+        return time.monotonic() - self.last_activity
+
+    def buffer_idle_audio(self, prompt_name, content_name, audio_data):
+        """Keep audio received while suspended; return True if it contains speech."""
+        self._preroll.append((prompt_name, content_name, audio_data))
+        try:
+            samples = array('h', base64.b64decode(audio_data))
+        except (ValueError, TypeError):
+            return False
+        return bool(samples) and max(max(samples), -min(samples)) >= IDLE_WAKE_PEAK
+
+    async def suspend(self):
+        """Release the Bedrock stream and its tasks while the device is idle.
+
+        The client, bootstrap events and history are kept so resume() can
+        recreate the session without the device noticing.
+        """
+        if not self.is_active:
+            return
+        # Mark first so nobody mistakes the stream closing below for a session end
+        self.suspended = True
+        await self.close()
+        self._preroll.clear()
+
+    async def resume(self, replay=True):
+        """Reopen the stream after suspend().
+
+        With replay the recorded bootstrap and history are sent first and the
+        pre-roll audio follows; without it the device is starting a new session
+        itself and the pre-roll is discarded.
+        """
+        self.audio_input_queue = asyncio.Queue()
+        self.input_queue = asyncio.PriorityQueue()
+        self._audio_lane_pending = 0
+        self._audio_carry = None
+        await self.initialize_stream()
+        self.suspended = False
+        self.last_activity = time.monotonic()
+
+        if replay and self.replay_session():
+            for prompt_name, content_name, audio_data in self._preroll:
+                self.add_audio_chunk(prompt_name, content_name, audio_data)
+        self._preroll.clear()
+
+    def _replayable(self):
+        """Whether enough of the bootstrap was recorded to recreate the session."""
+        return 'sessionStart' in self._bootstrap and 'promptStart' in self._bootstrap
+
+    def replay_session(self):
+        """Queue the recorded bootstrap and history ahead of any new input."""
+        if not self._replayable():
+            return False
+        self._history_pending = False
+        for event_data in self._replay_events():
+            self._enqueue_input(event_data, PRIORITY_CONTROL)
+        return True
+
+    def inherit_session(self, previous, patch_event):
+        """Take over bootstrap events and history from a restarted session.
+
+        patch_event(event_data, is_system) re-applies the current device
+        configuration to each copied bootstrap event. If the device then sends
+        its own bootstrap instead of the session being replayed, the history is
+        sent right after the device's system prompt.
+        """
+        self.history = previous.history
+        self._history_pending = bool(self.history)
+        self.prompt_name = previous.prompt_name
+        self.audio_content_name = previous.audio_content_name
+        for key, value in previous._bootstrap.items():
+            if key == 'system':
+                self._bootstrap[key] = [patch_event(copy.deepcopy(event_data), True) for event_data in value]
+            else:
+                self._bootstrap[key] = patch_event(copy.deepcopy(value), False)
+        if 'audioStart' in self._bootstrap:
+            self.set_audio_input_config(self._bootstrap['audioStart']['event']['contentStart'].get('audioInputConfiguration'))
+
+    async def _process_responses(self, stream):
+        """Process incoming responses from Bedrock for one stream."""
+        end_error = None
+        while self.is_active and stream is self.stream:
             try:            
-                output = await self.stream.await_output()
+                output = await stream.await_output()
                 result = await output[1].receive()
                 
                 if result.value and result.value.bytes_:
@@ -169,42 +548,62 @@ class S2sSessionManager:
                     json_data["timestamp"] = int(time.time() * 1000)  # Milliseconds since epoch
                     
                     event_name = None
+                    self.last_activity = time.monotonic()
                     if 'event' in json_data:
                         event_name = list(json_data["event"].keys())[0]
                         # if event_name == "audioOutput":
                         #     print(json_data)
+                        event_body = json_data['event'][event_name]
+
+                        self._record_history(event_name, event_body)
+
+                        if event_name == 'contentStart':
+                            self.turn_in_progress = True
+                        elif event_name == 'contentEnd' and event_body.get('stopReason') in ('END_TURN', 'INTERRUPTED'):
+                            self.turn_in_progress = False
+
+                        # Switch to a fresh stream between turns once the current one is old
+                        if event_name == 'contentEnd' and event_body.get('stopReason') == 'END_TURN' \
+                                and self._stream_age() >= self.max_session_seconds - ROLLOVER_MARGIN_SECONDS:
+                            self._schedule_rollover()
+
+                        # Track the assistant audio content so barge-in can target it
+                        if event_name == 'contentStart' and event_body.get('type') == 'AUDIO':
+                            self.current_audio_content_id = event_body.get('contentId')
+                            self.interrupted_content_id = None
+
+                        # Drop audio that belongs to an interrupted content
+                        elif event_name == 'audioOutput' and self.interrupted_content_id \
+                                and event_body.get('contentId') == self.interrupted_content_id:
+                            continue
+
+                        elif self._is_interruption(event_name, event_body):
+                            # textOutput carries its own contentId; only an AUDIO contentEnd names the audio content
+                            interrupted_id = event_body.get('contentId') if event_body.get('type') == 'AUDIO' else None
+                            if (interrupted_id or self.current_audio_content_id) != self.interrupted_content_id:
+                                debug_print("Barge-in detected, flushing pending audio")
+                                self.flush_pending_audio(interrupted_id)
+                            self._cancel_pending_tools()
                         
                         # Handle tool use detection
                         if event_name == 'toolUse':
-                            self.toolUseContent = json_data['event']['toolUse']
-                            self.toolName = json_data['event']['toolUse']['toolName']
-                            self.toolUseId = json_data['event']['toolUse']['toolUseId']
-                            debug_print(f"Tool use detected: {self.toolName}, ID: {self.toolUseId}, "+ json.dumps(json_data['event']))
-
-                        # Process tool use when content ends
-                        elif event_name == 'contentEnd' and json_data['event'][event_name].get('type') == 'TOOL':
-                            prompt_name = json_data['event']['contentEnd'].get("promptName")
-                            debug_print("Processing tool use and sending result")
-                            toolResult = await self.processToolUse(self.toolName, self.toolUseContent)
-                                
-                            # Send tool start event
-                            toolContent = str(uuid.uuid4())
-                            tool_start_event = S2sEvent.content_start_tool(prompt_name, toolContent, self.toolUseId)
-                            await self.send_raw_event(tool_start_event)
-                            
-                            # Send tool result event
-                            if isinstance(toolResult, dict):
-                                content_json_string = json.dumps(toolResult)
-                            else:
-                                content_json_string = toolResult
-
-                            tool_result_event = S2sEvent.text_input_tool(prompt_name, toolContent, content_json_string)
-                            print("Tool result", tool_result_event)
-                            await self.send_raw_event(tool_result_event)
-
-                            # Send tool content end event
-                            tool_content_end_event = S2sEvent.content_end(prompt_name, toolContent)
-                            await self.send_raw_event(tool_content_end_event)
+                            toolUseId, toolName = event_body['toolUseId'], event_body['toolName']
+                            debug_print(f"Tool use detected: {toolName}, ID: {toolUseId}, "+ json.dumps(json_data['event']))
+                            # Run the tool while the model finishes the tool content
+                            task = asyncio.create_task(self.processToolUse(toolName, event_body))
+                            self.tool_calls[event_body.get('contentId') or toolUseId] = (toolUseId, toolName, task)
+
+                        # Send the tool result once the model has closed the tool content
+                        elif event_name == 'contentEnd' and event_body.get('type') == 'TOOL':
+                            waiting = [key for key in self.tool_calls if key not in self._tool_senders]
+                            key = event_body.get('contentId')
+                            if key not in waiting:
+                                # No matching content id: the oldest call not yet answered
+                                key = waiting[0] if waiting else None
+                            if key is not None:
+                                debug_print(f"Processing tool use {self.tool_calls[key][1]} and sending result")
+                                self._tool_senders[key] = asyncio.create_task(
+                                    self._send_tool_result(event_body.get("promptName"), key))
                     
                     # Put the response in the output queue for forwarding to the frontend
                     await self.output_queue.put(json_data)
@@ -216,6 +615,7 @@ class S2sSessionManager:
             except StopAsyncIteration as ex:
                 # Stream has ended
                 print(ex)
+                break
             except Exception as e:
                 # Handle ValidationException properly
                 if "ValidationException" in str(e):
@@ -223,15 +623,299 @@ class S2sSessionManager:
                     print(f"Validation error: {error_message}")
                 else:
                     print(f"Error receiving response: {e}")
+                end_error = str(e) or type(e).__name__
                 break
 
-        self.is_active = False
-        self.close()
+        # A retired stream ends quietly; an unexpected end of the live one is
+        # recovered by rolling over to a new stream if it expired
+        if stream is not self.stream or not self.is_active:
+            return
+        await self._recover_stream(stream, end_error)
+
+    def _stream_expired(self, error):
+        """Whether the live stream ended because of its lifetime rather than a fault."""
+        if self._stream_age() >= self.max_session_seconds - ROLLOVER_MARGIN_SECONDS:
+            return True
+        return bool(error) and any(marker in error.lower() for marker in STREAM_EXPIRY_MARKERS)
+
+    async def _recover_stream(self, stream, error):
+        """Replace a live stream that ended on its own, or close the session and tell the device."""
+        if self._stream_expired(error) and self._replayable():
+            if self._stream_age() < ROLLOVER_EARLY_SECONDS:
+                self._early_stream_ends += 1
+            else:
+                self._early_stream_ends = 0
+            if await self._retry_rollover(stream):
+                return
+
+        await self._end_session(error or "stream ended")
+
+    async def _retry_rollover(self, stream):
+        """Roll over, retrying with exponential backoff until ROLLOVER_MAX_FAILURES.
+
+        Failed attempts count toward the same limit as streams that end early.
+        Returns False once the limit is reached.
+        """
+        while self._early_stream_ends < ROLLOVER_MAX_FAILURES:
+            if self._early_stream_ends:
+                await asyncio.sleep(ROLLOVER_BACKOFF_SECONDS * 2 ** (self._early_stream_ends - 1))
+                if stream is not self.stream or not self.is_active:
+                    return True
+            if await self._rollover(stream):
+                return True
+            self._early_stream_ends += 1
+        return False
+
+    async def _end_session(self, reason):
+        """Tell the device the session is over and close it."""
+        print(f"Bedrock stream ended ({reason}), closing session")
+        self.output_queue.put_nowait({"type": "session_error", "error": reason})
+        await self.close()
+
+    def _record_history(self, event_name, event_body):
+        """Keep a compact transcript of final user/assistant text for rollover replay."""
+        if event_name == 'contentStart' and event_body.get('type') == 'TEXT':
+            stage = 'FINAL'
+            try:
+                stage = json.loads(event_body.get('additionalModelFields') or '{}').get('generationStage', 'FINAL')
+            except (TypeError, ValueError):
+                pass
+            self._text_output_final = event_body.get('role') == 'USER' or stage == 'FINAL'
+        elif event_name == 'textOutput' and self._text_output_final:
+            role = event_body.get('role')
+            content = event_body.get('content', '')
+            if role not in ('USER', 'ASSISTANT') or not content or '"interrupted"' in content:
+                return
+            if self.history and self.history[-1]['role'] == role:
+                content = f"{self.history[-1]['content']} {content}"
+                self.history.pop()
+            self.history.append({'role': role, 'content': content[-HISTORY_TURN_MAX_CHARS:]})
+
+    def _stream_age(self):
+        """Seconds since the current Bedrock stream was opened."""
+        return time.monotonic() - self.stream_started_at if self.stream_started_at else 0
+
+    async def _open_stream(self):
+        """Open a new bidirectional stream with Bedrock."""
+        return await self.bedrock_client.invoke_model_with_bidirectional_stream(
+            InvokeModelWithBidirectionalStreamOperationInput(model_id=self.model_id)
+        )
+
+    def _schedule_rollover(self):
+        """Start a rollover in the background unless one is already running."""
+        if not self._rollover_lock.locked() and not (self._pending_rollover and not self._pending_rollover.done()):
+            self._pending_rollover = asyncio.create_task(self._rollover(self.stream))
+
+    async def _rollover_watchdog(self):
+        """Force a rollover shortly before the stream limit if no turn boundary came."""
+        while self.is_active:
+            try:
+                deadline = self.max_session_seconds - ROLLOVER_HARD_MARGIN_SECONDS
+                await asyncio.sleep(max(1, deadline - self._stream_age()))
+                if self.is_active and self._stream_age() >= deadline:
+                    debug_print("Stream limit approaching mid-turn, forcing rollover")
+                    stream = self.stream
+                    await self._settle_tool_calls(self.max_session_seconds - ROLLOVER_HARD_MARGIN_SECONDS / 2)
+                    if stream is not self.stream or not self.is_active:
+                        continue
+                    if await self._retry_rollover(stream):
+                        self._early_stream_ends = 0
+                    else:
+                        await self._end_session("stream rollover failed")
+            except asyncio.CancelledError:
+                break
+
+    async def _settle_tool_calls(self, limit):
+        """Before a forced rollover, let outstanding tool calls finish until the stream
+        is ``limit`` seconds old, then answer the rest with an error.
+
+        A toolUseId is only known to the stream that issued it, so every call must be
+        answered on the current stream before switching.
+        """
+        while self.tool_calls and self.is_active and self._stream_age() < limit:
+            await asyncio.sleep(0.1)
+        for key in list(self.tool_calls):
+            toolUseId, toolName, task = self.tool_calls.pop(key)
+            sender = self._tool_senders.pop(key, None)
+            for pending in (task, sender):
+                if pending and not pending.done():
+                    pending.cancel()
+            debug_print(f"Answering tool call {toolName}, ID: {toolUseId} before rollover")
+            await self._queue_tool_result(self.prompt_name, toolUseId, encode_tool_result(toolName, {
+                "result": "The tool call took too long. Please tell the user to try again."}))
+
+    def _replay_events(self):
+        """Events that recreate the current session on a fresh stream."""
+        events = [self._bootstrap['sessionStart'], self._bootstrap['promptStart']]
+        events.extend(self._bootstrap.get('system', []))
+        events.extend(self._history_events())
+        if 'audioStart' in self._bootstrap:
+            events.append(self._bootstrap['audioStart'])
+        return events
+
+    def _history_events(self):
+        """Non-interactive text content events replaying the retained history."""
+        events = []
+        for turn in self.history:
+            content_name = str(uuid.uuid4())
+            events.append(S2sEvent.content_start_text(self.prompt_name, content_name, role=turn['role'], interactive=False))
+            events.append(S2sEvent.text_input(self.prompt_name, content_name, turn['content']))
+            events.append(S2sEvent.content_end(self.prompt_name, content_name))
+        return events
+
+    async def _rollover(self, stream=None):
+        """Replace the Bedrock stream without the device noticing.
+
+        A new stream is opened and primed with the session bootstrap and recent
+        history while the old one keeps serving; input then switches over and
+        the old stream is retired. Returns False if the session cannot be replayed.
+        """
+        if not self._replayable():
+            return False
+
+        async with self._rollover_lock:
+            if stream is not None and stream is not self.stream:
+                return True  # already replaced while waiting for the lock
+            old_stream, old_response_task = self.stream, self.response_task
+            try:
+                new_stream = await self._open_stream()
+                for event_data in self._replay_events():
+                    await new_stream.input_stream.send(self._encode_event(event_data))
+            except Exception as e:
+                print(f"Failed to roll over stream: {str(e)}")
+                return False
+
+            # Tool results and other control events already queued belong to the old stream
+            await self._drain_control_events()
+
+            # Switch: the writer picks up the new stream with its next event
+            self.stream = new_stream
+            self.stream_started_at = time.monotonic()
+            self.response_task = asyncio.create_task(self._process_responses(new_stream))
+            debug_print(f"Stream rolled over, replayed {len(self.history)} history turns")
+
+            if old_response_task and old_response_task is not asyncio.current_task() and not old_response_task.done():
+                old_response_task.cancel()
+            try:
+                await old_stream.input_stream.close()
+            except Exception as e:
+                debug_print(f"Error closing retired stream: {str(e)}")
+            return True
+
+    @staticmethod
+    def _is_interruption(event_name, event_body):
+        """Detect the barge-in signal emitted by Nova Sonic."""
+        if event_name == 'textOutput':
+            content = event_body.get('content', '')
+            return '"interrupted"' in content and 'true' in content
+        if event_name == 'contentEnd':
+            return event_body.get('stopReason') == 'INTERRUPTED'
+        return False
+
+    async def _send_tool_result(self, prompt_name, key):
+        """Wait for one tool call and send its result under its own toolUseId.
+
+        The model waits for a result for every toolUseId, so a failed call is
+        answered with an error result rather than left unanswered.
+        """
+        toolUseId, toolName, task = self.tool_calls[key]
+        try:
+            try:
+                toolResult = await task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Tool call {toolName} ({toolUseId}) failed: {e}")
+                toolResult = encode_tool_result(toolName, {
+                    "result": "An error occurred while attempting to retrieve information related to the toolUse event."})
+        finally:
+            self.tool_calls.pop(key, None)
+            self._tool_senders.pop(key, None)
+
+        await self._queue_tool_result(prompt_name, toolUseId, toolResult)
+
+    async def _queue_tool_result(self, prompt_name, toolUseId, toolResult):
+        """Queue the tool content carrying one result."""
+        toolContent = str(uuid.uuid4())
+        # The three events are queued without yielding, so results of concurrent
+        # calls never interleave
+        tool_start_event = S2sEvent.content_start_tool(prompt_name, toolContent, toolUseId)
+        await self.send_raw_event(tool_start_event, PRIORITY_CONTROL)
+
+        # Send tool result event (already budgeted and serialized)
+        tool_result_event = S2sEvent.text_input_tool(prompt_name, toolContent, toolResult)
+        await self.send_raw_event(tool_result_event, PRIORITY_CONTROL)
+
+        tool_content_end_event = S2sEvent.content_end(prompt_name, toolContent)
+        await self.send_raw_event(tool_content_end_event, PRIORITY_CONTROL)
+
+    def _cancel_pending_tools(self):
+        """Abandon tool calls the model has not finished requesting (turn interrupted)."""
+        for key in [key for key in self.tool_calls if key not in self._tool_senders]:
+            toolUseId, toolName, task = self.tool_calls.pop(key)
+            if not task.done():
+                debug_print(f"Cancelling tool call {toolName}, ID: {toolUseId}")
+                task.cancel()
+
+    def flush_pending_audio(self, content_id=None):
+        """Purge queued assistant audio and tell the device to flush its playback buffer.
+
+        Called when Nova Sonic reports an interruption or when the device sends
+        an explicit interrupt. Only audio tagged with the interrupted content id is
+        dropped; with no assistant audio content to target nothing is purged.
+        Non-audio events stay queued in their original order.
+        """
+        content_id = content_id or self.current_audio_content_id
+        if content_id is None:
+            debug_print("No assistant audio content to interrupt, nothing flushed")
+            return 0
+        self.interrupted_content_id = content_id
+
+        kept = []
+        dropped = 0
+        while True:
+            try:
+                item = self.output_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            audio = item.get('event', {}).get('audioOutput') if isinstance(item, dict) else None
+            if audio is not None and audio.get('contentId') == content_id:
+                dropped += 1
+                continue
+            kept.append(item)
+
+        for item in kept:
+            self.output_queue.put_nowait(item)
+        self.output_queue.put_nowait({"type": "audio_flush", "content_id": content_id})
+        debug_print(f"Dropped {dropped} pending audio chunks for content {content_id}")
+        return dropped
 
     async def processToolUse(self, toolName, toolUseContent):
+        """Return the serialized toolResult content, within the node's concurrent tool call limit
+        and the tool's result budget"""
+        if not self.admission:
+            result = await self._invoke_tool(toolName, toolUseContent)
+        else:
+            try:
+                async with self.admission.tool_call():
+                    result = await self._invoke_tool(toolName, toolUseContent)
+            except AdmissionRejected:
+                result = {"result": "The service is busy right now. Please tell the user to try again in a moment."}
+        return encode_tool_result(toolName, result, self._tool_server_config(toolName))
+
+    def _tool_server_config(self, toolName):
+        """Config of the dynamic MCP server providing a tool (result budget and field projection rules)"""
+        if self.universal_mcp_manager and toolName.lower() not in S2sEvent.BUILTIN_TOOL_NAMES:
+            for client in self.universal_mcp_manager.clients.values():
+                if client.resolve_tool(toolName):
+                    return client.config
+        return None
+
+    async def _invoke_tool(self, toolName, toolUseContent):
         """Return the tool result"""
-        print(f"Tool Use Content: {toolUseContent}")
+        debug_print(f"Tool Use Content: {toolUseContent}")
 
+        requestedName = toolName
         toolName = toolName.lower()
         content, result = None, None
         try:
@@ -239,7 +923,7 @@ class S2sSessionManager:
                 # Parse the JSON string in the content field
                 query_json = json.loads(toolUseContent.get("content"))
                 content = toolUseContent.get("content")  # Pass the JSON string directly to the agent
-                print(f"Extracted query: {content}")
+                debug_print(f"Extracted query: {content}")
             
             # Simple toolUse to get system time in UTC
             if toolName == "getdatetool":
@@ -248,7 +932,7 @@ class S2sSessionManager:
 
             # Bedrock Knowledge Bases (RAG)
             if toolName == "getkbtool":
-                result = kb.retrieve_kb(content)
+                result = await asyncio.to_thread(kb.retrieve_kb, content)
 
             # MCP integration - location search                        
             if toolName == "getlocationtool":
@@ -256,17 +940,18 @@ class S2sSessionManager:
                     result = await self.mcp_loc_client.call_tool(content)
             
             # 动态MCP工具调用
-            if self.universal_mcp_manager and toolName not in ["getdatetool", "getkbtool", "getlocationtool", "externalagent", "getbookingdetails"]:
+            if self.universal_mcp_manager and toolName not in S2sEvent.BUILTIN_TOOL_NAMES:
                 # 查找对应的MCP服务器
                 for server_name, client in self.universal_mcp_manager.clients.items():
-                    if hasattr(client, 'config') and client.config.get('tool_name', '').lower() == toolName:
-                        result = await self.universal_mcp_manager.call_tool(server_name, toolName, content)
+                    server_tool = client.resolve_tool(requestedName)
+                    if server_tool:
+                        result = await self.universal_mcp_manager.call_tool(server_name, server_tool, content)
                         break
             
             # Strands Agent integration - weather questions
             if toolName == "externalagent":
                 if self.strands_agent:
-                    result = self.strands_agent.query(content)
+                    result = await asyncio.to_thread(self.strands_agent.query, content)
 
             # Bedrock Agents integration - Bookings
             if toolName == "getbookingdetails":
@@ -298,20 +983,38 @@ class S2sSessionManager:
             print(ex)
             return {"result": "An error occurred while attempting to retrieve information related to the toolUse event."}
     
+    def _release_stream_slot(self):
+        """Give the admission slot back once the stream is gone."""
+        if self._holds_stream_slot:
+            self._holds_stream_slot = False
+            self.admission.release_stream()
+
     async def close(self):
         """Close the stream properly."""
         if not self.is_active:
             return
             
         self.is_active = False
+        self._release_stream_slot()
         
-        if self.stream:
-            await self.stream.input_stream.close()
-        
-        if self.response_task and not self.response_task.done():
-            self.response_task.cancel()
-            try:
-                await self.response_task
-            except asyncio.CancelledError:
-                pass
+        try:
+            if self.stream:
+                await self.stream.input_stream.close()
+        except Exception as e:
+            # A broken stream (e.g. after failed recovery) must not keep the tasks below alive
+            debug_print(f"Error closing stream: {str(e)}")
+        finally:
+            current = asyncio.current_task()
+            tool_tasks = [task for _, _, task in self.tool_calls.values()] + list(self._tool_senders.values())
+            self.tool_calls.clear()
+            for task in (self.response_task, self.audio_task, self.writer_task, self.rollover_task, self._pending_rollover,
+                         *tool_tasks):
+                if task and task is not current and not task.done():
+                    task.cancel()
+                    try:
+                        await task
+                    except asyncio.CancelledError:
+                        pass
+                    except Exception as e:
+                        debug_print(f"Task ended with error during close: {str(e)}")
         
\ No newline at end of file
@@ -0,0 +1,54 @@
+import json
+import uuid
+from typing import Dict, List, Optional
+
+from s2s_events import S2sEvent
+from tool_catalog import mcp_tool_catalog
+
+
+class BootstrapTemplate:
+    """按设备配置版本预先生成的会话引导事件序列，事件和序列化结果只生成一次，所有会话共用（只读）"""
+
+    __slots__ = ('events', 'payloads', 'prompt_name', 'audio_content_name')
+
+    def __init__(self, events: List[Dict], prompt_name: str, audio_content_name: str):
+        self.events = events
+        self.payloads = [json.dumps(event).encode('utf-8') for event in events]
+        self.prompt_name = prompt_name
+        self.audio_content_name = audio_content_name
+
+
+def template_key(device_config: dict) -> tuple:
+    """模板对应的配置版本：设备配置版本，以及所用MCP服务器的配置版本和工具目录版本"""
+    mcp_servers = device_config.get('mcp_servers') or []
+    return (
+        device_config.get('version'),
+        tuple((server.get('id'), server.get('version'), mcp_tool_catalog.revision(server))
+              for server in mcp_servers if isinstance(server, dict)),
+    )
+
+
+def build_bootstrap_template(device_config: dict, tool_config: dict,
+                             audio_input_config: Optional[dict] = None) -> BootstrapTemplate:
+    """生成会话引导事件：sessionStart、promptStart、系统提示词和音频输入的contentStart。
+    会话内的名称在模板中固定，不同会话各自使用独立的上游流，可以复用"""
+    prompt_name = str(uuid.uuid4())
+    system_content_name = str(uuid.uuid4())
+    audio_content_name = str(uuid.uuid4())
+
+    audio_output_config = dict(S2sEvent.DEFAULT_AUDIO_OUTPUT_CONFIG, voiceId=device_config.get('voice_id', 'matthew'))
+    events = [
+        S2sEvent.session_start({
+            'maxTokens': device_config.get('max_tokens', 1024),
+            'topP': device_config.get('top_p', 0.95),
+            'temperature': device_config.get('temperature', 0.7)
+        }),
+        S2sEvent.prompt_start(prompt_name, audio_output_config, tool_config),
+        S2sEvent.content_start_text(prompt_name, system_content_name),
+        S2sEvent.text_input(prompt_name, system_content_name,
+                            device_config.get('system_prompt', 'You are a friendly assistant.')),
+        S2sEvent.content_end(prompt_name, system_content_name),
+        S2sEvent.content_start_audio(prompt_name, audio_content_name,
+                                     dict(S2sEvent.DEFAULT_AUDIO_INPUT_CONFIG, **(audio_input_config or {}))),
+    ]
+    return BootstrapTemplate(events, prompt_name, audio_content_name)
@@ -0,0 +1,227 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import weakref
+from typing import Dict, List, Optional
+
+from integration.universal_mcp_client import UniversalMcpManager
+
+logger = logging.getLogger(__name__)
+
+# S2S会话内部持有的后台任务
+SESSION_TASK_ATTRS = ('response_task', 'audio_task', 'writer_task', 'rollover_task', '_pending_rollover')
+
+
+def _session_tasks(session) -> List[asyncio.Task]:
+    return [task for task in (getattr(session, attr, None) for attr in SESSION_TASK_ATTRS) if task]
+
+
+def _rss_bytes() -> Optional[int]:
+    """当前进程的常驻内存（仅Linux）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class SupervisorRegistry:
+    """本进程所有设备连接的资源统计和泄漏检测"""
+
+    def __init__(self):
+        self.live: Dict[int, 'SessionSupervisor'] = {}
+        self.by_device: Dict[str, 'SessionSupervisor'] = {}
+        # 已关闭的S2S会话，关闭后仍在运行的任务即为泄漏
+        self.closed_sessions = weakref.WeakSet()
+
+    def find_leaks(self) -> List[str]:
+        """返回已关闭连接或会话遗留的任务名"""
+        leaks = []
+        for task in asyncio.all_tasks():
+            name = task.get_name()
+            if name.startswith('conn-') and not task.done():
+                conn_id = int(name[5:].split(':', 1)[0])
+                if conn_id not in self.live:
+                    leaks.append(name)
+        for session in list(self.closed_sessions):
+            if session.is_active:
+                continue  # 空闲释放后已恢复
+            leaks.extend(f"session:{attr}" for attr in SESSION_TASK_ATTRS
+                         if getattr(session, attr, None) and not getattr(session, attr).done())
+        return leaks
+
+    def counts(self) -> Dict:
+        """按资源类型统计当前存活的资源数量"""
+        supervisors = list(self.live.values())
+        sessions = [s.session for s in supervisors if s.session]
+        return {
+            "connections": len(supervisors),
+            "devices": len(self.by_device),
+            "sessions": len(sessions),
+            "streams": sum(1 for session in sessions if session.is_active),
+            "suspended_sessions": sum(1 for session in sessions if session.suspended),
+            "tasks": sum(len(s.tasks) for s in supervisors)
+                     + sum(1 for session in sessions for task in _session_tasks(session) if not task.done()),
+            "queued_items": sum(session.audio_input_queue.qsize() + session.input_queue.qsize()
+                                + session.output_queue.qsize() for session in sessions),
+            "mcp_leases": sum(1 for s in supervisors if s.mcp_manager),
+            "mcp_clients": sum(len(s.mcp_manager.clients) for s in supervisors if s.mcp_manager),
+            "asyncio_tasks": len(asyncio.all_tasks()),
+            "leaked_tasks": len(self.find_leaks()),
+            "rss_bytes": _rss_bytes(),
+        }
+
+
+# 全局注册表实例
+supervisor_registry = SupervisorRegistry()
+
+
+class SessionSupervisor:
+    """一个设备连接的资源所有者：后台任务、S2S会话（含其队列和上游流）和MCP租约，关闭时按固定顺序释放"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, websocket, device_manager, mcp_managers: Dict[str, UniversalMcpManager],
+                 registry: SupervisorRegistry = supervisor_registry, multiplexed: bool = False):
+        self.conn_id = next(self._ids)
+        self.websocket = websocket
+        # 网关连接上的一个设备通道：下行消息带channel字段，连接由网关持有
+        self.device_manager = device_manager
+        self.mcp_managers = mcp_managers
+        self.registry = registry
+        self.device_id: Optional[str] = None
+        self.session = None
+        self.mcp_manager: Optional[UniversalMcpManager] = None
+        self.multiplexed = multiplexed
+        # 会话状态：被重启的上一个会话（供新会话沿用历史）、响应转发任务、准入被拒后的等待期限
+        self.previous_session = None
+        self.forward_task: Optional[asyncio.Task] = None
+        self.busy_until = 0.0
+        self.tasks = set()
+        self.closed = False
+        # 已被同一设备的新连接替换
+        self.evicted = False
+        registry.live[self.conn_id] = self
+
+    def bind_device(self, device_id: str):
+        """连接认证为某个设备"""
+        self.device_id = device_id
+        self.registry.by_device[device_id] = self
+
+    def take_over(self, device_id: str) -> Optional['SessionSupervisor']:
+        """认证为设备；该设备在本进程已有连接时接管其S2S会话和MCP连接，返回被替换的连接。
+        登记和交接之间没有await，同一设备并发认证时只有一个连接会成为所有者"""
+        old = self.registry.by_device.get(device_id)
+        self.bind_device(device_id)
+        if old is None or old is self or old.closed:
+            return None
+        old.evicted = True
+        self.session, old.session = old.session, None
+        self.mcp_manager, old.mcp_manager = old.mcp_manager, None
+        return old
+
+    async def evict(self):
+        """被同一设备的新连接替换：停止转发并关闭旧连接，不再把设备标记为离线"""
+        self.evicted = True
+        if self._owns_device():
+            del self.registry.by_device[self.device_id]
+        for task in list(self.tasks):
+            await self.cancel(task)
+        # 关闭握手可能很慢（旧连接往往已经失联），不阻塞新连接
+        self.spawn(self._close_replaced(), "evict")
+
+    async def _close_replaced(self):
+        try:
+            await self.send({"type": "connection_replaced"})
+            if self.multiplexed:
+                # 只关闭网关上的这个通道
+                await self.close()
+            else:
+                await self.websocket.close(4000, "replaced by new connection")
+        except Exception:
+            pass
+
+    async def send(self, payload: Dict):
+        """向设备发送消息，网关通道的消息带上channel字段"""
+        if self.multiplexed:
+            payload["channel"] = self.device_id
+        await self.websocket.send(json.dumps(payload))
+
+    def spawn(self, coro, name: str) -> asyncio.Task:
+        """创建归属于本连接的任务，连接关闭时统一取消"""
+        task = asyncio.create_task(coro, name=f"conn-{self.conn_id}:{self.device_id}:{name}")
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def cancel(self, task: Optional[asyncio.Task]):
+        """取消并等待本连接的任务"""
+        if task and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def mcp_lease(self) -> UniversalMcpManager:
+        """本连接的MCP管理器，首次使用时创建并登记"""
+        if self.mcp_manager is None:
+            self.mcp_manager = UniversalMcpManager()
+        if not self.evicted:
+            self.mcp_managers[self.device_id] = self.mcp_manager
+        return self.mcp_manager
+
+    def attach_session(self, session):
+        """登记新的S2S会话；已被替换的连接只持有会话直到关闭"""
+        self.session = session
+        if not self.evicted:
+            self.device_manager.set_device_session(self.device_id, session)
+        return session
+
+    def detach_session(self):
+        """放弃当前会话（已被重启或已结束），返回该会话"""
+        session, self.session = self.session, None
+        if session is not None and not session.is_active:
+            self.registry.closed_sessions.add(session)
+        return session
+
+    def _owns_device(self) -> bool:
+        return self.device_id is not None and self.registry.by_device.get(self.device_id) is self
+
+    async def close(self):
+        """按顺序释放：转发等任务、S2S会话、设备会话登记、MCP连接、设备在线状态"""
+        if self.closed:
+            return
+        self.closed = True
+
+        current = asyncio.current_task()
+        for task in list(self.tasks):
+            if task is not current:
+                await self.cancel(task)
+
+        session, self.session = self.session, None
+        if session:
+            try:
+                await session.close()
+            except Exception as e:
+                logger.error(f"Error closing session for device {self.device_id}: {e}")
+            self.registry.closed_sessions.add(session)
+            if self.device_id and self.device_manager.get_device_session(self.device_id) is session:
+                self.device_manager.set_device_session(self.device_id, None)
+
+        if self.mcp_manager:
+            if self.mcp_managers.get(self.device_id) is self.mcp_manager:
+                del self.mcp_managers[self.device_id]
+            try:
+                await self.mcp_manager.cleanup_all()
+            except Exception as e:
+                logger.error(f"Error closing MCP servers for device {self.device_id}: {e}")
+            self.mcp_manager = None
+
+        if self._owns_device():
+            del self.registry.by_device[self.device_id]
+            await self.device_manager.unregister_device(self.device_id)
+
+        self.registry.live.pop(self.conn_id, None)
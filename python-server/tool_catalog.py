@@ -0,0 +1,93 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from database import db_manager
+
+logger = logging.getLogger(__name__)
+
+# 工具目录的有效期（秒），过期后MCP服务器下次连接时在后台刷新
+MCP_TOOL_CATALOG_TTL = float(os.getenv("MCP_TOOL_CATALOG_TTL", "3600"))
+
+# 决定服务器提供哪些工具的连接配置字段
+_CONNECTION_FIELDS = ('connection_type', 'command', 'args', 'env_vars', 'url', 'headers')
+
+
+def config_hash(server_config: dict) -> str:
+    """MCP服务器连接配置的哈希，连接配置不变时工具目录可以复用"""
+    fields = {}
+    for field in _CONNECTION_FIELDS:
+        value = server_config.get(field)
+        if isinstance(value, str) and field in ('args', 'env_vars', 'headers'):
+            try:
+                value = json.loads(value or 'null')
+            except ValueError:
+                pass
+        fields[field] = value
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+class McpToolCatalog:
+    """MCP服务器通过 list_tools 提供的工具目录，按连接配置哈希缓存，持久化在Postgres中。
+    工具列表变化时该目录的版本加一，引用它的工具配置随之重新生成"""
+
+    def __init__(self):
+        # 配置哈希 -> (目录版本, 工具列表, 获取时间)
+        self._entries: Dict[str, Tuple[int, List[Dict], float]] = {}
+
+    def _set(self, key: str, tools: List[Dict], fetched_at: float) -> bool:
+        revision, current, _ = self._entries.get(key, (0, None, 0.0))
+        changed = current != tools
+        self._entries[key] = (revision + 1 if changed else revision, tools, fetched_at)
+        return changed
+
+    def tools(self, server_config: dict) -> Optional[List[Dict]]:
+        entry = self._entries.get(config_hash(server_config))
+        return entry[1] if entry else None
+
+    def revision(self, server_config: dict) -> int:
+        entry = self._entries.get(config_hash(server_config))
+        return entry[0] if entry else 0
+
+    def is_stale(self, server_config: dict) -> bool:
+        """没有目录或目录已过期"""
+        entry = self._entries.get(config_hash(server_config))
+        return entry is None or time.time() - entry[2] > MCP_TOOL_CATALOG_TTL
+
+    async def store(self, server_config: dict, tools: List[Dict]):
+        """记录服务器刚返回的工具列表并写入数据库（其他进程通过变更通知加载）"""
+        key = config_hash(server_config)
+        if self._set(key, tools, time.time()):
+            logger.info(f"MCP tool catalog for '{server_config.get('name')}' updated: {len(tools)} tools")
+        try:
+            await db_manager.save_tool_catalog(key, server_config.get('id'), server_config.get('name'), tools)
+        except Exception as e:
+            logger.error(f"Failed to persist MCP tool catalog for '{server_config.get('name')}': {e}")
+
+    async def load(self, key: Optional[str] = None):
+        """从数据库加载全部目录（启动或监听重连时）或单个目录（变更通知）"""
+        for row in await db_manager.get_tool_catalogs(key):
+            tools = json.loads(row['tools']) if isinstance(row['tools'], str) else row['tools']
+            self._set(row['config_hash'], tools, row['fetched_at'].timestamp())
+
+
+# 全局工具目录实例
+mcp_tool_catalog = McpToolCatalog()
+
+
+def tool_spec(name: str, description: str, input_schema) -> Dict:
+    """Nova Sonic 的 toolSpec，inputSchema 以JSON字符串传递"""
+    if not isinstance(input_schema, str):
+        input_schema = json.dumps(input_schema)
+    return {
+        "toolSpec": {
+            "name": name,
+            "description": description,
+            "inputSchema": {
+                "json": input_schema
+            }
+        }
+    }
@@ -0,0 +1,175 @@
+import json
+import logging
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 发送给模型的工具结果（toolResult 的 content）大小上限（字节，约4字节一个token），
+# MCP服务器可在 mcp_servers.max_result_bytes 中单独设置
+TOOL_RESULT_MAX_BYTES = int(os.getenv("TOOL_RESULT_MAX_BYTES", "4096"))
+# 按该比例抽样记录工具结果（只记录前 TOOL_RESULT_LOG_CHARS 个字符）
+TOOL_RESULT_LOG_SAMPLE = float(os.getenv("TOOL_RESULT_LOG_SAMPLE", "0.01"))
+TOOL_RESULT_LOG_CHARS = int(os.getenv("TOOL_RESULT_LOG_CHARS", "500"))
+
+
+def _encode(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+def _parse_json(value):
+    """MCP的文本结果经常是JSON字符串，解析后才能按字段投影和截断；不是JSON时原样返回"""
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+def parse_result_fields(value) -> List[str]:
+    """解析结果字段投影规则：字段路径的JSON数组（或其字符串形式），格式不对时抛出 ValueError"""
+    invalid = ValueError('result_fields must be a JSON array of field paths, e.g. ["bookings.date"]')
+    try:
+        while isinstance(value, str):
+            value = json.loads(value) if value.strip() else None
+    except ValueError:
+        raise invalid from None
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(field, str) and field.strip() for field in value):
+        raise invalid
+    return [field.strip() for field in value]
+
+
+def result_fields(server_config: Optional[dict]) -> List[str]:
+    """服务器配置的结果字段投影规则（mcp_servers.result_fields），如 ["bookings.date", "bookings.guest.name"]；
+    规则无效时不投影"""
+    try:
+        return parse_result_fields((server_config or {}).get('result_fields'))
+    except ValueError as e:
+        logger.warning(f"Ignoring invalid result_fields of MCP server '{(server_config or {}).get('name')}': {e}")
+        return []
+
+
+def _field_tree(fields: List[str]) -> Dict:
+    """["a.b", "a.c", "d"] -> {"a": {"b": {}, "c": {}}, "d": {}}"""
+    tree = {}
+    for path in fields:
+        node = tree
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def project(value, tree: Dict):
+    """只保留字段树中的字段，列表按元素逐个投影；叶子字段保留整个值"""
+    if not tree:
+        return value
+    value = _parse_json(value)
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    return value
+
+
+def _shrink(value, max_chars: int, max_items: int):
+    """截断过长的字符串、列表和对象，并注明省略了多少"""
+    if isinstance(value, str):
+        if len(value) > max_chars:
+            return value[:max_chars] + f"…[{len(value) - max_chars} more chars]"
+        return value
+    if isinstance(value, list):
+        items = [_shrink(item, max_chars, max_items) for item in value[:max_items]]
+        if len(value) > max_items:
+            items.append(f"…[{len(value) - max_items} more items]")
+        return items
+    if isinstance(value, dict):
+        fields = {key: _shrink(item, max_chars, max_items) for key, item in list(value.items())[:max_items]}
+        if len(value) > max_items:
+            fields["…"] = f"{len(value) - max_items} more fields"
+        return fields
+    return value
+
+
+def fit(result: Dict, budget: int) -> Tuple[str, bool]:
+    """把 {"result": ...} 序列化到 budget 字节以内：先按结构逐步截断字符串和列表，仍然超出时截断整段文本。
+    返回序列化结果和是否截断"""
+    text = _encode(result)
+    if len(text.encode('utf-8')) <= budget:
+        return text, False
+
+    value = result.get('result')
+    value = [_parse_json(item) for item in value] if isinstance(value, list) else _parse_json(value)
+    max_chars, max_items = budget, max(1, budget // 8)
+    while max_chars >= 16:
+        text = _encode({"result": _shrink(value, max_chars, max_items)})
+        if len(text.encode('utf-8')) <= budget:
+            return text, True
+        max_chars //= 2
+        max_items = max(1, max_items // 2)
+
+    # 结构本身放不下（如字段很多的对象）：截断整段文本
+    return _truncate(value, budget), True
+
+
+def _truncate(value, budget: int) -> str:
+    """把结果当作一段文本截断到 budget 字节以内"""
+    flat = value if isinstance(value, str) else _encode(value)
+    flat = flat.encode('utf-8')[:max(0, budget - 48)].decode('utf-8', 'ignore')
+    return _encode({"result": flat + "…[truncated]"})
+
+
+class ToolResultStats:
+    """按工具统计结果大小（原始大小、发送大小、截断次数）"""
+
+    def __init__(self):
+        self.tools: Dict[str, Dict] = {}
+
+    def record(self, tool_name: str, raw_bytes: int, sent_bytes: int, truncated: bool):
+        stats = self.tools.get(tool_name)
+        if stats is None:
+            stats = self.tools[tool_name] = {"calls": 0, "raw_bytes": 0, "sent_bytes": 0, "max_raw_bytes": 0, "truncated": 0}
+        stats["calls"] += 1
+        stats["raw_bytes"] += raw_bytes
+        stats["sent_bytes"] += sent_bytes
+        stats["max_raw_bytes"] = max(stats["max_raw_bytes"], raw_bytes)
+        stats["truncated"] += int(truncated)
+
+    def stats(self) -> Dict:
+        return {
+            tool_name: dict(stats,
+                            avg_raw_bytes=stats["raw_bytes"] // stats["calls"],
+                            avg_sent_bytes=stats["sent_bytes"] // stats["calls"])
+            for tool_name, stats in self.tools.items()
+        }
+
+
+# 全局工具结果统计
+tool_result_stats = ToolResultStats()
+
+
+def encode_tool_result(tool_name: str, result: Dict, server_config: Optional[dict] = None) -> str:
+    """生成 toolResult 的 content：按服务器的规则投影字段，限制在结果预算内，并记录大小统计。
+    投影或截断出错时退回到未投影、直接截断的文本，保证模型总能收到结果"""
+    raw_bytes = len(_encode(result).encode('utf-8'))
+    try:
+        budget = int((server_config or {}).get('max_result_bytes') or TOOL_RESULT_MAX_BYTES)
+        fields = result_fields(server_config)
+        projected = {"result": project(result['result'], _field_tree(fields))} if fields and 'result' in result else result
+        text, truncated = fit(projected, budget)
+    except Exception as e:
+        logger.warning(f"Failed to shape result of tool {tool_name}, sending it truncated: {e}")
+        text = _encode(result)
+        truncated = len(text.encode('utf-8')) > TOOL_RESULT_MAX_BYTES
+        if truncated:
+            text = _truncate(result.get('result', result), TOOL_RESULT_MAX_BYTES)
+    sent_bytes = len(text.encode('utf-8'))
+    tool_result_stats.record(tool_name, raw_bytes, sent_bytes, truncated)
+
+    if random.random() < TOOL_RESULT_LOG_SAMPLE:
+        logger.info(f"Tool result {tool_name}: {raw_bytes} bytes -> {sent_bytes} bytes"
+                    f"{' (truncated)' if truncated else ''}: {text[:TOOL_RESULT_LOG_CHARS]}")
+    return text
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerIpc:
+    """同一节点上多个工作进程之间的本地IPC通道（Unix域套接字，每行一个JSON消息）"""
+
+    def __init__(self, worker_id: int, worker_count: int, ipc_dir: str):
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+        self.ipc_dir = ipc_dir
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.handler: Optional[Callable[[Dict], Awaitable[Dict]]] = None
+        self._socket_inode: Optional[int] = None
+
+    def socket_path(self, worker_id: int) -> str:
+        """工作进程的套接字路径"""
+        return os.path.join(self.ipc_dir, f"worker-{worker_id}.sock")
+
+    async def start(self, handler: Callable[[Dict], Awaitable[Dict]]):
+        """开始监听本进程的IPC套接字"""
+        self.handler = handler
+        os.makedirs(self.ipc_dir, exist_ok=True)
+        path = self.socket_path(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self._serve, path=path)
+        self._socket_inode = os.stat(path).st_ino
+        logger.info(f"Worker {self.worker_id} IPC listening at {path}")
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                response = await self.handler(json.loads(line))
+            except Exception as e:
+                logger.error(f"IPC handler error: {e}")
+                response = {"error": str(e)}
+            response.setdefault("worker_id", self.worker_id)
+            writer.write(json.dumps(response).encode('utf-8') + b"\n")
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def request(self, worker_id: int, message: Dict, timeout: float = 5.0) -> Optional[Dict]:
+        """向指定工作进程发送请求，失败时返回None"""
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_unix_connection(self.socket_path(worker_id)), timeout
+            )
+            try:
+                writer.write(json.dumps(message).encode('utf-8') + b"\n")
+                await writer.drain()
+                line = await asyncio.wait_for(reader.readline(), timeout)
+                return json.loads(line) if line else None
+            finally:
+                writer.close()
+        except (OSError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"IPC request to worker {worker_id} failed: {e}")
+            return None
+
+    async def broadcast(self, message: Dict, timeout: float = 5.0) -> List[Dict]:
+        """向其他所有工作进程发送请求，返回成功的响应"""
+        others = [i for i in range(self.worker_count) if i != self.worker_id]
+        responses = await asyncio.gather(*(self.request(i, message, timeout) for i in others))
+        return [response for response in responses if response is not None]
+
+    async def close(self):
+        """停止监听并删除套接字文件"""
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        # 滚动重启时新进程已在同一路径上监听，只删除自己创建的套接字文件
+        path = self.socket_path(self.worker_id)
+        try:
+            if os.stat(path).st_ino == self._socket_inode:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
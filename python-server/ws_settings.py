@@ -0,0 +1,82 @@
+import os
+from typing import Dict
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate, ServerPerMessageDeflateFactory
+from websockets.frames import CTRL_OPCODES, OP_CONT
+
+# WebSocket保活：每隔 WS_PING_INTERVAL 秒发送ping，WS_PING_TIMEOUT 秒内无pong视为断线（0 表示关闭）
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_PING_TIMEOUT = float(os.getenv("WS_PING_TIMEOUT", "20"))
+WS_OPEN_TIMEOUT = float(os.getenv("WS_OPEN_TIMEOUT", "10"))
+WS_CLOSE_TIMEOUT = float(os.getenv("WS_CLOSE_TIMEOUT", "10"))
+# 单条消息上限（字节）和每个连接缓冲的接收帧数
+WS_MAX_SIZE = int(os.getenv("WS_MAX_SIZE", str(256 * 1024)))
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "16"))
+# 读空闲超时：未认证连接必须在 WS_AUTH_TIMEOUT 秒内认证，已认证连接 WS_IDLE_TIMEOUT 秒无消息即关闭（0 表示不限制）
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "15"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "0"))
+# 压缩：selective（音频不压缩，其他消息压缩）、deflate（全部压缩）、none
+WS_COMPRESSION = os.getenv("WS_COMPRESSION", "selective").lower()
+
+# 音频消息的标记，出现在消息开头附近
+_AUDIO_MARKERS = (b'"audioOutput"', b'"audioInput"')
+
+
+class SelectivePerMessageDeflate(PerMessageDeflate):
+    """音频消息不压缩（base64编码的PCM压缩率低且耗CPU），其他消息照常压缩。
+    RFC 7692 按消息设置RSV1位，未压缩的消息对端直接按原文处理"""
+
+    _skip_message = False
+
+    def encode(self, frame):
+        if frame.opcode in CTRL_OPCODES:
+            return frame
+        if frame.opcode is not OP_CONT:
+            head = bytes(frame.data[:64])
+            self._skip_message = any(marker in head for marker in _AUDIO_MARKERS)
+        if self._skip_message:
+            return frame
+        return super().encode(frame)
+
+
+class SelectiveDeflateFactory(ServerPerMessageDeflateFactory):
+    """协商permessage-deflate，但使用按消息类型选择是否压缩的扩展"""
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        extension.__class__ = SelectivePerMessageDeflate
+        return response_params, extension
+
+
+def _timeout(value: float):
+    return value if value > 0 else None
+
+
+def serve_options() -> Dict:
+    """websockets.serve 的连接参数"""
+    options = {
+        "ping_interval": _timeout(WS_PING_INTERVAL),
+        "ping_timeout": _timeout(WS_PING_TIMEOUT),
+        "open_timeout": _timeout(WS_OPEN_TIMEOUT),
+        "close_timeout": _timeout(WS_CLOSE_TIMEOUT),
+        "max_size": WS_MAX_SIZE or None,
+        "max_queue": WS_MAX_QUEUE or None,
+    }
+    if WS_COMPRESSION == "selective":
+        # 与websockets默认的deflate参数一致
+        options["compression"] = None
+        options["extensions"] = [SelectiveDeflateFactory(
+            server_max_window_bits=12,
+            client_max_window_bits=12,
+            compress_settings={"memLevel": 5},
+        )]
+    elif WS_COMPRESSION == "none":
+        options["compression"] = None
+    else:
+        options["compression"] = "deflate"
+    return options
+
+
+def read_timeout(authenticated: bool):
+    """当前连接状态下等待下一条消息的最长秒数"""
+    return _timeout(WS_IDLE_TIMEOUT if authenticated else WS_AUTH_TIMEOUT)
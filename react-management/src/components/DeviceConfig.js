@@ -186,6 +186,19 @@ const DeviceConfig = ({ deviceId, onClose }) => {
                             }}
                         />
                     </FormField>
+                    <FormField 
+                        label="空闲释放时间（秒）"
+                        description="无语音活动超过该时长后释放模型连接，0 表示不释放"
+                    >
+                        <Input
+                            type="number"
+                            value={config.idle_timeout || 0}
+                            onChange={({ detail }) => {
+                                const value = parseInt(detail.value);
+                                updateConfig('idle_timeout', isNaN(value) || value < 0 ? 0 : value);
+                            }}
+                        />
+                    </FormField>
                 </ColumnLayout>
             </Container>
         </SpaceBetween>
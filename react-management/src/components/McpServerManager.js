@@ -9,7 +9,9 @@ import {
     Textarea,
     Alert,
     Box,
-    Select
+    Select,
+    Checkbox,
+    ExpandableSection
 } from '@cloudscape-design/components';
 import deviceApi from '../services/deviceApi';
 
@@ -19,6 +21,7 @@ const McpServerManager = ({ visible, onClose }) => {
     const [showModal, setShowModal] = useState(false);
     const [editingServer, setEditingServer] = useState(null);
     const [alert, setAlert] = useState(null);
+    const [serverTools, setServerTools] = useState({});
     const [formData, setFormData] = useState({
         name: '',
         connection_type: 'stdio',
@@ -29,7 +32,13 @@ const McpServerManager = ({ visible, onClose }) => {
         headers: '{}',
         description: '',
         tool_name: '',
-        tool_description: ''
+        tool_description: '',
+        call_timeout: '',
+        max_in_flight: '',
+        replicas: 1,
+        eager: false,
+        max_result_bytes: '',
+        result_fields: '[]'
     });
 
     const connectionTypes = [
@@ -54,21 +63,90 @@ const McpServerManager = ({ visible, onClose }) => {
         }
     };
 
+    const parseResultFields = (value) => {
+        let fields = value;
+        if (typeof fields === 'string') {
+            if (!fields.trim()) {
+                return [];
+            }
+            try {
+                fields = JSON.parse(fields);
+            } catch (error) {
+                return null;
+            }
+        }
+        if (fields == null) {
+            return [];
+        }
+        if (!Array.isArray(fields) || !fields.every(field => typeof field === 'string' && field.trim())) {
+            return null;
+        }
+        return fields.map(field => field.trim());
+    };
+
     const handleSave = async () => {
+        const resultFields = parseResultFields(formData.result_fields);
+        if (resultFields === null) {
+            setAlert('Failed to save MCP server: 结果字段必须是字段路径的JSON数组，例如 ["bookings.date"]');
+            return;
+        }
+        const serverData = {...formData, result_fields: resultFields};
         try {
             if (editingServer) {
-                await deviceApi.updateMcpServer(editingServer.id, formData);
+                await deviceApi.updateMcpServer(editingServer.id, serverData);
             } else {
-                await deviceApi.createMcpServer(formData);
+                await deviceApi.createMcpServer(serverData);
             }
             setAlert('MCP server saved successfully');
             setShowModal(false);
+            // 连接配置变化后工具目录可能不同，展开时重新获取
+            setServerTools({});
             await loadServers();
         } catch (error) {
             setAlert(`Failed to save MCP server: ${error.message}`);
         }
     };
 
+    const loadServerTools = async (serverId) => {
+        if (serverTools[serverId] && !serverTools[serverId].error) {
+            return;
+        }
+        setServerTools(prev => ({...prev, [serverId]: {loading: true}}));
+        try {
+            const data = await deviceApi.getMcpServerTools(serverId);
+            setServerTools(prev => ({...prev, [serverId]: {catalogs: data.catalogs || []}}));
+        } catch (error) {
+            setServerTools(prev => ({...prev, [serverId]: {error: error.message}}));
+        }
+    };
+
+    const renderServerTools = (serverId) => {
+        const entry = serverTools[serverId];
+        if (!entry || entry.loading) {
+            return <Box variant="small">正在加载工具列表...</Box>;
+        }
+        if (entry.error) {
+            return <Box variant="small" color="text-status-error">加载工具列表失败：{entry.error}</Box>;
+        }
+        // 最近获取的目录在前；服务器尚未被连接过时没有目录
+        const catalog = entry.catalogs[0];
+        if (!catalog || !catalog.tools.length) {
+            return <Box variant="small" color="text-body-secondary">暂无工具目录（服务器首次连接后获取）</Box>;
+        }
+        return (
+            <SpaceBetween direction="vertical" size="xxs">
+                <Box variant="small" color="text-body-secondary">
+                    {catalog.tools.length} 个工具，获取于 {new Date(catalog.fetched_at).toLocaleString()}
+                </Box>
+                {catalog.tools.map(tool => (
+                    <Box key={tool.name} variant="small">
+                        <strong>{tool.name}</strong>{tool.description ? `：${tool.description}` : ''}
+                    </Box>
+                ))}
+            </SpaceBetween>
+        );
+    };
+
     const handleDelete = async (serverId) => {
         if (!window.confirm('确定要删除这个MCP服务器吗？此操作不可恢复。')) {
             return;
@@ -95,7 +173,13 @@ const McpServerManager = ({ visible, onClose }) => {
             headers: '{}',
             description: '',
             tool_name: '',
-            tool_description: ''
+            tool_description: '',
+            call_timeout: '',
+            max_in_flight: '',
+            replicas: 1,
+            eager: false,
+            max_result_bytes: '',
+            result_fields: '[]'
         });
         setShowModal(true);
     };
@@ -148,12 +232,23 @@ const McpServerManager = ({ visible, onClose }) => {
                                         <Box variant="small" color="text-body-secondary">
                                             {server.connection_type?.toUpperCase()} | {server.tool_name || '未命名'}
                                         </Box>
+                                        {server.breaker && server.breaker.state !== 'closed' && (
+                                            <Box variant="small" color="text-status-error">
+                                                熔断中（{server.breaker.state}，{server.breaker.workers_tripped}/{server.breaker.workers} 个工作进程）{server.breaker.last_error ? `：${server.breaker.last_error}` : ''}
+                                            </Box>
+                                        )}
                                     </Box>
                                     <SpaceBetween direction="horizontal" size="xs">
                                         <Button size="small" onClick={() => openModal(server)}>编辑</Button>
                                         <Button size="small" onClick={() => handleDelete(server.id)}>删除</Button>
                                     </SpaceBetween>
                                 </SpaceBetween>
+                                <ExpandableSection
+                                    headerText="工具列表"
+                                    onChange={({ detail }) => detail.expanded && loadServerTools(server.id)}
+                                >
+                                    {renderServerTools(server.id)}
+                                </ExpandableSection>
                             </Box>
                         ))}
                     </SpaceBetween>
@@ -278,6 +373,79 @@ const McpServerManager = ({ visible, onClose }) => {
                             />
                         </FormField>
 
+                        <FormField 
+                            label="调用超时（秒）"
+                            description="单次工具调用的最长等待时间，留空使用服务器默认值（MCP_CALL_TIMEOUT）"
+                        >
+                            <Input
+                                type="number"
+                                value={formData.call_timeout == null ? '' : String(formData.call_timeout)}
+                                onChange={({ detail }) => setFormData({...formData, call_timeout: detail.value})}
+                                placeholder="15"
+                            />
+                        </FormField>
+
+                        <FormField 
+                            label="启动方式"
+                            description="默认在模型首次调用此服务器的工具时才连接；延迟敏感的工具可以在会话开始时预先连接"
+                        >
+                            <Checkbox
+                                checked={formData.eager || false}
+                                onChange={({ detail }) => setFormData({...formData, eager: detail.checked})}
+                            >
+                                会话开始时立即连接
+                            </Checkbox>
+                        </FormField>
+
+                        <FormField 
+                            label="并发调用上限"
+                            description="每个服务器进程同时执行的调用数，超出的调用排队（超过调用期限则直接提示稍后再试）；留空使用默认值（MCP_MAX_IN_FLIGHT）"
+                        >
+                            <Input
+                                type="number"
+                                value={formData.max_in_flight == null ? '' : String(formData.max_in_flight)}
+                                onChange={({ detail }) => setFormData({...formData, max_in_flight: detail.value})}
+                                placeholder="4"
+                            />
+                        </FormField>
+
+                        {formData.connection_type === 'stdio' && (
+                            <FormField 
+                                label="副本进程数"
+                                description="启动多个相同的服务器进程分担调用"
+                            >
+                                <Input
+                                    type="number"
+                                    value={formData.replicas == null ? '1' : String(formData.replicas)}
+                                    onChange={({ detail }) => setFormData({...formData, replicas: detail.value})}
+                                />
+                            </FormField>
+                        )}
+
+                        <FormField 
+                            label="结果大小上限（字节）"
+                            description="发送给模型的工具结果超出时按结构截断（约4字节一个token）；留空使用默认值（TOOL_RESULT_MAX_BYTES）"
+                        >
+                            <Input
+                                type="number"
+                                value={formData.max_result_bytes == null ? '' : String(formData.max_result_bytes)}
+                                onChange={({ detail }) => setFormData({...formData, max_result_bytes: detail.value})}
+                                placeholder="4096"
+                            />
+                        </FormField>
+
+                        <FormField 
+                            label="结果字段 (JSON数组)"
+                            description="JSON结果只保留这些字段（点号表示嵌套字段，列表按元素处理）；空数组保留全部字段"
+                        >
+                            <Textarea
+                                value={typeof formData.result_fields === 'string' ? formData.result_fields : JSON.stringify(formData.result_fields || [])}
+                                onChange={({ detail }) => setFormData({...formData, result_fields: detail.value})}
+                                placeholder='["bookings.date", "bookings.guest.name"]'
+                                rows={2}
+                            />
+                        </FormField>
+
                         <FormField 
                             label="详细说明"
                             description="对此MCP服务器的详细描述，供管理员参考"
@@ -184,6 +184,13 @@ class DeviceAPI {
         });
     }
 
+    async getMcpServerTools(serverId) {
+        if (!serverId) {
+            throw new Error('Server ID is required');
+        }
+        return this.request(`/api/mcp-servers/${serverId}/tools`);
+    }
+
     async deleteMcpServer(serverId) {
         if (!serverId) {
             throw new Error('Server ID is required');